@@ -0,0 +1,184 @@
+'''Corpus-level aggregation of tracking results.
+
+tracker_analysis.tht_grid estimates a (rho, delta) density from the points of
+a single tracking result, and tht_tracking_conf its mean top confidence. A
+DensityAccumulator keeps their unnormalized sums instead, so that results can
+be added one at a time and discarded, and accumulators built in different
+processes can be merged by adding their sums. aggregate runs this as a
+map-reduce over tracking pickles: each file is accumulated in a worker
+process and the parent merges the accumulators as they arrive.
+'''
+
+import multiprocessing
+import pickle
+
+import numpy as np
+from scipy.stats import norm
+
+from m2.tht import tracker_analysis
+
+
+class DensityAccumulator():
+    '''
+    Unnormalized (rho, delta) density and tracking confidence of a set of
+    tracking results.
+
+    grid() is, for a single result, tht_grid of it, and for several, the
+    tht_grid of all of their points together.
+
+    Args:
+        delta_samples, rho_samples: grid of the density, defaults to
+            tracker_analysis.ht_grid
+        delta_sigma, rho_sigma: see tracker_analysis.ht_weighted_distribution
+
+    Interal Variables
+        sums: (len(delta_samples), len(rho_samples)) array of the weighted
+            sums of the points on each grid point
+        points: amount of points added
+        results: amount of results added
+        conf_sum: sum of the tracking confidences of the results
+        conf_count: amount of results with a tracking confidence
+    '''
+
+    def __init__(self, delta_samples=None, rho_samples=None,
+                 delta_sigma=25, rho_sigma=0.1):
+        if delta_samples is None or rho_samples is None:
+            default_delta, default_rho = tracker_analysis.ht_grid()
+            if delta_samples is None:
+                delta_samples = default_delta
+            if rho_samples is None:
+                rho_samples = default_rho
+        self.delta_samples = np.asarray(delta_samples, dtype=float)
+        self.rho_samples = np.asarray(rho_samples, dtype=float)
+        self.delta_sigma = delta_sigma
+        self.rho_sigma = rho_sigma
+        self.sums = np.zeros((len(self.delta_samples),
+                              len(self.rho_samples)))
+        self.points = 0
+        self.results = 0
+        self.conf_sum = 0.0
+        self.conf_count = 0
+
+    def add_points(self, points):
+        '''
+        Adds (delta, rho, conf) points, see tracker_analysis.tht_ht_points.
+        '''
+        if len(points) == 0:
+            return
+        deltas, rhos, confs = np.array(points, dtype=float).T
+        d_weight = norm.pdf(deltas[np.newaxis, :],
+                            loc=self.delta_samples[:, np.newaxis],
+                            scale=self.delta_sigma)
+        r_weight = norm.pdf(rhos[np.newaxis, :],
+                            loc=self.rho_samples[:, np.newaxis],
+                            scale=self.rho_sigma)
+        self.sums += np.dot(d_weight * confs, r_weight.T)
+        self.points += len(points)
+
+    def add(self, hts, onset_count=None):
+        '''
+        Adds a tracking result.
+
+        Args:
+            hts: dict :: hypothesis_name -> HypothesisTracker
+            onset_count: see tracker_analysis.tht_tracking_confs
+        '''
+        self.add_points(tracker_analysis.tht_ht_points(hts))
+        self.results += 1
+        if any(ht.confs for ht in hts.values()):
+            confs = tracker_analysis.tht_tracking_confs(hts, onset_count)
+            if confs:
+                self.conf_sum += np.mean([c for _, c in confs])
+                self.conf_count += 1
+        return self
+
+    def _check_compatible(self, other):
+        if (not np.array_equal(self.delta_samples, other.delta_samples) or
+                not np.array_equal(self.rho_samples, other.rho_samples) or
+                self.delta_sigma != other.delta_sigma or
+                self.rho_sigma != other.rho_sigma):
+            raise ValueError('Accumulators have different grids')
+
+    def merge(self, other):
+        'Adds the results of other, an accumulator over the same grid'
+        self._check_compatible(other)
+        self.sums += other.sums
+        self.points += other.points
+        self.results += other.results
+        self.conf_sum += other.conf_sum
+        self.conf_count += other.conf_count
+        return self
+
+    def grid(self):
+        '''
+        Normalized density, as tracker_analysis.tht_grid.
+
+        Returns:
+            (n x 3) array with columns as: rho_value, delta_value and conf
+        '''
+        deltas, rhos = np.meshgrid(self.delta_samples, self.rho_samples,
+                                   indexing='ij')
+        weights = self.sums / self.sums.sum()
+        return np.column_stack([rhos.ravel(), deltas.ravel(),
+                                weights.ravel()])
+
+    def tracking_conf(self):
+        'Mean tht_tracking_conf of the results'
+        if self.conf_count == 0:
+            return np.nan
+        return self.conf_sum / self.conf_count
+
+
+def _load(filename):
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+_options = {}
+
+
+def _init_worker(options):
+    global _options
+    _options = options
+
+
+def _run_job(filename):
+    accumulator = DensityAccumulator(**_options)
+    return filename, accumulator.add(_load(filename))
+
+
+def aggregate(filenames, processes=None, on_result=None, **options):
+    '''
+    Accumulates tracking pickles (see the full modality) over a process
+    pool.
+
+    Args:
+        filenames: tracking pickle filenames
+        processes: size of the process pool. None uses a process per cpu and
+            1 runs all files in the current process.
+        on_result: callable called with (filename, accumulator of the file)
+            as soon as each file is accumulated
+        options: DensityAccumulator arguments
+
+    Returns:
+        DensityAccumulator of all the files
+    '''
+    total = DensityAccumulator(**options)
+
+    def collect(results):
+        for filename, accumulator in results:
+            if on_result is not None:
+                on_result(filename, accumulator)
+            total.merge(accumulator)
+
+    if processes == 1:
+        _init_worker(options)
+        try:
+            collect(map(_run_job, filenames))
+        finally:
+            _init_worker({})
+    else:
+        with multiprocessing.Pool(processes, _init_worker,
+                                  (options,)) as pool:
+            collect(pool.imap_unordered(_run_job, filenames))
+    return total
@@ -0,0 +1,184 @@
+'''Approximate tracking mode, trading accuracy for speed.
+
+The approximate mode combines:
+    * quantized onset times: onsets are rounded to a time resolution and
+      merged when they fall on the same value, reducing the onset pairs that
+      originate hypotheses in dense passages (chords, ornaments).
+    * sparse correction: hypotheses are corrected only every few onsets (see
+      SparseCorrection). In between, a hypothesis keeps its period and its
+      phase is extrapolated along it.
+    * a smaller window for both the evaluation and the correction.
+
+accuracy_report runs the exact and the approximate modes on the same onsets
+and measures how much the approximation diverges next to the speedup.
+'''
+
+import time
+
+import numpy as np
+
+from m2.tht import confidence
+from m2.tht import correction
+from m2.tht import evaluation
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import tracker_analysis
+
+
+class SparseCorrection():
+    '''
+    Correction function that corrects hypotheses with corr_f only every
+    `every` onsets (and on the first update of each hypothesis). On the rest
+    of the onsets the hypothesis is kept unchanged, so its projection
+    extrapolates the last corrected phase with the last corrected period.
+
+    Args:
+        corr_f: correction function
+        every: amount of onsets between corrections
+    '''
+
+    def __init__(self, corr_f, every=4):
+        self.corr_f = corr_f
+        self.every = every
+        self.window = getattr(corr_f, 'window', None)
+
+    def __call__(self, ht, ongoing_play):
+        if ht.corr and ongoing_play.discovered_index % self.every:
+            return correction.HypothesisCorrection(o_rho=ht.r, o_delta=ht.d,
+                                                   n_rho=ht.r, n_delta=ht.d)
+        return self.corr_f(ht, ongoing_play)
+
+
+def quantize_onsets(onset_times, resolution=10):
+    '''
+    Rounds onset times to multiples of resolution, merging equal onsets.
+
+    Args:
+        onset_times: [ms]
+        resolution: ms
+
+    Returns:
+        sorted np.array of unique onset times
+    '''
+    onset_times = np.asarray(onset_times, dtype=float)
+    return np.unique(np.round(onset_times / resolution) * resolution)
+
+
+def approximate_tht(window=4000, correct_every=4, **kwargs):
+    '''
+    Returns a TactusHypothesisTracker configured for the approximate mode:
+    the default evaluation and correction over a smaller window, with a
+    correction every correct_every onsets. Other default configuration
+    values may be overriden with kwargs (see defaults.config).
+    '''
+    corr_f = correction.WindowedCorrection(correction.windowed_corr.mult,
+                                           correction.windowed_corr.decay,
+                                           window)
+    config = {
+        'eval_f': confidence.WindowedExpEval(window),
+        'corr_f': SparseCorrection(corr_f, correct_every)
+    }
+    config.update(kwargs)
+    return tactus_hypothesis_tracker.default_tht(**config)
+
+
+def approximate_track(tracker, onset_times, resolution=10):
+    '''
+    Tracks the quantized onset_times.
+
+    Returns:
+        (quantized onsets, dict :: hypothesis_name -> HypothesisTracker)
+    '''
+    onsets = quantize_onsets(onset_times, resolution)
+    return onsets, tracker(onsets)
+
+
+def _top_periods(top):
+    'Onset indexes and corrected periods of top hypotheses'
+    return (np.array([idx for idx, _ in top], dtype=int),
+            np.array([dict(ht.corr)[idx].n_delta for idx, ht in top]))
+
+
+def accuracy_report(onset_times, exact=None, approximate=None, resolution=10,
+                    beat_tolerance=70, period_tolerance=0.05):
+    '''
+    Tracks onset_times in exact and approximate modes, measuring the
+    divergence of the approximation and the speedup.
+
+    Args:
+        onset_times: sorted [ms]
+        exact: exact mode tracker, defaults to default_tht()
+        approximate: approximate mode tracker, defaults to approximate_tht()
+        resolution: ms of the approximate mode onset quantization
+        beat_tolerance: ms within which beats are considered equal
+        period_tolerance: relative period difference within which top
+            hypotheses are considered to agree
+
+    Returns:
+        dict with
+            onsets, approximate_onsets: amount of onsets tracked by each mode
+            exact_time, approximate_time: seconds taken by each mode
+            speedup: exact_time / approximate_time
+            beat_f_measure: F-measure of the approximate beats against the
+                exact beats
+            top_agreement: fraction of the onsets where the top hypotheses
+                of both modes agree on period
+            top_agreement_curve: [(ms, bool)] agreement over time
+            congruence_error: mean absolute difference between the
+                congruence curves (the top confidence over time)
+    '''
+    if exact is None:
+        exact = tactus_hypothesis_tracker.default_tht()
+    if approximate is None:
+        approximate = approximate_tht()
+    onset_times = np.asarray(onset_times, dtype=float)
+
+    start = time.perf_counter()
+    exact_hts = exact(onset_times)
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    q_onsets, approx_hts = approximate_track(approximate, onset_times,
+                                             resolution)
+    approximate_time = time.perf_counter() - start
+
+    exact_top = tracker_analysis.top_hypothesis(exact_hts, len(onset_times))
+    approx_top = tracker_analysis.top_hypothesis(approx_hts, len(q_onsets))
+    exact_beats = (tracker_analysis.produce_beats_information(
+        onset_times, exact_top) if exact_top else [])
+    approx_beats = (tracker_analysis.produce_beats_information(
+        q_onsets, approx_top) if approx_top else [])
+
+    # Each exact onset is compared with the approximate tracking at the last
+    # approximate onset not after it.
+    e_idx, e_periods = _top_periods(exact_top)
+    a_idx, a_periods = _top_periods(approx_top)
+    curve = []
+    conf_errors = []
+    if len(e_idx) and len(a_idx):
+        a_times = q_onsets[a_idx]
+        pos = np.searchsorted(a_times, onset_times[e_idx], side='right') - 1
+        valid = pos >= 0
+        agree = (np.abs(a_periods[pos] - e_periods) <=
+                 period_tolerance * e_periods)
+        curve = [(float(t), bool(a))
+                 for t, a in zip(onset_times[e_idx][valid], agree[valid])]
+
+        e_confs = np.array([dict(ht.confs)[idx] for idx, ht in exact_top])
+        a_confs = np.array([dict(ht.confs)[idx] for idx, ht in approx_top])
+        conf_errors = np.abs(a_confs[pos[valid]] - e_confs[valid])
+
+    return {
+        'onsets': len(onset_times),
+        'approximate_onsets': len(q_onsets),
+        'exact_time': exact_time,
+        'approximate_time': approximate_time,
+        'speedup': (exact_time / approximate_time
+                    if approximate_time > 0 else np.nan),
+        'beat_f_measure': evaluation.f_measure(exact_beats, approx_beats,
+                                               beat_tolerance),
+        'top_agreement': (np.mean([a for _, a in curve])
+                          if curve else np.nan),
+        'top_agreement_curve': curve,
+        'congruence_error': (np.mean(conf_errors)
+                             if len(conf_errors) else np.nan)
+    }
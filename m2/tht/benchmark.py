@@ -0,0 +1,276 @@
+'''Evaluation of tracker configurations over annotated beat corpora.
+
+A corpus is given as a manifest: a list of items, each with the onsets to
+track (an input file or the onset times themselves) and the reference beats.
+Every (configuration, item) job tracks the onsets, produces the beats as the
+beat modality does and scores them against the reference with the metrics
+of m2.tht.evaluation, recording its runtime and hypothesis count too. Jobs
+run over a process pool and a row is produced per job as soon as it
+finishes, so that performance changes can be checked for accuracy
+regressions over a whole corpus by comparing the summaries of a baseline
+and a modified configuration.
+'''
+
+import json
+import multiprocessing
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from m2.tht import evaluation
+from m2.tht import sweep
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import tracker_analysis
+from m2.tht.onsets import load_onsets
+
+METRICS = ['onsets', 'beats', 'hypotheses', 'runtime', 'peak_memory',
+           'f_measure', 'cmlc', 'cmlt', 'amlc', 'amlt']
+
+
+def load_manifest(path):
+    '''
+    Loads a JSON manifest: a list of objects with
+        in_file: input filename (see onsets.load_onsets), or
+        onsets: onset times [ms]
+        item: item id, when in_file is an onset corpus
+        reference: reference beats [ms], or the filename of a text file
+            with a reference beat (ms) per line
+        name: optional item name, defaults to in_file (and item) or the
+            item position
+
+    Relative filenames are resolved from the manifest directory.
+    '''
+    with open(path) as f:
+        items = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    resolved = []
+    for item in items:
+        item = dict(item)
+        for key in ('in_file', 'reference'):
+            if isinstance(item.get(key), str):
+                item[key] = os.path.join(base, item[key])
+        resolved.append(item)
+    return resolved
+
+
+def _validate_item(item, position):
+    'Raises ValueError if the manifest item at position is malformed'
+    entry = 'Manifest item {!r}'.format(item.get('name', position))
+    if 'item' in item and 'in_file' not in item:
+        raise ValueError(entry + ' has an item but no in_file')
+    if 'onsets' not in item and 'in_file' not in item:
+        raise ValueError(entry + ' has neither onsets nor in_file')
+    if 'reference' not in item:
+        raise ValueError(entry + ' has no reference')
+
+
+def _item_name(item, position):
+    if 'name' not in item and 'item' in item:
+        return '{}:{}'.format(item['in_file'], item['item'])
+    return str(item.get('name', item.get('in_file', position)))
+
+
+def _load_reference(reference):
+    if isinstance(reference, str):
+        return np.loadtxt(reference, ndmin=1)
+    return np.asarray(reference, dtype=float)
+
+
+def _load_item_onsets(item):
+    if 'onsets' in item:
+        return np.asarray(item['onsets'], dtype=float)
+    elif 'in_file' in item:
+        return load_onsets(item['in_file'], item=item.get('item'))
+    raise ValueError('Manifest item has neither onsets nor in_file')
+
+
+def track_and_score(tracker, onset_times, reference_beats, tolerance=70,
+                    max_bpm=None, avoid_quickturns=None, memory=False):
+    '''
+    Tracks onset_times, produces the beats and scores them.
+
+    Args:
+        tracker: TactusHypothesisTracker
+        onset_times: [ms]
+        reference_beats: [ms]
+        tolerance: ms of the F-measure
+        max_bpm, avoid_quickturns: beat production options (see
+            scripts/tht)
+        memory: whether to measure the peak memory allocated. It is measured
+            on a second, traced, run so that the runtime is not affected.
+
+    Returns:
+        dict with the METRICS, peak_memory (bytes) is nan if not measured
+    '''
+    def run():
+        hts = tracker(onset_times)
+        top_hts = tracker_analysis.top_hypothesis(hts, len(onset_times))
+        beats = (tracker_analysis.produce_beats_information(
+            onset_times, top_hts, adapt_period=max_bpm is not None,
+            adapt_phase=tracker.eval_f, max_delta_bpm=max_bpm,
+            avoid_quickturns=avoid_quickturns) if top_hts else [])
+        return hts, beats
+
+    start = time.perf_counter()
+    hts, beats = run()
+    runtime = time.perf_counter() - start
+
+    peak_memory = np.nan
+    if memory:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1] - base
+        if not tracing:
+            tracemalloc.stop()
+
+    row = {
+        'onsets': len(onset_times),
+        'beats': len(beats),
+        'hypotheses': len(hts),
+        'runtime': runtime,
+        'peak_memory': peak_memory,
+        'f_measure': evaluation.f_measure(reference_beats, beats, tolerance)
+    }
+    row.update(evaluation.continuity(reference_beats, beats))
+    return row
+
+
+_corpus = {}
+
+
+def _init_worker(corpus):
+    global _corpus
+    _corpus = corpus
+
+
+def _run_job(job):
+    config_id, overrides, name, options = job
+    item = _corpus[name]
+    tracker = tactus_hypothesis_tracker.default_tht(
+        **sweep.tracker_config(overrides))
+    row = {'config': config_id, 'file': name}
+    row.update(sweep._describe(overrides))
+    row.update(track_and_score(tracker, _load_item_onsets(item),
+                               _load_reference(item['reference']),
+                               **options))
+    return row
+
+
+def evaluate(manifest, configs=None, processes=None, on_result=None,
+             **options):
+    '''
+    Evaluates tracker configurations over an annotated corpus.
+
+    Args:
+        manifest: list of manifest items (see load_manifest) or a manifest
+            filename. Input files are loaded in the worker processes.
+        configs: either an overrides dict or a list of them (see
+            sweep.tracker_config). Defaults to the default configuration.
+        processes: size of the process pool. None uses a process per cpu and
+            1 runs all jobs in the current process.
+        on_result: callable called with each result row as soon as the job
+            finishes.
+        options: tolerance, max_bpm, avoid_quickturns and memory, see
+            track_and_score
+
+    Returns:
+        DataFrame with one row per (configuration, item) with columns
+        config, file, one per configuration parameter and METRICS.
+
+    Raises:
+        ValueError if a manifest item is malformed or the item names are
+        not unique.
+    '''
+    if isinstance(manifest, str):
+        manifest = load_manifest(manifest)
+    if configs is None:
+        configs = [{}]
+    elif isinstance(configs, dict):
+        configs = [configs]
+    for i, item in enumerate(manifest):
+        _validate_item(item, i)
+    corpus = dict((_item_name(item, i), item)
+                  for i, item in enumerate(manifest))
+    if len(corpus) != len(manifest):
+        raise ValueError('Manifest item names are not unique')
+    for overrides in configs:
+        sweep.tracker_config(overrides)
+
+    jobs = [(config_id, overrides, name, options)
+            for config_id, overrides in enumerate(configs)
+            for name in corpus]
+
+    rows = []
+
+    def collect(results):
+        for row in results:
+            if on_result is not None:
+                on_result(row)
+            rows.append(row)
+
+    if processes == 1:
+        _init_worker(corpus)
+        try:
+            collect(map(_run_job, jobs))
+        finally:
+            _init_worker({})
+    else:
+        with multiprocessing.Pool(processes, _init_worker,
+                                  (corpus,)) as pool:
+            collect(pool.imap_unordered(_run_job, jobs))
+
+    columns = (['config', 'file'] + sweep.grid_parameters(configs) +
+               METRICS)
+    results = pd.DataFrame(rows, columns=columns)
+    return results.sort_values(['config', 'file']).reset_index(drop=True)
+
+
+def summarize(results):
+    '''
+    Summarizes evaluation results per configuration.
+
+    Returns:
+        DataFrame with one row per configuration with its parameters, the
+        number of files, the mean of the scores and hypotheses, the total
+        runtime and the largest peak memory.
+    '''
+    groups = results.groupby('config')
+    params = [c for c in results.columns
+              if c not in ['config', 'file'] + METRICS]
+    summary = groups[params].first()
+    summary['files'] = groups['file'].count()
+    for metric in ['f_measure', 'cmlc', 'cmlt', 'amlc', 'amlt',
+                   'hypotheses']:
+        summary[metric] = groups[metric].mean()
+    summary['runtime'] = groups['runtime'].sum()
+    summary['peak_memory'] = groups['peak_memory'].max()
+    return summary.reset_index()
+
+
+def compare(results, baseline=0):
+    '''
+    Compares the summaries of each configuration with a baseline
+    configuration.
+
+    Args:
+        results: evaluate results
+        baseline: config id of the baseline
+
+    Returns:
+        summarize DataFrame with, for each score, its difference with the
+        baseline (columns suffixed _delta) and the speedup (baseline runtime
+        over runtime).
+    '''
+    summary = summarize(results).set_index('config')
+    base = summary.loc[baseline]
+    for metric in ['f_measure', 'cmlc', 'cmlt', 'amlc', 'amlt']:
+        summary[metric + '_delta'] = summary[metric] - base[metric]
+    summary['speedup'] = base['runtime'] / summary['runtime']
+    return summary.reset_index()
@@ -0,0 +1,177 @@
+'''On-disk cache of tracking results.
+
+Results are addressed by the fingerprint of the tracker configuration (see
+TactusHypothesisTracker.fingerprint), a digest of the onset times (and
+weights, if any) and CACHE_VERSION, so a result is reused whenever the same
+onsets are tracked with the same configuration and tracking code. Entries are
+pickles of the tracking result, evicted least recently used first when the
+cache exceeds its size or entry limits.
+
+The default cache is located at the directory in the THT_CACHE_DIR
+environment variable. If it is not set, results are not cached by default.
+'''
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+CACHE_DIR_ENV = 'THT_CACHE_DIR'
+
+# Version of the tracking results. Must be increased whenever a change to the
+# tracking (evaluation, correction, step or result format) changes the result
+# of a configuration, so that results cached before it are not reused.
+CACHE_VERSION = 1
+
+
+def onsets_digest(onset_times):
+    'Digest of onset times, as float64 ms'
+    onsets = np.ascontiguousarray(onset_times, dtype=np.float64)
+    return hashlib.sha256(onsets.tobytes()).hexdigest()
+
+
+def is_cacheable(tracker):
+    '''
+    Whether the results of tracker only depend on its fingerprint and the
+    onsets. Trackers with a realtime controller are not, as their result
+    depends on timing. Trackers with observers or a trace are not either,
+    as a cached result would skip their side effects.
+    '''
+    return (getattr(tracker, 'controller', None) is None and
+            not getattr(tracker, 'observers', None) and
+            getattr(tracker, 'trace', None) is None)
+
+
+class ResultCache():
+    '''
+    Directory of cached tracking results.
+
+    Args:
+        directory: cache directory, created if missing
+        max_bytes: size limit of the cached entries
+        max_entries: limit of the amount of entries, None for no limit
+    '''
+
+    SUFFIX = '.pkl'
+
+    def __init__(self, directory, max_bytes=2 ** 30, max_entries=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, tracker, onset_times, onset_weights=None):
+        'Cache key for tracking onset_times (weighted) with tracker'
+        key = '{}:{}:{}'.format(CACHE_VERSION, tracker.fingerprint(),
+                                onsets_digest(onset_times))
+        if onset_weights is not None:
+            key += ':{}'.format(onsets_digest(onset_weights))
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key):
+        'Cached result of key, None if missing'
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        'Stores result under key, evicting entries if limits are exceeded'
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def entries(self):
+        '''
+        Returns:
+            [(mtime, size, path)] of the cached entries, least recently used
+            first
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        'Removes least recently used entries until limits are met'
+        entries = self.entries()
+        size = sum(e[1] for e in entries)
+        max_entries = (self.max_entries if self.max_entries is not None
+                       else len(entries))
+        while entries and (size > self.max_bytes or
+                           len(entries) > max_entries):
+            _, entry_size, path = entries.pop(0)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            size -= entry_size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.unlink(path)
+
+    def track(self, tracker, onset_times, track=None, onset_weights=None):
+        '''
+        Result of tracking onset_times with tracker, from the cache if
+        present.
+
+        Args:
+            tracker: TactusHypothesisTracker
+            onset_times: [ms]
+            track: function performing the tracking of onset_times on a
+                miss, defaults to tracker itself
+            onset_weights: weights of onset_times, if any. A given track
+                function must apply them itself.
+
+        Returns:
+            A dict :: hypothesis_name -> HypothesisTracker
+        '''
+        if track is None:
+            def track(onset_times):
+                return tracker(onset_times, onset_weights=onset_weights)
+        if not is_cacheable(tracker):
+            return track(onset_times)
+        key = self.key(tracker, onset_times, onset_weights)
+        result = self.get(key)
+        if result is None:
+            result = track(onset_times)
+            self.put(key, result)
+        return result
+
+
+def default_cache():
+    'ResultCache at THT_CACHE_DIR, None if it is not set'
+    directory = os.environ.get(CACHE_DIR_ENV)
+    if not directory:
+        return None
+    return ResultCache(directory)
@@ -0,0 +1,143 @@
+'''Onset clustering stage that merges near-simultaneous onsets before a
+TactusHypothesisTracker discovers them.
+
+Polyphonic performances play chord notes a few milliseconds apart. Each of
+those onsets originates hypotheses paired with every other onset and is
+matched by every projection, multiplying nearly identical candidates. A
+clustering merges the onsets within a tolerance into a single onset at a
+representative time, weighted by the amount of onsets merged. The weights
+are given to the tracker with the clustered onsets (see
+TactusHypothesisTracker.__call__) and kept in the playback for the evaluation
+and correction functions that use them: confidence.WindowedExpEval,
+confidence.all_history_eval_exp (and IncrementalAllHistoryEval with the 'exp'
+weight), correction.WindowedCorrection and
+correction.RecursiveLeastSquaresCorrection.
+
+Onsets may be clustered at once (OnsetClusterer.cluster) or as they are
+received (OnsetClusterer.start, see onset_detection.track_onsets).
+'''
+
+import numpy as np
+
+REPRESENTATIVES = ['first', 'mean']
+
+
+class OnsetClusterer():
+    '''
+    Merges the onsets that follow the first onset of a cluster within
+    `tolerance` ms into the cluster. Clusters are anchored to their first
+    onset so that a run of closely spaced onsets (e.g. a fast arpeggio)
+    does not chain into a single cluster.
+
+    Clusters are formed as onsets are received: a cluster is closed when an
+    onset beyond its tolerance is received, or when the onsets end (see
+    OnsetClustering.flush). The clusters of a set of onsets are the same
+    whether they are received at once or in batches.
+
+    Configuration is shared among runs. The per run state is created with
+    start.
+
+    Args:
+        tolerance: max ms between the first onset of a cluster and the rest
+        representative: time of a cluster, its 'first' onset or the 'mean'
+            of its onsets
+    '''
+
+    def __init__(self, tolerance=30, representative='mean'):
+        if representative not in REPRESENTATIVES:
+            raise ValueError('Unknown cluster representative: {}'.format(
+                representative))
+        self.tolerance = tolerance
+        self.representative = representative
+        self._last_clustering = None
+
+    def start(self):
+        'Returns the clustering state of a run'
+        self._last_clustering = OnsetClustering(self)
+        return self._last_clustering
+
+    def cluster(self, onset_times):
+        '''
+        Clusters of a complete set of onsets.
+
+        Returns:
+            (times, weights) float arrays
+        '''
+        clustering = self.start()
+        times, weights = clustering.push(onset_times)
+        l_times, l_weights = clustering.flush()
+        return (np.concatenate([times, l_times]),
+                np.concatenate([weights, l_weights]))
+
+    def report(self):
+        'Report of the last run, see OnsetClustering.report'
+        return self._last_clustering.report() if self._last_clustering else {}
+
+
+class OnsetClustering():
+    '''
+    Per run state of an OnsetClusterer.
+
+    Interal Variables
+        received: amount of onsets received
+        pending: [ms] onsets of the open cluster
+        clusters: amount of clusters closed
+    '''
+
+    def __init__(self, clusterer):
+        self.clusterer = clusterer
+        self.received = 0
+        self.pending = []
+        self.clusters = 0
+
+    def _close(self, times, weights):
+        if self.clusterer.representative == 'first':
+            times.append(self.pending[0])
+        else:
+            times.append(float(np.mean(self.pending)))
+        weights.append(float(len(self.pending)))
+        self.pending = []
+
+    def push(self, onset_times):
+        '''
+        Receives sorted onsets, later than those received before.
+
+        Returns:
+            (times, weights) float arrays of the clusters closed
+        '''
+        times, weights = [], []
+        for onset in onset_times:
+            if (self.pending and
+                    onset - self.pending[0] > self.clusterer.tolerance):
+                self._close(times, weights)
+            self.pending.append(onset)
+            self.received += 1
+        self.clusters += len(times)
+        return np.array(times, dtype=float), np.array(weights, dtype=float)
+
+    def flush(self):
+        '''
+        Closes the open cluster, as no more onsets are received.
+
+        Returns:
+            (times, weights) float arrays with the cluster closed, if any
+        '''
+        times, weights = [], []
+        if self.pending:
+            self._close(times, weights)
+        self.clusters += len(times)
+        return np.array(times, dtype=float), np.array(weights, dtype=float)
+
+    def report(self):
+        '''
+        Returns:
+            dict with the onsets received, the clusters closed and the
+            reduction (fraction of onsets merged away)
+        '''
+        onsets = self.received - len(self.pending)
+        return {
+            'onsets': onsets,
+            'clusters': self.clusters,
+            'reduction': (1 - self.clusters / float(onsets)
+                          if onsets else 0.0)
+        }
@@ -14,8 +14,8 @@ def gaussian_weight(distances):
 
 
 def conf_exp(xs, proj, onsets, delta):
-    _, r_p, p = zip(*utils.project(xs, proj, onsets))
-    errors = abs(np.array(p) - np.array(r_p))
+    _, r_p, p = utils.project_arrays(xs, proj, onsets)
+    errors = abs(p - r_p)
     relative_errors = errors / float(delta)
     ret = 0.01 ** relative_errors
     return ret
@@ -26,8 +26,8 @@ def conf(xs, proj, onsets, delta, mult, scale, weight_func=gaussian_weight):
 
     Complexity: O(|proj|) \in O(|ongoing_play|)
     '''
-    xs, r_p, p = list(zip(*utils.project(xs, proj, onsets)))
-    errors = np.array(p) - np.array(r_p) 
+    xs, r_p, p = utils.project_arrays(xs, proj, onsets)
+    errors = p - r_p
     relative_errors = errors / (float(delta) * scale)
     ret = weight_func(relative_errors)
     return mult * ret
@@ -40,10 +40,41 @@ def all_history_eval_exp(ht, ongoing_play):
 
     Complexity: O(|ongoing_play|)
     '''
-    xs, proj = zip(*ht.proj_with_x(ongoing_play))
-    conf_sum = sum(conf_exp(xs, proj, ongoing_play.discovered_play(), ht.d))
-    return ((conf_sum / len(proj)) *
-            (conf_sum / len(ongoing_play.discovered_play())))
+    if ongoing_play.weights is not None:
+        return weighted_history_eval_exp(ht, ongoing_play)
+    xs, proj = ht.proj_arrays(ongoing_play)
+    onsets = np.asarray(ongoing_play.discovered_play(), dtype=float)
+    return _matched_eval_exp(proj, onsets, utils.project_indexes(proj, onsets),
+                             ht.d)
+
+
+def weighted_history_eval_exp(ht, ongoing_play):
+    '''
+    all_history_eval_exp over a playback with weighted onsets. The
+    confidence sum over the onsets is weighted by the weights of the matched
+    onsets and normalized by the total weight, so an onset merging several
+    onsets counts as them. With unit weights it equals all_history_eval_exp.
+
+    Complexity: O(|ongoing_play|)
+    '''
+    xs, proj = ht.proj_arrays(ongoing_play)
+    onsets = np.asarray(ongoing_play.discovered_play(), dtype=float)
+    return _matched_eval_exp(proj, onsets, utils.project_indexes(proj, onsets),
+                             ht.d, ongoing_play.discovered_weights())
+
+
+def _matched_eval_exp(proj, onsets, idx, delta, weights=None):
+    '''
+    all_history_eval_exp (or weighted_history_eval_exp, if onsets are
+    weighted) of the projections proj, whose first ones are matched to the
+    onsets of indexes idx.
+    '''
+    confs = 0.01 ** (np.abs(onsets[idx] - proj[:len(idx)]) / float(delta))
+    if weights is None:
+        conf_sum = sum(confs)
+        return (conf_sum / len(proj)) * (conf_sum / len(onsets))
+    return ((np.sum(confs) / len(proj)) *
+            (np.dot(confs, weights[idx]) / np.sum(weights)))
 
 
 def all_history_eval_gauss(ht, ongoing_play, scale=0.1):
@@ -53,7 +84,7 @@ def all_history_eval_gauss(ht, ongoing_play, scale=0.1):
 
     Complexity: O(|ongoing_play|)
     '''
-    xs, proj = list(zip(*ht.proj_with_x(ongoing_play)))
+    xs, proj = ht.proj_arrays(ongoing_play)
     conf_sum = sum(conf(xs, proj, ongoing_play.discovered_play(), 
                         ht.d, 1, scale))
     return ((conf_sum / len(proj)) *
@@ -61,17 +92,121 @@ def all_history_eval_gauss(ht, ongoing_play, scale=0.1):
 
 
 class WindowedExpEval:
-    '''Confidence is evaluated with exp function over a window of time.'''
+    '''
+    Confidence is evaluated with exp function over a window of time.
+
+    Onset weights, if any, are taken into account (see
+    weighted_history_eval_exp).
+    '''
 
     def __init__(self, window):
         self.window = window
 
     def __call__(self, ht, ongoing_play):
-        discovered_play = ongoing_play.discovered_play()
-        last = discovered_play[-1]
-        discovered_play_f = [o for o in discovered_play 
-                             if o > last - self.window]
-        return all_history_eval_exp(ht, play.Playback(discovered_play_f))
+        discovered_play_f = ongoing_play.discovered_window(self.window)
+        weights = None
+        if ongoing_play.weights is not None:
+            weights = ongoing_play.window_weights(self.window)
+        return all_history_eval_exp(ht, play.Playback(discovered_play_f,
+                                                      weights))
+
+    def bound(self, ht, ongoing_play):
+        '''
+        Upper bound of the confidence of ht, cheaper than its evaluation.
+
+        Each of the P projections of ht over the N onsets of the window is
+        matched to an onset at least as far as its nearest onset, so the
+        confidence sum S is at most the sum of the terms of the nearest
+        onsets errors, and the confidence (S / P) * (S / N) is bounded
+        accordingly. With weighted onsets, the weighted sum is at most S
+        times the max weight, over the total weight instead of N. A relative
+        margin covers rounding differences.
+        '''
+        discovered_play_f = np.asarray(
+            ongoing_play.discovered_window(self.window))
+        min_x, max_x = ht.proj_x_range(discovered_play_f[0],
+                                       discovered_play_f[-1])
+        if max_x < min_x:
+            return np.inf
+        proj = ht.r + ht.d * np.arange(min_x, max_x + 1)
+        idx = np.searchsorted(discovered_play_f, proj)
+        left = discovered_play_f[np.clip(idx - 1, 0, None)]
+        right = discovered_play_f[np.clip(idx, None,
+                                          len(discovered_play_f) - 1)]
+        errors = np.minimum(np.abs(proj - left), np.abs(right - proj))
+        conf_sum = np.sum(0.01 ** (errors / float(ht.d)))
+        if ongoing_play.weights is None:
+            bound = ((conf_sum / len(proj)) *
+                     (conf_sum / len(discovered_play_f)))
+        else:
+            weights = ongoing_play.window_weights(self.window)
+            bound = ((conf_sum / len(proj)) *
+                     (conf_sum * np.max(weights) / np.sum(weights)))
+        return bound * (1 + 1e-9) + 1e-12
+
+
+class FamilyWindowedExpEval(WindowedExpEval):
+    '''
+    WindowedExpEval sharing the matching of projections to the onsets of the
+    window among metrically related hypotheses (e.g. of double or triple
+    period on the same phase lattice), see utils.ProjectionFamilies.
+
+    TactusHypothesisTracker calls prepare with the hypotheses of each step,
+    once corrected, before evaluating them. Hypotheses not prepared are
+    matched on their own. The confidence is that of WindowedExpEval, as
+    shared matches are those of each hypothesis on its own. verify matches
+    each hypothesis on its own too and raises RuntimeError if any match
+    differs.
+
+    Args:
+        window: ms
+        tolerance: ms, see utils.ProjectionFamilies
+        ratios: see utils.ProjectionFamilies
+        verify: whether to check the shared matches
+    '''
+
+    def __init__(self, window, tolerance=20.0, ratios=(2, 3, 4),
+                 verify=False):
+        WindowedExpEval.__init__(self, window)
+        self.tolerance = tolerance
+        self.ratios = ratios
+        self.verify = verify
+        self._families = utils.ProjectionFamilies(tolerance, ratios)
+
+    def __getstate__(self):
+        return {'window': self.window, 'tolerance': self.tolerance,
+                'ratios': self.ratios, 'verify': self.verify}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _onsets(self, ongoing_play):
+        return np.asarray(ongoing_play.discovered_window(self.window),
+                          dtype=float)
+
+    def prepare(self, hts, ongoing_play):
+        'Groups the hypotheses hts to be evaluated on ongoing_play'
+        self._families.group(hts, self._onsets(ongoing_play))
+
+    def __call__(self, ht, ongoing_play):
+        onsets = self._onsets(ongoing_play)
+        idx = self._families.indexes(ht, onsets)
+        if idx is None:
+            return WindowedExpEval.__call__(self, ht, ongoing_play)
+        xs, proj = ht.proj_arrays_in_range(onsets[0], onsets[-1])
+        if self.verify and not np.array_equal(
+                idx, utils.project_indexes(proj, onsets)):
+            raise RuntimeError(
+                'Shared matching of {} differs from its own matching at '
+                'onset {}'.format(ht, ongoing_play.discovered_index))
+        weights = None
+        if ongoing_play.weights is not None:
+            weights = ongoing_play.window_weights(self.window)
+        return _matched_eval_exp(proj, onsets, idx, ht.d, weights)
+
+    def report(self):
+        'dict with the amount of lattices and of hypotheses sharing one'
+        return self._families.report()
 
 
 def all_history_eval(ht, ongoing_play, scale=0.1):
@@ -81,7 +216,7 @@ def all_history_eval(ht, ongoing_play, scale=0.1):
 
     Complexity: O(|ongoing_play|)
     '''
-    xs, proj = list(zip(*ht.proj_with_x(ongoing_play)))
+    xs, proj = ht.proj_arrays(ongoing_play)
     conf_sum = sum(conf(xs, proj, ongoing_play.discovered_play(), 
                         ht.d, 1, scale, lambda x: abs(x)))
     return ((conf_sum / len(proj)) *
@@ -114,11 +249,7 @@ class EvalAssembler:
         self.decay = decay
 
     def __call__(self, ht, ongoing_play):
-        try:
-            xs, proj = list(zip(*ht.proj_with_x(ongoing_play)))
-        except ValueError as ve:
-            print(ht, ht.r, ht.d)
-            raise ve
+        xs, proj = ht.proj_arrays(ongoing_play)
         discovered_onsets = ongoing_play.discovered_play()
         confs = conf(xs, proj, discovered_onsets, ht.d, self.mult, self.decay)
         for cm in self.conf_modifiers:
@@ -186,7 +317,7 @@ class TimeRestrictedConfMod:
 
         n_discovered_onsets = discovered_onsets[onsets_idx:]
 
-        xs, n_proj = list(zip(*ht.proj_with_x(play.Playback(n_discovered_onsets))))
+        xs, n_proj = ht.proj_arrays(play.Playback(n_discovered_onsets))
         n_confs = conf(xs, n_proj, n_discovered_onsets, ht.d, self.mult,
                        self.decay) 
 
@@ -215,6 +346,168 @@ class DeltaPriorEndMod:
         return self._delta_prior(ht.d) * end_conf
 
 
+class IncrementalAllHistoryEval:
+    '''
+    Evaluates a hypothesis over the whole history of the playback, as
+    all_history_eval_exp, all_history_eval_gauss, all_history_eval or an
+    EvalAssembler without conf modifiers, keeping the confidence sum of each
+    hypothesis tracker along the tracking (see utils.ProjectionHistory).
+
+    Only the projections that can still be matched to a different onset are
+    evaluated on each step, and the whole history again after the hypothesis
+    moved the rest more than tolerance ms. With tolerance 0 the confidence
+    is that of the original function, up to rounding.
+
+    With the 'exp' weight, onset weights, if any, are taken into account as
+    weighted_history_eval_exp does. The other weights, as their original
+    functions, do not take them into account.
+
+    Args:
+        weight: 'exp' (all_history_eval_exp), 'gauss' (all_history_eval_gauss
+            and EvalAssembler) or 'abs' (all_history_eval)
+        mult, scale: of the gauss and abs weights, see conf
+        end_modifiers: list of end modifiers, see EvalAssembler
+        tolerance: ms
+
+    Complexity: O(1) amortized per step while the hypothesis is stable
+    '''
+
+    def __init__(self, weight='exp', mult=1, scale=0.1, end_modifiers=(),
+                 tolerance=1.0):
+        if weight not in ('exp', 'gauss', 'abs'):
+            raise ValueError('Unknown weight {}'.format(weight))
+        self.weight = weight
+        self.mult = mult
+        self.scale = scale
+        self.end_modifiers = list(end_modifiers)
+        self.tolerance = tolerance
+        self._history = utils.ProjectionHistory(
+            self._terms, 1, tolerance,
+            key=(type(self).__name__, weight, mult, scale))
+        self._weighted_history = utils.ProjectionHistory(
+            self._weighted_terms, 2, tolerance,
+            key=(type(self).__name__, 'weighted', weight, mult, scale))
+
+    def _terms(self, xs, proj, onsets, delta):
+        errors = onsets - proj
+        if self.weight == 'exp':
+            confs = 0.01 ** (np.abs(errors) / float(delta))
+        elif self.weight == 'gauss':
+            confs = self.mult * gaussian_weight(
+                errors / (float(delta) * self.scale))
+        else:
+            confs = self.mult * np.abs(errors / (float(delta) * self.scale))
+        return confs[:, np.newaxis]
+
+    def _weighted_terms(self, xs, proj, onsets, delta, weights):
+        confs = 0.01 ** (np.abs(onsets - proj) / float(delta))
+        return np.column_stack([confs, confs * weights])
+
+    def __call__(self, ht, ongoing_play):
+        discovered_onsets = ongoing_play.discovered_play()
+        if ongoing_play.weights is not None and self.weight == 'exp':
+            weights = ongoing_play.discovered_weights()
+            (conf_sum, weighted_sum), n_proj = self._weighted_history.sums(
+                ht, discovered_onsets, weights)
+            if n_proj == 0:
+                return 0
+            end_conf = ((conf_sum / n_proj) *
+                        (weighted_sum / np.sum(weights)))
+        else:
+            (conf_sum,), n_proj = self._history.sums(ht, discovered_onsets)
+            if n_proj == 0:
+                return 0
+            end_conf = ((conf_sum / n_proj) *
+                        (conf_sum / len(discovered_onsets)))
+        for em in self.end_modifiers:
+            end_conf = em(ht, ongoing_play, end_conf)
+        return end_conf
+
+    def report(self):
+        'dict with the amount of full and incremental evaluations'
+        return {k: v + self._weighted_history.report()[k]
+                for k, v in self._history.report().items()}
+
+
+class MemoizedEval:
+    '''
+    Memoizes an evaluation function over the hypotheses of a step.
+
+    Live hypotheses often converge to practically the same (rho, delta)
+    before they are trimmed. The confidence of a hypothesis only depends on
+    its projections over the evaluated onsets (the window of eval_f, if it
+    has one, or the whole discovered playback), so hypotheses are keyed by
+    the bounds of those onsets, their delta and their phase relative to the
+    first of them, both quantized to tolerance ms. Entries are evicted when
+    the evaluated onsets change, i.e. on each step.
+
+    Other attributes (e.g. window) are those of eval_f. The bound of eval_f
+    is only given with tolerance 0: otherwise a hypothesis may get the
+    confidence of another one, above its own bound, and two phase updates
+    would drop hypotheses that are kept (see TactusHypothesisTracker).
+
+    With a tolerance, the confidence of a hypothesis depends on the others
+    evaluated in the step, so it is not parallel safe (see
+    parallel.is_parallel_safe).
+
+    Args:
+        eval_f: evaluation function
+        tolerance: ms, 0 only reuses the confidence of identical hypotheses
+    '''
+
+    def __init__(self, eval_f, tolerance=0.01):
+        self.eval_f = eval_f
+        self.tolerance = tolerance
+        self._bounds = None
+        self._cache = {}
+        self._hits = 0
+        self._misses = 0
+
+    def __getattr__(self, name):
+        if name.startswith('_') or 'eval_f' not in self.__dict__:
+            raise AttributeError(name)
+        if name == 'bound' and self.tolerance > 0:
+            raise AttributeError(name)
+        return getattr(self.eval_f, name)
+
+    def __getstate__(self):
+        return {'eval_f': self.eval_f, 'tolerance': self.tolerance}
+
+    @property
+    def parallel_safe(self):
+        return self.tolerance == 0
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _key(self, ht, ongoing_play):
+        window = getattr(self.eval_f, 'window', None)
+        onsets = (ongoing_play.discovered_window(window)
+                  if window is not None else ongoing_play.discovered_play())
+        bounds = (onsets[0], onsets[-1], len(onsets))
+        if bounds != self._bounds:
+            self._bounds = bounds
+            self._cache = {}
+        phase = (ht.r - onsets[0]) % ht.d
+        if self.tolerance > 0:
+            return (round(ht.d / self.tolerance),
+                    round(phase / self.tolerance))
+        return (ht.d, phase)
+
+    def __call__(self, ht, ongoing_play):
+        key = self._key(ht, ongoing_play)
+        if key in self._cache:
+            self._hits += 1
+        else:
+            self._misses += 1
+            self._cache[key] = self.eval_f(ht, ongoing_play)
+        return self._cache[key]
+
+    def report(self):
+        'dict with the amount of cache hits and misses'
+        return {'hits': self._hits, 'misses': self._misses}
+
+
 class WindowedExpEvalPrior:
 
     def __init__(self, window):
@@ -234,6 +527,9 @@ conf_prev_w_prior = EvalAssembler([TimeRestrictedConfMod(5000)],
 
 windowed_conf = WindowedExpEval(6000)
 
+inc_conf_all_exp = IncrementalAllHistoryEval('exp')
+inc_conf_all = IncrementalAllHistoryEval('gauss', 1, 5)
+
 
 try:
     import m2.povel1985
@@ -241,17 +537,52 @@ try:
         '''
         Function class for evaluating a hypothesis where confidence on each beat
         onset is multiplied if the onset is accented according to Povel 1981 rules.
+
+        Accents only depend on the discovered onsets, so they are computed once
+        per discovered prefix and shared by all hypotheses evaluated on it.
         '''
 
         def __init__(self, accent_multiplier):
             self.multiplier = accent_multiplier
+            self._bounds = None
+            self._onsets = None
+            self._mask = None
+
+        def _is_cached(self, discovered_onsets):
+            # Windows of the same playback share their base array, so the
+            # onsets themselves are compared
+            if (self._mask is None or len(discovered_onsets) == 0 or
+                    self._bounds != (discovered_onsets[0],
+                                     discovered_onsets[-1],
+                                     len(discovered_onsets))):
+                return False
+            return np.array_equal(self._onsets, discovered_onsets)
+
+        def accent_mask(self, discovered_onsets):
+            '''
+            Boolean mask aligned with discovered_onsets, True for onsets
+            accented according to m2.povel1985.
+
+            The mask of the last onsets given is cached, so the accents are
+            computed once for all hypotheses in a tracking step. The cache is
+            checked against the onsets (not only their bounds), as windows
+            of the same length may be given by other conf modifiers.
+            '''
+            if not self._is_cached(discovered_onsets):
+                onsets = np.array(discovered_onsets)
+                accents = list(m2.povel1985.accented_onsets(onsets))
+                self._bounds = ((onsets[0], onsets[-1], len(onsets))
+                                if len(onsets) else None)
+                self._onsets = onsets
+                self._mask = np.isin(onsets, accents)
+            return self._mask
 
         def __call__(self, ht, proj, discovered_onsets, confs):
-            accents = set(m2.povel1985.accented_onsets(discovered_onsets))
+            mask = self.accent_mask(discovered_onsets)
             accented_confs = [
                 c * self.multiplier
-                for c, o in zip(confs, discovered_onsets)
-                if o in accents
+                for c, accented in zip(confs, mask)
+                if accented
             ]
             return proj, discovered_onsets, accented_confs
 
@@ -0,0 +1,240 @@
+'''Indexed onset corpus container.
+
+A corpus file holds the onsets of many inputs, so that batch runs read a
+single file instead of parsing thousands of audio and midi files. Its layout
+is
+
+    magic (8 bytes) | header position (uint64)
+    onsets: float64, the onset times [ms] of every item, concatenated
+    offsets: int64, len(items) + 1 positions of each item in onsets
+    header: JSON object with the format version, the amount of onsets and
+        the items metadata (id, source path and duration, the ms of the
+        last onset)
+
+Numbers are little endian. Onsets and offsets are memory mapped when the
+corpus is opened, so the onsets of any item are accessed in O(1) without
+reading the rest. build_corpus writes the onsets as inputs are parsed (over a
+process pool), keeping memory flat.
+'''
+
+import json
+import multiprocessing
+import os
+import struct
+import warnings
+
+import numpy as np
+
+from m2.tht.onsets import load_onsets
+
+MAGIC = b'THTCORP1'
+VERSION = 1
+_PREAMBLE = struct.Struct('<8sQ')
+
+
+def is_corpus(filename):
+    'Whether filename is a corpus file'
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (IOError, OSError):
+        return False
+
+
+class OnsetCorpus():
+    '''
+    Read-only access to a corpus file.
+
+    Items are accessed by position or id, as read-only float64 arrays backed
+    by the memory map.
+
+    Args:
+        filename: corpus filename
+
+    Interal Variables
+        items: [dict] with the id, source and duration of each item
+        offsets: int64 array, onsets of item i are onsets[offsets[i]:
+            offsets[i + 1]]
+        onsets: float64 memory mapped array of all the onsets
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            magic, header_pos = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError('Not an onset corpus: {}'.format(filename))
+            f.seek(header_pos)
+            header = json.loads(f.read().decode('utf-8'))
+        if header['version'] != VERSION:
+            raise ValueError('Unsupported corpus version {}'.format(
+                header['version']))
+
+        self.items = header['items']
+        n_onsets = header['onsets']
+        self.onsets = (np.memmap(filename, dtype='<f8', mode='r',
+                                 offset=_PREAMBLE.size, shape=(n_onsets,))
+                       if n_onsets else np.zeros(0))
+        self.offsets = np.memmap(filename, dtype='<i8', mode='r',
+                                 offset=_PREAMBLE.size + 8 * n_onsets,
+                                 shape=(len(self.items) + 1,))
+        self._positions = dict((item['id'], i)
+                               for i, item in enumerate(self.items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item_id):
+        return item_id in self._positions
+
+    def position(self, item_id):
+        'Position of the item with item_id'
+        try:
+            return self._positions[item_id]
+        except KeyError:
+            raise KeyError('No item {} in corpus {}'.format(item_id,
+                                                           self.filename))
+
+    def __getitem__(self, key):
+        '''
+        Onset times [ms] of an item, given its position (int) or id (str)
+        '''
+        i = self.position(key) if isinstance(key, str) else key
+        if not -len(self) <= i < len(self):
+            raise IndexError('Item position out of range: {}'.format(key))
+        i %= len(self)
+        return self.onsets[self.offsets[i]:self.offsets[i + 1]]
+
+    def ids(self):
+        return [item['id'] for item in self.items]
+
+    def __iter__(self):
+        'Iterates over (item metadata, onset times)'
+        for i, item in enumerate(self.items):
+            yield item, self[i]
+
+
+def load_inputs(filenames, detector='beatroot'):
+    '''
+    Onset times of a list of input files, where onset corpora stand for all
+    of their items.
+
+    Returns:
+        iterator of (name, onset_times), named by filename, or
+        filename:item_id for corpus items
+    '''
+    for filename in filenames:
+        if is_corpus(filename):
+            for item, onsets in OnsetCorpus(filename):
+                yield '{}:{}'.format(filename, item['id']), onsets
+        else:
+            yield filename, load_onsets(filename, detector)
+
+
+def _item_id(filename, base):
+    if base is None:
+        return os.path.basename(filename)
+    return os.path.relpath(filename, base)
+
+
+def list_inputs(inputs):
+    '''
+    Input files of build_corpus, as [(item_id, filename)].
+
+    Directories are walked recursively and their files identified by their
+    path relative to the directory, files by their basename.
+    '''
+    ret = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for fn in sorted(files):
+                    filename = os.path.join(root, fn)
+                    ret.append((_item_id(filename, path), filename))
+        else:
+            ret.append((_item_id(path, None), path))
+    return ret
+
+
+_detector = 'beatroot'
+
+
+def _init_worker(detector):
+    global _detector
+    _detector = detector
+
+
+def _load_job(job):
+    item_id, filename = job
+    try:
+        return item_id, filename, np.asarray(
+            load_onsets(filename, _detector), dtype='<f8')
+    except ValueError as e:
+        return item_id, filename, str(e)
+
+
+def build_corpus(out_file, inputs, detector='beatroot', processes=None,
+                 on_item=None):
+    '''
+    Builds a corpus file from input files.
+
+    Args:
+        out_file: corpus filename
+        inputs: filenames and directories (see list_inputs), or a list of
+            (item_id, filename)
+        detector: onset detector of audio files, see onsets.load_onsets
+        processes: size of the process pool parsing the inputs. None uses a
+            process per cpu and 1 parses them in the current process.
+        on_item: callable called with the metadata of each item as it is
+            written
+
+    Returns:
+        [(filename, error)] of the inputs skipped because their onsets could
+        not be loaded
+    '''
+    inputs = list(inputs)
+    jobs = (inputs if all(isinstance(i, tuple) for i in inputs)
+            else list_inputs(inputs))
+    if len(set(item_id for item_id, _ in jobs)) != len(jobs):
+        raise ValueError('Corpus item ids are not unique')
+
+    items = []
+    offsets = [0]
+    skipped = []
+
+    with open(out_file, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, 0))
+
+        def collect(results):
+            for item_id, filename, onsets in results:
+                if isinstance(onsets, str):
+                    warnings.warn('Skipping {}: {}'.format(filename, onsets))
+                    skipped.append((filename, onsets))
+                    continue
+                f.write(onsets.tobytes())
+                offsets.append(offsets[-1] + len(onsets))
+                item = {'id': item_id, 'source': os.path.abspath(filename),
+                        'duration': float(onsets[-1]) if len(onsets) else 0.}
+                items.append(item)
+                if on_item is not None:
+                    on_item(item)
+
+        if processes == 1:
+            _init_worker(detector)
+            try:
+                collect(map(_load_job, jobs))
+            finally:
+                _init_worker('beatroot')
+        else:
+            with multiprocessing.Pool(processes, _init_worker,
+                                      (detector,)) as pool:
+                collect(pool.imap(_load_job, jobs))
+
+        f.write(np.array(offsets, dtype='<i8').tobytes())
+        header_pos = f.tell()
+        f.write(json.dumps({'version': VERSION, 'onsets': offsets[-1],
+                            'items': items}).encode('utf-8'))
+        f.seek(0)
+        f.write(_PREAMBLE.pack(MAGIC, header_pos))
+    return skipped
@@ -23,19 +23,22 @@ def gauss_error_conf(error, multiplicator, decay, delta):
 
 
 def error_calc(ht, ongoing_play):
-    p_w_x = ht.proj_with_x(ongoing_play)
-    try:
-        xs, p = list(zip(*p_w_x))
-    except ValueError:
-        print(ht, ongoing_play.onset_times)
+    xs, p = ht.proj_arrays(ongoing_play)
+    xs, p, r_p = utils.project_arrays(xs, p, ongoing_play.discovered_play())
 
-    #xs, p, r_p = zip(*utils.centered_real_proj(xs, p, ongoing_play))
-    xs, p, r_p = list(zip(*utils.project(xs, p, ongoing_play.discovered_play()))) 
-
-    err = np.array(r_p) - np.array(p)
+    err = r_p - p
     return xs, err, p
 
 
+def weighted_error_calc(ht, ongoing_play):
+    'error_calc, adding the weights of the onsets matched by projections'
+    xs, p = ht.proj_arrays(ongoing_play)
+    onsets = np.asarray(ongoing_play.discovered_play(), dtype=float)
+    idx = utils.project_indexes(p, onsets)
+    return (xs[:len(idx)], onsets[idx] - p[:len(idx)], p[:len(idx)],
+            ongoing_play.discovered_weights()[idx])
+
+
 def proj_error_conf(ht, ongoing_play, mult, decay, err_conf_f):
     xs, err, p = error_calc(ht, ongoing_play)
     return xs, err_conf_f(np.array(err), mult, decay, ht.d), p
@@ -117,10 +120,101 @@ class LinearRegressOverSmoothedErrorCorrection(HypothesisCorrectionMethod):
                                     stderr=stderr)
 
 
+def _linregress_sums(n, sx, sy, sxx, sxy, syy):
+    '''
+    scipy.stats.linregress of n points from the sums of their x, y, x*x, x*y
+    and y*y.
+
+    Returns:
+        (slope, intercept, r_value, p_value, stderr)
+    '''
+    xmean, ymean = sx / n, sy / n
+    ssxm = sxx / n - xmean * xmean
+    ssxym = sxy / n - xmean * ymean
+    ssym = max(syy / n - ymean * ymean, 0)
+    if ssxm == 0 or ssym == 0:
+        r = np.nan if ssxym == 0 else 0.0
+    else:
+        r = min(max(ssxym / np.sqrt(ssxm * ssym), -1.0), 1.0)
+    slope = ssxym / ssxm
+    intercept = ymean - slope * xmean
+    if n == 2:
+        return slope, intercept, r, 1.0 if ssym == 0 else 0.0, 0.0
+    df = n - 2
+    t = r * np.sqrt(df / ((1.0 - r + 1e-20) * (1.0 + r + 1e-20)))
+    p_value = 2 * stats.t.sf(abs(t), df)
+    stderr = np.sqrt(max((1 - r ** 2) * ssym / ssxm / df, 0))
+    return slope, intercept, r, p_value, stderr
+
+
+def weighted_linregress(x, y, weights):
+    '''
+    Weighted least squares fit of y over x, as scipy.stats.linregress of
+    points repeated by their weights (which need not be integers).
+
+    Returns:
+        (slope, intercept, r_value, p_value, stderr)
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) == 0 or np.all(x == x[0]):
+        raise ValueError('Cannot calculate a linear regression if all x '
+                         'values are identical')
+    return _linregress_sums(np.sum(weights), np.dot(weights, x),
+                            np.dot(weights, y), np.dot(weights, x * x),
+                            np.dot(weights, x * y), np.dot(weights, y * y))
+
+
+class IncrementalLinearRegressCorrection(HypothesisCorrectionMethod):
+    '''
+    LinearRegressOverSmoothedErrorCorrection keeping the regression sums of
+    each hypothesis tracker along the tracking (see
+    utils.ProjectionHistory).
+
+    Only the projections that can still be matched to a different onset are
+    added on each step, and the whole history again after the hypothesis
+    moved the rest more than tolerance ms. With tolerance 0 the correction
+    is that of LinearRegressOverSmoothedErrorCorrection, up to rounding.
+
+    Complexity: O(1) amortized per step while the hypothesis is stable
+    '''
+
+    def __init__(self, multiplicator=1.0, decay=0.01, tolerance=1.0):
+        self.mult = multiplicator
+        self.decay = decay
+        self.tolerance = tolerance
+        self._history = utils.ProjectionHistory(
+            self._terms, 6, tolerance,
+            key=(type(self).__name__, multiplicator, decay))
+
+    def _terms(self, xs, proj, onsets, delta):
+        ys = exp_error_conf(onsets - proj, self.mult, self.decay, delta)
+        return np.column_stack([np.ones(len(xs)), xs, ys, xs * xs, xs * ys,
+                                ys * ys])
+
+    def __call__(self, ht, ongoing_play):
+        sums, _ = self._history.sums(ht, ongoing_play.discovered_play())
+        (delta_delta, delta_rho, r_value,
+         p_value, stderr) = _linregress_sums(*sums)
+
+        return HypothesisCorrection(o_rho=ht.r, o_delta=ht.d,
+                                    n_rho=ht.r + delta_rho,
+                                    n_delta=ht.d + delta_delta,
+                                    r_value=r_value, p_value=p_value,
+                                    stderr=stderr)
+
+    def report(self):
+        'dict with the amount of full and incremental corrections'
+        return self._history.report()
+
+
 class WindowedCorrection(HypothesisCorrectionMethod):
     '''
     Correction function in which only part of the past of the percieved onsets
     is taken into account for the correction.
+
+    Onset weights, if any, weight the errors of their projections in the
+    regression (see weighted_linregress).
     '''
 
     def __init__(self, mult, decay, window):
@@ -135,16 +229,22 @@ class WindowedCorrection(HypothesisCorrectionMethod):
         self.window = window
 
     def __call__(self, ht, ongoing_play):
-        discovered_onsets = np.array(ongoing_play.discovered_play())
-        discovered_onsets = discovered_onsets[discovered_onsets >
-                                              discovered_onsets[-1] -
-                                              self.window]
-        sub_pl = playback.Playback(discovered_onsets)
-        xs, err, p = error_calc(ht, sub_pl)
-        conf = exp_error_conf(err, self.mult, self.decay, ht.d)
+        discovered_onsets = ongoing_play.discovered_window(self.window)
+        if ongoing_play.weights is None:
+            sub_pl = playback.Playback(discovered_onsets)
+            xs, err, p = error_calc(ht, sub_pl)
+            conf = exp_error_conf(err, self.mult, self.decay, ht.d)
 
-        (delta_delta, delta_rho, r_value,
-         p_value, stderr) = stats.linregress(xs, conf)
+            (delta_delta, delta_rho, r_value,
+             p_value, stderr) = stats.linregress(xs, conf)
+        else:
+            sub_pl = playback.Playback(
+                discovered_onsets, ongoing_play.window_weights(self.window))
+            xs, err, p, weights = weighted_error_calc(ht, sub_pl)
+            conf = exp_error_conf(err, self.mult, self.decay, ht.d)
+
+            (delta_delta, delta_rho, r_value,
+             p_value, stderr) = weighted_linregress(xs, conf, weights)
 
         return HypothesisCorrection(o_rho=ht.r, o_delta=ht.d,
                                     n_rho=ht.r + delta_rho,
@@ -173,10 +273,7 @@ class MovingWindowedSmoothCorrection(HypothesisCorrectionMethod):
         self.window = window
 
     def __call__(self, ht, ongoing_play):
-        discovered_onsets = np.array(ongoing_play.discovered_play())
-        discovered_onsets = discovered_onsets[discovered_onsets >
-                                              discovered_onsets[-1] -
-                                              self.window]
+        discovered_onsets = ongoing_play.discovered_window(self.window)
         sub_pl = playback.Playback(discovered_onsets)
         xs, err, p = error_calc(ht, sub_pl)
         conf = gauss_error_conf(err, self.mult, self.decay, ht.d)
@@ -202,6 +299,80 @@ class MovingWindowedSmoothCorrection(HypothesisCorrectionMethod):
 
 
 
+class RecursiveLeastSquaresCorrection(HypothesisCorrectionMethod):
+    '''
+    Correction by recursive least squares with exponential forgetting.
+
+    The hypothesis (rho, delta) is taken as the estimate of the line
+    onset = rho + delta * x. Each newly discovered onset is matched to its
+    nearest projection x and updates the estimate, weighted by
+    decay ** (|error| / delta) to tone down onsets off the beat, while older
+    onsets are forgotten by a factor per onset (raised to that weight).
+    Weighted onsets (see m2.tht.clustering) multiply their update weight by
+    their weight relative to the mean weight of the onsets seen.
+    Updates that would leave delta not positive are skipped. Only the 2x2
+    covariance of the estimate and the amount (and weight) of onsets seen are
+    kept per hypothesis tracker, so a correction costs O(1) regardless of the
+    window or onset density.
+
+    The state is kept in the hypothesis tracker states, so it is pickled
+    with the tracker. Hypotheses without states (e.g. plain
+    hypothesis.Hypothesis) start from the prior covariance on each call.
+
+    Args:
+        forgetting: factor in (0, 1] applied to the weight of older onsets
+            on each onset
+        decay: double multiplier of the error on the decay part
+        prior: weight of the initial hypothesis, relative to an onset
+    '''
+
+    def __init__(self, forgetting=0.6, decay=0.01, prior=0.1):
+        self.forgetting = forgetting
+        self.decay = decay
+        self.prior = prior
+        self._key = (type(self).__name__, forgetting, decay, prior)
+
+    def __call__(self, ht, ongoing_play):
+        onsets = ongoing_play.discovered_play()
+        states = getattr(ht, 'states', None)
+        state = states.get(self._key) if states is not None else None
+        if state is None:
+            # The onsets of the hypothesis origin are part of the prior
+            state = [np.eye(2) / self.prior, len(onsets) - 1, 0, 0.0]
+            if states is not None:
+                states[self._key] = state
+        cov, seen, weighted, weight_sum = state
+
+        theta = np.array([ht.r, ht.d], dtype=float)
+        weights = (None if ongoing_play.weights is None
+                   else ongoing_play.discovered_weights())
+        for i in range(seen, len(onsets)):
+            onset = onsets[i]
+            x = round((onset - theta[0]) / theta[1])
+            phi = np.array([1.0, x])
+            error = onset - phi.dot(theta)
+            weight = self.decay ** (abs(error) / theta[1])
+            # Forgetting in proportion to the weight keeps the covariance
+            # from winding up over onsets off the beat
+            forgetting = 1 - (1 - self.forgetting) * weight
+            if weights is not None:
+                weighted += 1
+                weight_sum += weights[i]
+                weight *= weights[i] * weighted / weight_sum
+            cov_phi = cov.dot(phi)
+            gain = weight * cov_phi / (forgetting +
+                                       weight * phi.dot(cov_phi))
+            new_theta = theta + gain * error
+            if not new_theta[1] > 0:
+                continue
+            theta = new_theta
+            cov = (cov - np.outer(gain, cov_phi)) / forgetting
+        state[:] = cov, len(onsets), weighted, weight_sum
+
+        return HypothesisCorrection(o_rho=ht.r, o_delta=ht.d,
+                                    n_rho=theta[0], n_delta=theta[1])
+
+
 class LinRegsOverSmoothedErrorCorrectionWithPeak(HypothesisCorrectionMethod):
 
     def __init__(self, decay=0.0001):
@@ -235,6 +406,10 @@ lin_r_corr_opt_by_5 = MultLinRegsOSEC(2, 0.0001, 5)
 lin_r_corr_opt = LinearRegressOverSmoothedErrorCorrection(2, .0001)
 windowed_corr = WindowedCorrection(2, 0.0001, 6000)
 
+inc_lin_r_corr = IncrementalLinearRegressCorrection()
+inc_lin_r_corr_opt = IncrementalLinearRegressCorrection(2, .0001)
+rls_corr = RecursiveLeastSquaresCorrection()
+
 
 def no_corr(ht, ongoing_play):
     'Correction function that performs no correction'
@@ -0,0 +1,142 @@
+'''Metrics to evaluate beat trackings against reference beats.
+
+All times are in ms.
+'''
+
+import numpy as np
+
+
+def _nearest(reference, times):
+    '''
+    Index of the nearest reference value for each of times. Reference must
+    be sorted and not empty.
+    '''
+    idx = np.clip(np.searchsorted(reference, times), 1, len(reference) - 1)
+    left = reference[idx - 1]
+    right = reference[idx]
+    return np.where(np.abs(times - left) <= np.abs(right - times),
+                    idx - 1, idx)
+
+
+def f_measure(reference_beats, estimated_beats, tolerance=70):
+    '''
+    F-measure of estimated beats against reference beats.
+
+    An estimated beat is a hit if it lies within tolerance of a reference
+    beat. Each reference beat accounts for at most one hit.
+
+    Args:
+        reference_beats: [ms]
+        estimated_beats: [ms]
+        tolerance: ms
+
+    Returns:
+        F-measure in [0, 1]
+    '''
+    reference = np.sort(np.asarray(reference_beats, dtype=float))
+    estimated = np.sort(np.asarray(estimated_beats, dtype=float))
+    if len(reference) == 0 or len(estimated) == 0:
+        return float(len(reference) == len(estimated))
+    if len(reference) == 1:
+        nearest = np.zeros(len(estimated), dtype=int)
+    else:
+        nearest = _nearest(reference, estimated)
+    matched = np.abs(reference[nearest] - estimated) <= tolerance
+    hits = len(np.unique(nearest[matched]))
+    precision = hits / float(len(estimated))
+    recall = hits / float(len(reference))
+    if hits == 0:
+        return 0.0
+    return 2 * precision * recall / (precision + recall)
+
+
+def _continuity_correct(reference, estimated, phase_tolerance,
+                        period_tolerance):
+    '''
+    Whether each reference beat is correctly tracked: its nearest estimated
+    beat lies within phase_tolerance of it and the interval to the previous
+    estimated beat lies within period_tolerance of the reference interval,
+    both relative to the reference interval. Each estimated beat accounts
+    for at most one reference beat.
+    '''
+    correct = np.zeros(len(reference), dtype=bool)
+    if len(reference) < 2 or len(estimated) < 2:
+        return correct
+    ref_intervals = np.diff(reference)
+    ref_intervals = np.concatenate([ref_intervals[:1], ref_intervals])
+    est_intervals = np.diff(estimated)
+    est_intervals = np.concatenate([est_intervals[:1], est_intervals])
+
+    nearest = _nearest(estimated, reference)
+    phase_ok = (np.abs(estimated[nearest] - reference) <=
+                phase_tolerance * ref_intervals)
+    period_ok = (np.abs(est_intervals[nearest] - ref_intervals) <=
+                 period_tolerance * ref_intervals)
+    correct = phase_ok & period_ok
+    _, first = np.unique(nearest, return_index=True)
+    unique = np.zeros(len(reference), dtype=bool)
+    unique[first] = True
+    return correct & unique
+
+
+def _longest_run(flags):
+    'Length of the longest run of True values'
+    if not flags.any():
+        return 0
+    padded = np.concatenate([[False], flags, [False]]).astype(int)
+    changes = np.flatnonzero(np.diff(padded))
+    return int(np.max(changes[1::2] - changes[::2]))
+
+
+def _metrical_variations(reference):
+    '''
+    Reference beats at metrical levels allowed by the AML scores: the
+    reference itself, its off-beats, double tempo and both half tempos.
+    '''
+    midpoints = (reference[:-1] + reference[1:]) / 2.
+    double = np.empty(len(reference) + len(midpoints))
+    double[::2] = reference
+    double[1::2] = midpoints
+    return [reference, midpoints, double, reference[::2], reference[1::2]]
+
+
+def continuity(reference_beats, estimated_beats, phase_tolerance=0.175,
+               period_tolerance=0.175):
+    '''
+    Continuity based scores of estimated beats against reference beats.
+
+    A reference beat is correctly tracked if its nearest estimated beat and
+    the interval preceding it lie within tolerance of the reference beat and
+    interval (see _continuity_correct). The AML scores also accept tracking
+    the reference at double or half tempo, or on the off-beats.
+
+    Args:
+        reference_beats: [ms]
+        estimated_beats: [ms]
+        phase_tolerance: relative to the reference interval
+        period_tolerance: relative to the reference interval
+
+    Returns:
+        dict with
+            cmlc: longest continuously correct segment at the reference
+                metrical level, as a fraction of the reference beats
+            cmlt: total correct beats at the reference metrical level, as a
+                fraction of the reference beats
+            amlc, amlt: as cmlc and cmlt, for the best metrical level
+    '''
+    reference = np.sort(np.asarray(reference_beats, dtype=float))
+    estimated = np.sort(np.asarray(estimated_beats, dtype=float))
+    scores = {'cmlc': 0.0, 'cmlt': 0.0, 'amlc': 0.0, 'amlt': 0.0}
+    if len(reference) < 2 or len(estimated) < 2:
+        return scores
+
+    for level, variation in enumerate(_metrical_variations(reference)):
+        correct = _continuity_correct(variation, estimated, phase_tolerance,
+                                      period_tolerance)
+        c = _longest_run(correct) / float(len(variation))
+        t = float(correct.sum()) / len(variation)
+        if level == 0:
+            scores['cmlc'], scores['cmlt'] = c, t
+        scores['amlc'] = max(scores['amlc'], c)
+        scores['amlt'] = max(scores['amlt'], t)
+    return scores
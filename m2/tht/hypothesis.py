@@ -38,6 +38,16 @@ class Hypothesis(object):
     def proj_with_x(self, play):
         return self.proj_with_x_in_range(play.min, play.max)
 
+    def proj_arrays_in_range(self, min, max):
+        'proj_with_x_in_range as (xs, projections) arrays'
+        min_x, max_x = self.proj_x_range(min, max)
+        xs = np.arange(min_x, max_x + 1)
+        return xs, self.r + self.d * xs
+
+    def proj_arrays(self, play):
+        'proj_with_x as (xs, projections) arrays'
+        return self.proj_arrays_in_range(play.min, play.max)
+
     def proj_in_range(self, min, max):
         return np.array([v[1] for v in self.proj_with_x_in_range(min, max)])
 
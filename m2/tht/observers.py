@@ -0,0 +1,198 @@
+'''Observers of the steps of a TactusHypothesisTracker run.
+
+Observers are callables given to the tracker (observers argument) that are
+called at the end of each step with a StepSnapshot: the onset of the step,
+the live hypotheses and those created, trimmed by similarity and dropped by
+score on it, as read-only arrays. Observers let reports be computed while
+tracking, without keeping the hypothesis trackers around until the tracking
+ends (e.g. without archive_hypotheses).
+
+TrackingConfs and TopHypothesis compute incrementally what
+tracker_analysis.tht_tracking_confs and top_hypothesis give on the result of
+the same tracking with archive_hypotheses and archive_trimmed, where every
+hypothesis updated on a step is in the result. With two_phase_update, the
+hypotheses trimmed on a step are not evaluated and so are not taken into
+account.
+'''
+
+import collections
+
+import numpy as np
+
+# Hypothesis trackers as arrays: origins is an (n, 2) int array with the onset
+# indexes that originated each hypothesis, rho, delta and conf are float
+# arrays. conf is NaN for hypotheses not evaluated on the step.
+HypothesisArrays = collections.namedtuple(
+    'HypothesisArrays', ['origins', 'rho', 'delta', 'conf'])
+
+StepSnapshot = collections.namedtuple(
+    'StepSnapshot', ['onset_idx', 'onset_time', 'live', 'created',
+                     'trimmed', 'trimmed_by', 'dropped'])
+StepSnapshot.__doc__ = '''
+Read-only state of a tracking step.
+
+Attributes:
+    onset_idx: index of the onset of the step
+    onset_time: ms of the onset of the step
+    live: HypothesisArrays of the hypotheses kept, in order of decreasing
+        confidence (ties in order of generation)
+    created: HypothesisArrays of the hypotheses created
+    trimmed: HypothesisArrays of the hypotheses trimmed by similarity
+    trimmed_by: (n, 2) int array with the origins of the hypothesis that
+        trimmed each of trimmed
+    dropped: HypothesisArrays of the hypotheses dropped, by the controller
+        (before being updated) and then by score
+'''
+
+
+def _read_only(array):
+    array.setflags(write=False)
+    return array
+
+
+def hypothesis_arrays(hts, onset_idx):
+    'HypothesisArrays of hypothesis trackers at the step of onset_idx'
+    origins = np.array([ht.onset_indexes for ht in hts],
+                       dtype=int).reshape(len(hts), 2)
+    rho = np.array([ht.r for ht in hts], dtype=float)
+    delta = np.array([ht.d for ht in hts], dtype=float)
+    conf = np.array([ht.conf if ht.confs and ht.confs[-1][0] == onset_idx
+                     else np.nan for ht in hts], dtype=float)
+    return HypothesisArrays(*[_read_only(a)
+                              for a in (origins, rho, delta, conf)])
+
+
+def step_snapshot(ongoing_play, live, created, trimmed, dropped):
+    '''
+    StepSnapshot of the step of the last discovered onset.
+
+    Args:
+        ongoing_play: OngoingPlayback
+        live: hypothesis trackers kept, in order of generation
+        created: hypothesis trackers created
+        trimmed: [(trimmed_ht, kept_ht)]
+        dropped: hypothesis trackers dropped
+    '''
+    onset_idx = ongoing_play.discovered_index
+    order = sorted(range(len(live)), key=lambda i: -live[i].conf)
+    return StepSnapshot(
+        onset_idx=onset_idx,
+        onset_time=ongoing_play.onset_times[onset_idx],
+        live=hypothesis_arrays([live[i] for i in order], onset_idx),
+        created=hypothesis_arrays(created, onset_idx),
+        trimmed=hypothesis_arrays([ht for ht, _ in trimmed], onset_idx),
+        trimmed_by=_read_only(np.array(
+            [kept.onset_indexes for _, kept in trimmed],
+            dtype=int).reshape(len(trimmed), 2)),
+        dropped=hypothesis_arrays(dropped, onset_idx))
+
+
+def _candidates(snapshot):
+    '''
+    Hypotheses evaluated on the step of snapshot, as a list of (origin,
+    rho, delta, conf)
+    '''
+    ret = []
+    for arrays in (snapshot.live, snapshot.trimmed, snapshot.dropped):
+        for origin, rho, delta, conf in zip(*arrays):
+            if conf == conf:
+                ret.append((tuple(origin), rho, delta, conf))
+    return ret
+
+
+class TrackingConfs():
+    '''
+    Observer of the top confidence at each onset, as tht_tracking_confs.
+
+    Interal Variables
+        confs: [(ms, confidence)]
+    '''
+
+    def __init__(self):
+        self.confs = []
+
+    def __call__(self, snapshot):
+        if snapshot.onset_idx < 3:
+            return
+        candidates = _candidates(snapshot)
+        if candidates:
+            self.confs.append((snapshot.onset_time,
+                               max(c[3] for c in candidates)))
+
+    def mean(self):
+        'Mean top confidence, as tht_tracking_conf'
+        return np.mean([c for _, c in self.confs])
+
+
+TOP_DTYPE = np.dtype([('onset_idx', int), ('a', int), ('b', int),
+                      ('rho', float), ('delta', float), ('conf', float)])
+
+
+class TopHypothesis():
+    '''
+    Observer of the top hypothesis at each onset, as top_hypothesis.
+
+    Ties are broken as in top_hypothesis, by the order of the trackers in
+    the result: those trimmed or dropped first come first, and the live ones
+    at the end come last, in order of generation. A tied onset is resolved
+    once one of its tied hypotheses is trimmed or dropped. Hypotheses dropped
+    by a controller are taken to leave after those trimmed on their step.
+
+    Interal Variables
+        resolved: [TOP_DTYPE tuple] top hypotheses of the resolved onsets
+        pending: deque of (onset_idx, [tied candidates]) onsets to resolve
+        left: hypothesis origin -> position in the order of leaving, kept
+            while there are pending onsets
+    '''
+
+    def __init__(self):
+        self.resolved = []
+        self.pending = collections.deque()
+        self.left = {}
+        self._leaving = 0
+
+    def __call__(self, snapshot):
+        for arrays in (snapshot.trimmed, snapshot.dropped):
+            for origin in arrays.origins:
+                self.left[tuple(origin)] = self._leaving
+                self._leaving += 1
+
+        if snapshot.onset_idx >= 3:
+            candidates = _candidates(snapshot)
+            if candidates:
+                best = max(c[3] for c in candidates)
+                self.pending.append((snapshot.onset_idx,
+                                     [c for c in candidates if c[3] == best]))
+        self.resolved.extend(self._resolve())
+        if not self.pending:
+            self.left.clear()
+
+    def _resolve(self, final=False):
+        ret = []
+        while self.pending:
+            onset_idx, tied = self.pending[0]
+            gone = [c for c in tied if c[0] in self.left]
+            if len(tied) == 1:
+                top = tied[0]
+            elif gone:
+                top = min(gone, key=lambda c: self.left[c[0]])
+            elif final:
+                top = min(tied, key=lambda c: (c[0][1], c[0][0]))
+            else:
+                break
+            self.pending.popleft()
+            ret.append((onset_idx,) + top[0] + top[1:])
+        return ret
+
+    def timeline(self):
+        '''
+        Top hypotheses of every onset so far, resolving pending ties as if
+        the tracking ended now.
+
+        Returns:
+            TOP_DTYPE array
+        '''
+        pending = collections.deque(self.pending)
+        final = self._resolve(final=True)
+        self.pending = pending
+        return np.array(self.resolved + final, dtype=TOP_DTYPE)
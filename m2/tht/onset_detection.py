@@ -0,0 +1,235 @@
+'''Streaming onset detection for audio input.
+
+SpectralFluxDetector computes a spectral flux novelty curve (the increase of
+the log compressed magnitude spectrum between consecutive frames) and picks
+its peaks with an adaptive threshold, as in Böck et al. (2012), "Evaluating
+the online capabilities of onset detection methods". Samples are processed
+as they are received and onsets are emitted as soon as the peak picking
+lookahead is available, so memory does not grow with the length of the
+input.
+
+wav_onsets reads a WAV file in chunks through a memory map, and track_onsets
+feeds a tracker with onsets as they are found (see TrackingState.extend), so
+that tracking overlaps with onset detection.
+'''
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.io import wavfile
+
+
+class SpectralFluxDetector():
+    '''
+    Detects onsets in a stream of mono audio samples.
+
+    Args:
+        sample_rate: Hz
+        frame_size: samples of each spectrum frame
+        hop: ms between frames
+        compression: gamma of the log(1 + gamma * |X|) compression
+        pre_max, post_max: ms before and after a frame where its novelty
+            must be the maximum
+        pre_avg, post_avg: ms before and after a frame over which the mean
+            novelty is computed
+        delta: novelty over the mean required for an onset
+        wait: minimum ms between onsets
+
+    Interal Variables
+        frames: amount of frames computed
+        novelty: novelty of the frames not yet decided, preceded by those
+            in their pre_max and pre_avg range
+        decided: amount of frames decided
+    '''
+
+    def __init__(self, sample_rate, frame_size=2048, hop=10,
+                 compression=100, pre_max=30, post_max=30, pre_avg=100,
+                 post_avg=70, delta=0.1, wait=30):
+        self.sample_rate = sample_rate
+        self.frame_size = frame_size
+        self.hop = hop
+        self.compression = compression
+        self.delta = delta
+
+        self.hop_size = int(round(sample_rate * hop / 1000.))
+        frames = lambda ms: int(round(ms / float(hop)))
+        self.pre_max, self.post_max = frames(pre_max), frames(post_max)
+        self.pre_avg, self.post_avg = frames(pre_avg), frames(post_avg)
+        self.wait = frames(wait)
+        self.pre = max(self.pre_max, self.pre_avg)
+        self.post = max(self.post_max, self.post_avg)
+
+        self._window = np.hanning(frame_size)
+        self._samples = np.zeros(0)
+        self._spectrum = None
+        self.frames = 0
+        self.novelty = np.zeros(self.pre)
+        self.decided = 0
+        self._last_onset = -self.wait - 1
+
+    def _frame_novelty(self):
+        'Computes the novelty of the complete frames in the sample buffer'
+        n_frames = (len(self._samples) - self.frame_size) // self.hop_size + 1
+        if n_frames <= 0:
+            return np.zeros(0)
+        frames = sliding_window_view(
+            self._samples[:(n_frames - 1) * self.hop_size + self.frame_size],
+            self.frame_size)[::self.hop_size]
+        spectra = np.log1p(self.compression * np.abs(
+            np.fft.rfft(frames * self._window, axis=1)))
+        if self._spectrum is None:
+            # The noise floor at the start is not an onset
+            self._spectrum = spectra[0]
+        diff = np.diff(np.vstack([self._spectrum, spectra]), axis=0)
+        self._spectrum = spectra[-1]
+        self._samples = self._samples[n_frames * self.hop_size:]
+        self.frames += n_frames
+        return np.maximum(diff, 0).mean(axis=1)
+
+    def _pick(self, available):
+        '''
+        Decides the frames whose lookahead is within the available frames.
+
+        Returns:
+            onset times [ms]
+        '''
+        n = available - self.post - self.decided
+        if n <= 0:
+            return []
+        nov = self.novelty
+        # nov[i] is the novelty of frame decided - pre + i
+        centers = np.arange(self.pre, self.pre + n)
+        maxs = sliding_window_view(
+            nov, self.pre_max + self.post_max + 1).max(axis=1)
+        maxs = maxs[centers - self.pre_max]
+        sums = np.concatenate([[0], np.cumsum(nov)])
+        means = ((sums[centers + self.post_avg + 1] -
+                  sums[centers - self.pre_avg]) /
+                 (self.pre_avg + self.post_avg + 1))
+        values = nov[centers]
+        peaks = np.flatnonzero((values >= maxs) &
+                               (values >= means + self.delta) &
+                               (values > 0))
+
+        onsets = []
+        for p in peaks:
+            frame = self.decided + p
+            if frame - self._last_onset > self.wait:
+                # Frames are timed at their center
+                onsets.append((frame * self.hop_size + self.frame_size / 2.) *
+                              1000. / self.sample_rate)
+                self._last_onset = frame
+        self.decided += n
+        self.novelty = nov[n:]
+        return onsets
+
+    def process(self, samples):
+        '''
+        Adds samples to the stream.
+
+        Returns:
+            onset times [ms] determined with them
+        '''
+        self._samples = np.concatenate([self._samples,
+                                        np.asarray(samples, dtype=float)])
+        self.novelty = np.concatenate([self.novelty, self._frame_novelty()])
+        return self._pick(self.frames)
+
+    def flush(self):
+        '''
+        Ends the stream.
+
+        Returns:
+            the remaining onset times [ms]
+        '''
+        pad = self.frame_size // 2 + self.hop_size - 1
+        self._samples = np.concatenate([self._samples, np.zeros(pad)])
+        self.novelty = np.concatenate([self.novelty, self._frame_novelty(),
+                                       np.zeros(self.post)])
+        return self._pick(self.frames + self.post)
+
+
+def _to_float(samples):
+    'Converts PCM samples to float mono samples in [-1, 1]'
+    if samples.dtype == np.uint8:
+        samples = (samples.astype(float) - 128) / 128.
+    elif samples.dtype.kind == 'i':
+        samples = samples.astype(float) / (2 ** (8 * samples.itemsize - 1))
+    else:
+        samples = samples.astype(float)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    return samples
+
+
+def wav_onsets(filename, chunk_size=2 ** 16, **kwargs):
+    '''
+    Detects the onsets of a WAV file, reading it in chunks through a memory
+    map.
+
+    Args:
+        filename: WAV filename
+        chunk_size: samples read at a time
+        kwargs: SpectralFluxDetector arguments
+
+    Returns:
+        iterator of onset times [ms], yielded as they are determined
+    '''
+    try:
+        sample_rate, data = wavfile.read(filename, mmap=True)
+    except ValueError:
+        # Formats that cannot be memory mapped (e.g. 24 bit)
+        sample_rate, data = wavfile.read(filename)
+    detector = SpectralFluxDetector(sample_rate, **kwargs)
+    for start in range(0, len(data), chunk_size):
+        for onset in detector.process(_to_float(
+                data[start:start + chunk_size])):
+            yield onset
+    for onset in detector.flush():
+        yield onset
+
+
+def track_onsets(tracker, onsets, batch_size=16, clusterer=None):
+    '''
+    Tracks onsets as they are received.
+
+    Args:
+        tracker: TactusHypothesisTracker
+        onsets: iterable of sorted onset times [ms], e.g. wav_onsets
+        batch_size: amount of onsets added to the tracking at a time
+        clusterer: optional clustering.OnsetClusterer. Clusters are tracked,
+            weighted, as they are closed.
+
+    Returns:
+        A dict :: hypothesis_name -> HypothesisTracker
+    '''
+    state = None
+    batch = []
+    clustering = clusterer.start() if clusterer is not None else None
+
+    def add(onset_times, weights=None):
+        nonlocal state
+        if not len(onset_times):
+            return
+        if state is None:
+            state = tracker.start(np.array(onset_times, dtype=float),
+                                  onset_weights=weights)
+        else:
+            state.extend(onset_times, weights)
+        tracker.run(state)
+
+    def add_batch(batch):
+        if clustering is None:
+            add(batch)
+        else:
+            add(*clustering.push(batch))
+
+    for onset in onsets:
+        batch.append(onset)
+        if len(batch) >= batch_size:
+            add_batch(batch)
+            batch = []
+    if batch:
+        add_batch(batch)
+    if clustering is not None:
+        add(*clustering.flush())
+    return state.result() if state is not None else {}
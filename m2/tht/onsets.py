@@ -0,0 +1,63 @@
+'''Functions to obtain the onset times (in ms) of input files.
+
+Input files can be either an audio file (mp3 or wav), a midi file or an item
+of an onset corpus (see m2.tht.corpus). Audio onsets are extracted with
+m2.beatroot, or for wav files with the built-in onset_detection.wav_onsets,
+and midi onsets with m2.midi, which are imported only when needed.
+'''
+
+import numpy as np
+
+DETECTORS = ['beatroot', 'spectral_flux']
+
+
+def load_onsets(in_file, detector='beatroot', item=None):
+    '''
+    Obtains the onset times of a music file.
+
+    Args:
+        in_file: filename of an audio or midi file, or of an onset corpus
+        detector: audio onset detector, one of DETECTORS. spectral_flux
+            only supports wav files.
+        item: id of the item of an onset corpus
+
+    Returns:
+        :: [ms]
+
+    Raises:
+        ValueError if the type of in_file is not recognized or not
+        supported by the detector, or if the corpus item is missing.
+    '''
+    if detector not in DETECTORS:
+        raise ValueError('Unknown onset detector: {}'.format(detector))
+    from m2.tht import corpus
+    if corpus.is_corpus(in_file):
+        if item is None:
+            raise ValueError('An item is required to load onsets from the '
+                             'corpus {}'.format(in_file))
+        try:
+            return np.array(corpus.OnsetCorpus(in_file)[item])
+        except KeyError as e:
+            raise ValueError(e.args[0])
+    elif item is not None:
+        raise ValueError('{} is not an onset corpus'.format(in_file))
+    import filetype
+
+    in_ft = filetype.guess(in_file)
+    if in_ft is None:
+        raise ValueError('Unrecognized input file: {}'.format(in_file))
+
+    if (in_ft.extension.startswith('midi')):
+        from m2 import midi
+        m = midi.MidiPlayback(in_file)
+        return m.onset_times_in_ms()
+    elif detector == 'spectral_flux':
+        if in_ft.extension != 'wav':
+            raise ValueError('The spectral_flux detector only supports wav '
+                             'files: {}'.format(in_file))
+        from m2.tht import onset_detection
+        return np.array(list(onset_detection.wav_onsets(in_file)))
+    else:
+        from m2.beatroot import beatroot
+        onsets = beatroot(in_file, onsets=True)
+        return np.array(onsets) * 1000.
@@ -0,0 +1,267 @@
+'''Hypothesis-parallel updates of the tracking steps.
+
+With large hypothesis populations most of a TactusHypothesisTracker step is
+spent correcting and evaluating each live hypothesis, which are independent
+of each other. A HypothesisPool splits the live hypotheses of a step into
+contiguous slices updated by a persistent pool of worker processes.
+
+The onset times (and weights) are published once per run in a shared memory
+block, from which workers build their own playback of the discovered onsets
+(and so of each window). Per step, a worker only receives the (start_idx,
+end_idx, rho, delta) of its slice, the last correction and the states (see
+HypothesisTracker.states) of each hypothesis tracker, and returns a float
+array with the fields of each correction and the confidence, and the updated
+states. Trimming and the k-best selection stay in the parent.
+
+The result is identical to the serial tracking as long as the evaluation and
+correction of a hypothesis only depend on those values and the onsets.
+Functions that do not, e.g. those sharing results among the hypotheses of a
+step (confidence.MemoizedEval) or reading older corrections, are
+declared with a false parallel_safe attribute and refused by HypothesisPool.
+'''
+
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from m2.tht import hypothesis
+from m2.tht import playback
+from m2.tht.correction import HypothesisCorrection
+
+# HypothesisCorrection fields exchanged with the workers, in order. The
+# optional ones are NaN when missing (None).
+CORRECTION_FIELDS = ['o_rho', 'o_delta', 'n_rho', 'n_delta', 'r_value',
+                     'p_value', 'stderr', 'o_mse', 'n_mse', 'd_rho',
+                     'd_delta']
+
+# shared memory name -> (SharedMemory, OnsetIndex, weights)
+_onsets = {}
+
+
+def _attach(name, length, dtype, weighted):
+    '''
+    (OnsetIndex, weights) over the onsets published in shared memory block
+    name, where weights is None if the onsets are not weighted
+    '''
+    if name not in _onsets:
+        for shm, _, _ in _onsets.values():
+            shm.close()
+        _onsets.clear()
+        shm = shared_memory.SharedMemory(name=name)
+        onset_times = np.ndarray((length,), dtype=dtype, buffer=shm.buf)
+        weights = (np.ndarray((length,), dtype=float, buffer=shm.buf,
+                              offset=onset_times.nbytes)
+                   if weighted else None)
+        _onsets[name] = (shm, playback.OnsetIndex(onset_times, copy=False),
+                         weights)
+    return _onsets[name][1:]
+
+
+def is_parallel_safe(f):
+    '''
+    Whether the evaluation or correction function f, and the functions it
+    wraps (as eval_f or corr_f), may update hypotheses in the workers.
+    Functions are safe unless their parallel_safe attribute is false.
+    '''
+    while f is not None:
+        if not getattr(f, 'parallel_safe', True):
+            return False
+        f = getattr(f, 'eval_f', None) or getattr(f, 'corr_f', None)
+    return True
+
+
+def _pack(correction, conf):
+    'Correction fields and confidence as (values, present)'
+    values = [getattr(correction, f) for f in CORRECTION_FIELDS] + [conf]
+    return ([np.nan if v is None else v for v in values],
+            [v is not None for v in values])
+
+
+def _unpack(values, present):
+    'Inverse of _pack, returns (correction, conf)'
+    values = [v if p else None for v, p in zip(values, present)]
+    correction = HypothesisCorrection(**dict(zip(CORRECTION_FIELDS,
+                                                 values)))
+    return correction, values[-1]
+
+
+def update_slice(index, discovered_index, hts_info, corr_f, eval_f,
+                 weights=None, states=None, last_corrections=None):
+    '''
+    Updates hypotheses on the onsets of index discovered up to
+    discovered_index.
+
+    Args:
+        index: OnsetIndex
+        discovered_index: index of the last discovered onset
+        hts_info: float array with a row (start_idx, end_idx, rho, delta)
+            per hypothesis
+        corr_f: correction function
+        eval_f: evaluation function, None to only correct
+        weights: weights of the onsets of index, None if not weighted
+        states: HypothesisTracker.states of each hypothesis, None for empty
+            states
+        last_corrections: [(onset_idx, correction)] with the last entry of
+            HypothesisTracker.corr of each hypothesis, empty if it was not
+            corrected before. None if no hypothesis was corrected before.
+
+    Returns:
+        (values, present, states): float array with a row per hypothesis
+        with the CORRECTION_FIELDS and the confidence (NaN if not
+        evaluated), a boolean array with whether each value is not None and
+        the updated states of each hypothesis
+    '''
+    # Imported here as the tracker module imports this one
+    from m2.tht.tactus_hypothesis_tracker import HypothesisTracker
+
+    ongoing_play = playback.OngoingPlayback(index.onset_times, index, weights)
+    ongoing_play.up_to_discovered_index = discovered_index + 1
+    shape = (len(hts_info), len(CORRECTION_FIELDS) + 1)
+    values = np.empty(shape)
+    present = np.empty(shape, dtype=bool)
+    if states is None:
+        states = [{} for _ in hts_info]
+    if last_corrections is None:
+        last_corrections = [[] for _ in hts_info]
+    for i, (start_idx, end_idx, rho, delta) in enumerate(hts_info):
+        ht = HypothesisTracker(int(start_idx), int(end_idx),
+                               index.onset_times)
+        ht.htuple = hypothesis.Hypothesis(rho, delta)
+        ht.states = states[i]
+        ht.corr = list(last_corrections[i])
+        ht.correct(ongoing_play, corr_f)
+        conf = None
+        if eval_f is not None:
+            ht.evaluate(ongoing_play, eval_f)
+            conf = ht.conf
+        values[i], present[i] = _pack(ht.corr[-1][1], conf)
+    return values, present, states
+
+
+def _run_slice(job):
+    (name, length, dtype, weighted, discovered_index, hts_info, states,
+     last_corrections, corr_f, eval_f) = job
+    index, weights = _attach(name, length, dtype, weighted)
+    return update_slice(index, discovered_index, hts_info, corr_f, eval_f,
+                        weights, states, last_corrections)
+
+
+class HypothesisPool():
+    '''
+    Updates the hypotheses of each tracking step over a pool of worker
+    processes. See the module documentation.
+
+    The pool is started on first use and kept until close (it may be used as
+    a context manager). Evaluation and correction functions that are not
+    parallel safe (see is_parallel_safe) are refused. It is not pickled
+    with its tracker, a copy starts its own pool.
+
+    Args:
+        processes: size of the worker pool, None uses a process per cpu
+        min_hypotheses: steps with fewer hypotheses are updated in the
+            calling process, where the cost of the exchange with the workers
+            is not compensated
+    '''
+
+    def __init__(self, processes=None, min_hypotheses=64):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.min_hypotheses = min_hypotheses
+        self._pool = None
+        self._shm = None
+        self._published = None
+
+    def __getstate__(self):
+        return {'processes': self.processes,
+                'min_hypotheses': self.min_hypotheses}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _publish(self, onset_times, weights):
+        'Copies onset_times, followed by weights if any, to a new block'
+        self._release()
+        size = onset_times.nbytes
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+            size += weights.nbytes
+        self._shm = shared_memory.SharedMemory(create=True,
+                                               size=max(size, 1))
+        shared = np.ndarray(onset_times.shape, dtype=onset_times.dtype,
+                            buffer=self._shm.buf)
+        shared[:] = onset_times
+        if weights is not None:
+            shared = np.ndarray(weights.shape, dtype=float,
+                                buffer=self._shm.buf,
+                                offset=onset_times.nbytes)
+            shared[:] = weights
+        self._published = onset_times
+
+    def _release(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+        self._shm = None
+        self._published = None
+
+    def update(self, hts, ongoing_play, corr_f, eval_f=None):
+        '''
+        Corrects the hypothesis trackers hts with corr_f and, if given,
+        evaluates them with eval_f for the last discovered onset, as
+        HypothesisTracker.correct and evaluate do.
+
+        Raises:
+            ValueError: if corr_f or eval_f are not parallel safe
+        '''
+        for f in (corr_f, eval_f):
+            if not is_parallel_safe(f):
+                raise ValueError('{} cannot update hypotheses in parallel '
+                                 'workers'.format(f))
+        if len(hts) < self.min_hypotheses:
+            for ht in hts:
+                ht.correct(ongoing_play, corr_f)
+                if eval_f is not None:
+                    ht.evaluate(ongoing_play, eval_f)
+            return
+
+        onset_times = ongoing_play.onset_times
+        if self._published is not onset_times:
+            self._publish(onset_times, ongoing_play.weights)
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+
+        hts_info = np.array([ht.onset_indexes + (ht.r, ht.d) for ht in hts],
+                            dtype=float)
+        step = ongoing_play.discovered_index
+        bounds = np.cumsum([0] + [len(info) for info in
+                                  np.array_split(hts_info, self.processes)])
+        jobs = [(self._shm.name, len(onset_times), onset_times.dtype.str,
+                 ongoing_play.weights is not None, step, hts_info[s:e],
+                 [ht.states for ht in hts[s:e]],
+                 [ht.corr[-1:] for ht in hts[s:e]], corr_f, eval_f)
+                for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+        results = self._pool.map(_run_slice, jobs)
+
+        rows = (row for values, present, states in results
+                for row in zip(values, present, states))
+        for ht, (row, present, states) in zip(hts, rows):
+            correction, conf = _unpack(row, present)
+            ht.states = states
+            ht.corr.append((step, correction))
+            ht.htuple = correction.new_hypothesis()
+            if eval_f is not None:
+                ht.confs.append((step, conf))
+
+    def close(self):
+        'Stops the workers and releases the shared onsets'
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self._release()
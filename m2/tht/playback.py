@@ -9,10 +9,18 @@ class Playback():
 
     Has the same interface as OngoingPlayback except for the discovering
     methods.
+
+    Onsets may be weighted (e.g. by the amount of onsets merged into each,
+    see m2.tht.clustering). Without weights, every onset has weight 1.
     """
 
-    def __init__(self, onset_times):
+    # Playbacks pickled before weights existed (e.g. checkpoints) unpickle
+    # without them
+    weights = None
+
+    def __init__(self, onset_times, weights=None):
         self.onset_times = onset_times
+        self.weights = weights
 
     @property
     def min(self):
@@ -28,6 +36,24 @@ class Playback():
         'Onsets discovered at the moment'
         return self.onset_times
 
+    def discovered_weights(self):
+        'Weights of the onsets discovered at the moment'
+        if self.weights is None:
+            return np.ones(len(self.discovered_play()))
+        return np.asarray(self.weights)[:len(self.discovered_play())]
+
+    def discovered_window(self, window):
+        'Discovered onsets later than `window` ms before the last one'
+        discovered_onsets = np.array(self.discovered_play())
+        return discovered_onsets[discovered_onsets >
+                                 discovered_onsets[-1] - window]
+
+    def window_weights(self, window):
+        'Weights of the onsets in discovered_window(window)'
+        discovered_onsets = np.array(self.discovered_play())
+        return self.discovered_weights()[discovered_onsets >
+                                         discovered_onsets[-1] - window]
+
 
 class OngoingPlayback(Playback):
     """Represents a playback that is discovered onset by onset.
@@ -40,10 +66,17 @@ class OngoingPlayback(Playback):
         onset_times: numpy array of all milliseconds with events in order
         up_to_discovered_index: index up to which all events were discovered
             (not inclusive)
+        index: OnsetIndex over onset_times
+        weights: numpy array of the weight of each onset, or None
     """
 
-    def __init__(self, onset_times):
-        self.onset_times = np.array(onset_times)
+    def __init__(self, onset_times, index=None, weights=None):
+        if index is None:
+            index = OnsetIndex(onset_times)
+        self.index = index
+        self.onset_times = index.onset_times
+        self.weights = (None if weights is None
+                        else np.array(weights, dtype=float))
         self.up_to_discovered_index = 1
 
     def advance(self):
@@ -70,3 +103,106 @@ class OngoingPlayback(Playback):
 
     def discovered_play(self):
         return self.onset_times[:self.up_to_discovered_index]
+
+    def extend(self, onset_times, weights=None):
+        '''
+        Appends onsets, which must come after the current ones, with their
+        weights if the playback is weighted
+        '''
+        if (weights is None) != (self.weights is None):
+            raise ValueError('Weights must be given for weighted playbacks '
+                             'only')
+        self.index = OnsetIndex(np.concatenate([self.onset_times,
+                                                np.asarray(onset_times)]))
+        self.onset_times = self.index.onset_times
+        if weights is not None:
+            self.weights = np.concatenate([self.weights,
+                                           np.asarray(weights, dtype=float)])
+
+    def discovered_weights(self):
+        if self.weights is None:
+            return np.ones(self.up_to_discovered_index)
+        return self.weights[:self.up_to_discovered_index]
+
+    def discovered_window(self, window):
+        start = self.index.window_starts(window)[self.discovered_index]
+        return self.onset_times[start:self.up_to_discovered_index]
+
+    def window_weights(self, window):
+        start = self.index.window_starts(window)[self.discovered_index]
+        return self.discovered_weights()[start:]
+
+
+class OnsetIndex():
+    """Precomputed lookups over a sorted set of onset times.
+
+    Lookups only depend on the onset times, so a single index can be shared
+    by every tracker run over the same onsets. Results are cached by their
+    parameters.
+
+    Interal Variables
+        onset_times: numpy array of all milliseconds with events in order
+    """
+
+    def __init__(self, onset_times, copy=True):
+        '''
+        Args:
+            onset_times: sorted [ms]
+            copy: whether to copy onset_times. If False, a numpy array is
+                used as given (e.g. one in shared memory).
+        '''
+        self.onset_times = (np.array(onset_times) if copy
+                            else np.asarray(onset_times))
+        self._window_starts = {}
+        self._pair_ranges = {}
+
+    def __len__(self):
+        return len(self.onset_times)
+
+    def window_starts(self, window):
+        '''
+        Array with, for each onset index i, the first index j such that
+        onset_times[j] > onset_times[i] - window.
+        '''
+        if window not in self._window_starts:
+            t = self.onset_times
+            self._window_starts[window] = np.searchsorted(t, t - window,
+                                                          side='right')
+        return self._window_starts[window]
+
+    def pair_ranges(self, min_delta, max_delta):
+        '''
+        Arrays (lo, hi) such that, for each onset index i, the onsets k < i
+        with min_delta <= onset_times[i] - onset_times[k] <= max_delta are
+        exactly those in range(lo[i], hi[i]).
+        '''
+        key = (min_delta, max_delta)
+        if key not in self._pair_ranges:
+            self._pair_ranges[key] = self._compute_pair_ranges(min_delta,
+                                                               max_delta)
+        return self._pair_ranges[key]
+
+    def _compute_pair_ranges(self, min_delta, max_delta):
+        t = self.onset_times
+        idx = np.arange(len(t))
+        lo = np.minimum(np.searchsorted(t, t - max_delta, side='left'), idx)
+        hi = np.minimum(np.searchsorted(t, t - min_delta, side='right'), idx)
+
+        # The searches compare against t[i] - delta, which may round
+        # differently than t[i] - t[k]. Boundaries are moved until they agree
+        # with the direct comparison.
+        def fix(bound, lower, step_down, step_up):
+            while True:
+                down = (bound > lower) & step_down(np.maximum(bound - 1, 0))
+                up = (bound < idx) & step_up(np.minimum(bound, idx))
+                if not (down.any() or up.any()):
+                    return bound
+                bound = bound - down + up
+
+        lo = fix(lo, 0,
+                 lambda k: t - t[k] <= max_delta,
+                 lambda k: t - t[k] > max_delta)
+        hi = fix(hi, lo,
+                 lambda k: t - t[k] < min_delta,
+                 lambda k: t - t[k] >= min_delta)
+        return lo, np.maximum(lo, hi)
@@ -0,0 +1,148 @@
+'''Utilities to run the Tactus Hypothesis Tracker under real-time constraints.'''
+
+import time
+
+
+class DeadlineController():
+    '''
+    Adapts the hypothesis budget of a TactusHypothesisTracker so that each
+    onset is processed within a deadline.
+
+    The cost of a tracking step is modeled as proportional to the number of
+    hypothesis trackers updated on it. The cost per update is estimated from
+    the measured duration of previous steps (exponential moving average) and
+    before each step the controller plans how many trackers fit in
+    `headroom * deadline`:
+        * live trackers beyond the budget are dropped, keeping those with
+          best confidence,
+        * new candidates are admitted up to the remaining budget, evenly
+          subsampled over the candidates so that the range of periods is
+          still covered,
+        * the effective max_hypotheses kept after the step is lowered
+          accordingly.
+
+    The controller keeps statistics about the degradation, see report.
+
+    Args:
+        deadline: ms available for each onset
+        headroom: fraction of the deadline the plan aims for
+        min_hypotheses: lower limit for the effective max_hypotheses
+        min_candidates: lower limit for the admitted new candidates
+        smoothing: weight of the last step on the cost estimate
+        clock: function returning the current time in seconds
+    '''
+
+    def __init__(self, deadline, headroom=0.8, min_hypotheses=1,
+                 min_candidates=1, smoothing=0.2, clock=time.perf_counter):
+        self.deadline = deadline
+        self.headroom = headroom
+        self.min_hypotheses = min_hypotheses
+        self.min_candidates = min_candidates
+        self.smoothing = smoothing
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        'Forgets the cost estimate and the degradation statistics'
+        self.cost = None
+        self.steps = 0
+        self.degraded_steps = 0
+        self.missed_deadlines = 0
+        self.max_overrun = 0.0
+        self.dropped_live = 0
+        self.dropped_candidates = 0
+        self.budget_reduction = 0
+        self._started = None
+
+    def budget(self):
+        'Amount of tracker updates that fit in a step. None if unknown'
+        if self.cost is None:
+            return None
+        return max(self.min_hypotheses + self.min_candidates,
+                   int(self.deadline * self.headroom / self.cost))
+
+    def step_started(self):
+        self._started = self.clock()
+
+    def plan(self, max_hypotheses, n_live, n_new):
+        '''
+        Plans the tracking step.
+
+        Args:
+            max_hypotheses: configured max hypotheses of the tracker
+            n_live: amount of live hypothesis trackers
+            n_new: amount of new candidates generated on the step
+
+        Returns:
+            (max_hypotheses, n_live, n_new) to use on the step
+        '''
+        budget = self.budget()
+        if budget is None or (n_live + n_new <= budget and
+                              max_hypotheses <= budget):
+            return max_hypotheses, n_live, n_new
+
+        k = max(self.min_hypotheses,
+                min(max_hypotheses, budget - self.min_candidates))
+        live = min(n_live, k)
+        new = min(n_new, max(self.min_candidates, budget - live))
+        if (k, live, new) != (max_hypotheses, n_live, n_new):
+            self.degraded_steps += 1
+            self.dropped_live += n_live - live
+            self.dropped_candidates += n_new - new
+            self.budget_reduction += max_hypotheses - k
+        return k, live, new
+
+    def admit(self, candidates, n):
+        'Evenly subsamples n candidates, keeping their order'
+        if n >= len(candidates):
+            return candidates
+        if n <= 0:
+            return []
+        if n == 1:
+            return [candidates[len(candidates) // 2]]
+        step = (len(candidates) - 1) / float(n - 1)
+        return [candidates[int(round(i * step))] for i in range(n)]
+
+    def step_done(self, n_updated):
+        'Registers the end of a step where n_updated trackers were updated'
+        elapsed = (self.clock() - self._started) * 1000
+        self.steps += 1
+        if elapsed > self.deadline:
+            self.missed_deadlines += 1
+            self.max_overrun = max(self.max_overrun, elapsed - self.deadline)
+
+        if n_updated > 0:
+            cost = elapsed / n_updated
+            self.cost = (cost if self.cost is None
+                         else (self.smoothing * cost +
+                               (1 - self.smoothing) * self.cost))
+
+    def report(self):
+        '''
+        Degradation statistics since the last reset.
+
+        Returns:
+            dict with
+                steps: steps performed
+                degraded_steps: steps where the budget was reduced
+                degraded_fraction: degraded_steps / steps
+                missed_deadlines: steps that took longer than the deadline
+                max_overrun: ms of the worst missed deadline
+                dropped_live: live trackers dropped before their update
+                dropped_candidates: new candidates not admitted
+                mean_budget_reduction: mean reduction of max_hypotheses over
+                    degraded steps
+        '''
+        return {
+            'steps': self.steps,
+            'degraded_steps': self.degraded_steps,
+            'degraded_fraction': (self.degraded_steps / float(self.steps)
+                                  if self.steps else 0.0),
+            'missed_deadlines': self.missed_deadlines,
+            'max_overrun': self.max_overrun,
+            'dropped_live': self.dropped_live,
+            'dropped_candidates': self.dropped_candidates,
+            'mean_budget_reduction': (
+                self.budget_reduction / float(self.degraded_steps)
+                if self.degraded_steps else 0.0)
+        }
@@ -0,0 +1,136 @@
+'''Seeding stages that restrict the hypothesis candidates generated by a
+TactusHypothesisTracker at each step.'''
+
+import collections
+import math
+
+import numpy as np
+
+
+class IOIHistogramSeeder():
+    '''
+    Admits only candidates whose period relates to the recent inter-onset
+    interval (IOI) structure.
+
+    A histogram of the IOIs between all pairs of onsets discovered within a
+    window is updated incrementally as onsets are discovered. A candidate
+    hypothesis is admitted if its delta, multiplied by one of `ratios`, lies
+    within `tolerance` (relative) of one of the `peaks` highest peaks of the
+    histogram. All candidates are admitted until the histogram holds
+    `min_iois` intervals.
+
+    Configuration is shared among runs. The per run state is created with
+    start and kept in the TrackingState.
+
+    Args:
+        window: ms of discovered onsets considered in the histogram
+        bin_width: ms of the histogram bins
+        peaks: amount of histogram peaks candidates are compared to
+        tolerance: max relative distance between a candidate and a peak
+        ratios: multiples and fractions of candidate deltas compared
+        min_iois: intervals needed in the histogram before filtering
+    '''
+
+    def __init__(self, window=6000, bin_width=10, peaks=3, tolerance=0.05,
+                 ratios=(1, 2, 3, 1 / 2., 1 / 3.), min_iois=8):
+        self.window = window
+        self.bin_width = bin_width
+        self.peaks = peaks
+        self.tolerance = tolerance
+        self.ratios = ratios
+        self.min_iois = min_iois
+        self._last_seeding = None
+
+    def start(self, min_delta, max_delta):
+        'Returns the seeding state for a run with the given delta range'
+        self._last_seeding = IOISeeding(self, min_delta * min(self.ratios),
+                                       max_delta * max(self.ratios))
+        return self._last_seeding
+
+    def report(self):
+        'Report of the last run, see IOISeeding.report'
+        return self._last_seeding.report() if self._last_seeding else {}
+
+
+class IOISeeding():
+    '''
+    Per run state of an IOIHistogramSeeder.
+
+    Interal Variables
+        histogram: IOI counts per bin, bin i holds [i, i + 1) * bin_width
+        window: discovered onsets within the seeder window
+        processed: amount of onsets added to the histogram
+        considered: amount of candidates considered
+        admitted: amount of candidates admitted
+    '''
+
+    def __init__(self, seeder, min_ioi, max_ioi):
+        self.seeder = seeder
+        self.min_ioi = min_ioi
+        self.max_ioi = max_ioi
+        self.histogram = np.zeros(
+            int(math.ceil(max_ioi / seeder.bin_width)) + 1)
+        self.window = collections.deque()
+        self.processed = 0
+        self.considered = 0
+        self.admitted = 0
+
+    def _account(self, iois, count):
+        iois = iois[(iois >= self.min_ioi) & (iois <= self.max_ioi)]
+        bins = (iois / self.seeder.bin_width).astype(int)
+        np.add.at(self.histogram, bins, count)
+
+    def update(self, ongoing_play):
+        'Adds the onsets discovered since the last update to the histogram'
+        onset_times = ongoing_play.onset_times
+        while self.processed <= ongoing_play.discovered_index:
+            t = onset_times[self.processed]
+            self.processed += 1
+            while self.window and self.window[0] <= t - self.seeder.window:
+                o = self.window.popleft()
+                self._account(np.array(self.window) - o, -1)
+            self._account(t - np.array(self.window), 1)
+            self.window.append(t)
+
+    def peaks(self):
+        'Centers (ms) of the highest peaks of the smoothed histogram'
+        h = np.convolve(self.histogram, [1, 2, 1], 'same')
+        local = ((h[1:-1] >= h[:-2]) & (h[1:-1] > h[2:]) &
+                 (h[1:-1] > 0))
+        idx = np.nonzero(local)[0] + 1
+        top = idx[np.argsort(-h[idx], kind='stable')][:self.seeder.peaks]
+        return (top + 0.5) * self.seeder.bin_width
+
+    def admits(self, deltas):
+        'Boolean array with whether each delta is admitted'
+        deltas = np.asarray(deltas, dtype=float)
+        if self.histogram.sum() < self.seeder.min_iois:
+            return np.ones(len(deltas), dtype=bool)
+        peaks = self.peaks()
+        related = deltas[:, None] * np.array(self.seeder.ratios)[None, :]
+        near = (np.abs(related[:, :, None] - peaks[None, None, :]) <=
+                self.seeder.tolerance * peaks[None, None, :])
+        return near.any(axis=(1, 2))
+
+    def select(self, hts):
+        'Filters hypothesis trackers, keeping the admitted ones'
+        self.considered += len(hts)
+        if not hts:
+            return hts
+        admitted = self.admits([ht.d for ht in hts])
+        hts = [ht for ht, a in zip(hts, admitted) if a]
+        self.admitted += len(hts)
+        return hts
+
+    def report(self):
+        '''
+        Returns:
+            dict with the candidates considered and admitted and the
+            reduction (fraction of candidates not admitted)
+        '''
+        return {
+            'considered': self.considered,
+            'admitted': self.admitted,
+            'reduction': (1 - self.admitted / float(self.considered)
+                          if self.considered else 0.0)
+        }
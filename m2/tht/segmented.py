@@ -0,0 +1,287 @@
+'''Segment-parallel tracking of long playbacks.
+
+The onsets are split in consecutive segments which are tracked independently
+over a process pool. Each segment is tracked starting some time before it
+(the overlap) so that its hypotheses are warmed up by the time the segment
+starts. Only the tracking steps of the onsets in the segment itself are kept
+and the hypothesis trackers of all segments are stitched by the onsets that
+originated them or, for the hypotheses originated in an overlap, by their
+closeness to the hypotheses of the previous segment. This produces a result
+that can be used as the result of a sequential TactusHypothesisTracker run
+(e.g. for top_hypothesis and produce_beats_information).
+
+The result is an approximation of the sequential tracking, see divergence.
+'''
+
+import multiprocessing
+import time
+
+import numpy as np
+
+from m2.tht import evaluation
+from m2.tht import tracker_analysis
+from m2.tht.tactus_hypothesis_tracker import HypothesisTracker
+
+
+def _windows(tracker):
+    'Windows (ms) declared by the evaluation and correction functions'
+    windows = [getattr(f, 'window', None)
+               for f in (tracker.eval_f, tracker.corr_f)]
+    return [w for w in windows if w is not None]
+
+
+def required_overlap(tracker):
+    '''
+    Minimum overlap (ms) for the tracker: the largest window of its
+    evaluation and correction functions.
+
+    Raises:
+        ValueError if neither function declares a window.
+    '''
+    windows = _windows(tracker)
+    if not windows:
+        raise ValueError('Tracker functions do not declare a window, an '
+                         'overlap must be given')
+    return max(windows)
+
+
+def segment_bounds(onset_times, segment_length, overlap):
+    '''
+    Splits onsets into segments.
+
+    Args:
+        onset_times: sorted [ms]
+        segment_length: ms of each segment
+        overlap: ms tracked before each segment
+
+    Returns:
+        [(start, first, last)] onset indexes where the segment owns the
+        onsets first..last (inclusive) and is tracked from start.
+    '''
+    onset_times = np.asarray(onset_times)
+    firsts = np.searchsorted(
+        onset_times,
+        np.arange(onset_times[0], onset_times[-1], segment_length),
+        side='left')
+    firsts = np.unique(firsts)
+    lasts = np.append(firsts[1:] - 1, len(onset_times) - 1)
+    starts = np.searchsorted(onset_times, onset_times[firsts] - overlap,
+                             side='left')
+    return [(int(s), int(f), int(l))
+            for s, f, l in zip(starts, firsts, lasts)]
+
+
+def _track_segment(job):
+    tracker, onset_times, start, first = job
+    hts = tracker(onset_times)
+    ret = []
+    for ht in hts.values():
+        corr = [(idx + start, c) for idx, c in ht.corr if idx + start >= first]
+        confs = [(idx + start, c) for idx, c in ht.confs
+                 if idx + start >= first]
+        if confs:
+            a, b = ht.onset_indexes
+            ret.append((a + start, b + start, corr, confs))
+    return ret
+
+
+def _nearest_beat(hypothesis, time):
+    'Beat (ms) of (rho, delta) nearest to time'
+    rho, delta = hypothesis
+    return rho + delta * np.round((time - rho) / delta)
+
+
+def _overlap_match(ht, corr, tolerance):
+    '''
+    Distance between the hypothesis of a tracker at the end of a segment and
+    the hypothesis of a segment result before its first correction, or None
+    if they are farther than tolerance (ms) in period or in phase.
+    '''
+    idx, first = corr[0]
+    start = (first.o_rho, first.o_delta)
+    time = ht.onset_times[idx]
+    period = abs(ht.d - start[1])
+    beat = _nearest_beat(start, time)
+    phase = abs(beat - _nearest_beat((ht.r, ht.d), beat))
+    if period > tolerance or phase > tolerance:
+        return None
+    return max(period, phase)
+
+
+def stitch(onset_times, segment_results, tolerance=20.0):
+    '''
+    Builds a tracking result from segment results.
+
+    Segment results are continued by the hypothesis trackers with the same
+    name. A result originated in the overlap of its segment (so that it has
+    no tracker of the previous segment with its name) continues the tracker
+    of the previous segment whose hypothesis is closest to it, in period and
+    in phase at the first onset of the segment, if it is within tolerance
+    and no other result of the segment continues it.
+
+    Args:
+        onset_times: [ms]
+        segment_results: list with the result of each segment, in order.
+            Each result is a list of (start_idx, end_idx, corr, confs) with
+            global onset indexes.
+        tolerance: ms within which hypotheses match in period and phase.
+
+    Returns:
+        A dict :: hypothesis_name -> HypothesisTracker
+    '''
+    onset_times = np.array(onset_times)
+    hts = {}
+    aliases = {}
+    previous = set()
+    for results in segment_results:
+        names = ['%d-%d' % (a, b) for a, b, _, _ in results]
+        names = [aliases.get(name, name) for name in names]
+        continued = set(names) & previous
+        candidates = []
+        for i, (name, (_, _, corr, _)) in enumerate(zip(names, results)):
+            if name in previous:
+                continue
+            for other in previous - continued:
+                distance = _overlap_match(hts[other], corr, tolerance)
+                if distance is not None:
+                    candidates.append((distance, i, other))
+        matched = set()
+        for _, i, other in sorted(candidates):
+            if i not in matched and other not in continued:
+                aliases[names[i]] = other
+                names[i] = other
+                matched.add(i)
+                continued.add(other)
+        for name, (a, b, corr, confs) in zip(names, results):
+            ht = hts.get(name)
+            if ht is None:
+                ht = HypothesisTracker(a, b, onset_times)
+                hts[ht.name] = ht
+            ht.corr.extend(corr)
+            ht.confs.extend(confs)
+            ht.htuple = corr[-1][1].new_hypothesis()
+        previous = set(names)
+    return hts
+
+
+def track_segmented(tracker, onset_times, segment_length=60000, overlap=None,
+                    warmup=None, processes=None):
+    '''
+    Tracks onset_times by segments over a process pool.
+
+    Args:
+        tracker: TactusHypothesisTracker (must be picklable)
+        onset_times: sorted [ms]
+        segment_length: ms of each segment
+        overlap: ms tracked before each segment. Defaults to
+            required_overlap(tracker) + warmup. It must be given if the
+            tracker functions do not declare a window.
+        warmup: ms added to the required overlap when overlap is not given.
+            Defaults to 4 beats of tracker.max_delta.
+        processes: size of the process pool. None uses a process per cpu and
+            1 tracks all segments in the current process.
+
+    Returns:
+        A dict :: hypothesis_name -> HypothesisTracker
+    '''
+    if overlap is None:
+        if warmup is None:
+            warmup = 4 * tracker.max_delta
+        overlap = required_overlap(tracker) + warmup
+    elif _windows(tracker) and overlap < required_overlap(tracker):
+        raise ValueError('Overlap is shorter than the tracker window')
+
+    onset_times = np.array(onset_times)
+    jobs = [(tracker, onset_times[start:last + 1], start, first)
+            for start, first, last in segment_bounds(onset_times,
+                                                     segment_length,
+                                                     overlap)]
+    if processes == 1:
+        results = list(map(_track_segment, jobs))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_track_segment, jobs)
+    return stitch(onset_times, results)
+
+
+def divergence(reference, hts, onset_times, beat_tolerance=70,
+               period_tolerance=0.05):
+    '''
+    Measures how much a tracking result diverges from a reference one (e.g.
+    a segmented tracking from the sequential tracking).
+
+    Args:
+        reference: dict :: hypothesis_name -> HypothesisTracker
+        hts: dict :: hypothesis_name -> HypothesisTracker
+        onset_times: [ms]
+        beat_tolerance: ms within which beats are considered equal
+        period_tolerance: relative period difference within which top
+            hypotheses are considered to agree on period
+
+    Returns:
+        dict with
+            compared_onsets: onsets with a top hypothesis on both results
+            top_agreement: fraction of those with the same top hypothesis
+            period_agreement: fraction of those where the top hypotheses
+                periods agree
+            congruence_error: mean absolute difference between the top
+                confidences
+            beat_f_measure: F-measure of the produced beats against the
+                reference beats
+    '''
+    n = len(onset_times)
+    ref_top = tracker_analysis.top_hypothesis(reference, n)
+    top = tracker_analysis.top_hypothesis(hts, n)
+    ref_top_d = dict(ref_top)
+    top_d = dict(top)
+    common = sorted(set(ref_top_d) & set(top_d))
+
+    def corrected(ht, idx):
+        return dict(ht.corr)[idx].new_hypothesis()
+
+    def conf(ht, idx):
+        return dict(ht.confs)[idx]
+
+    same = [ref_top_d[i].name == top_d[i].name for i in common]
+    ref_deltas = np.array([corrected(ref_top_d[i], i).d for i in common])
+    deltas = np.array([corrected(top_d[i], i).d for i in common])
+    conf_errors = [abs(conf(ref_top_d[i], i) - conf(top_d[i], i))
+                   for i in common]
+
+    ref_beats = (tracker_analysis.produce_beats_information(onset_times,
+                                                            ref_top)
+                 if ref_top else [])
+    beats = (tracker_analysis.produce_beats_information(onset_times, top)
+             if top else [])
+
+    return {
+        'compared_onsets': len(common),
+        'top_agreement': np.mean(same) if common else np.nan,
+        'period_agreement': (
+            np.mean(np.abs(deltas - ref_deltas) <=
+                    period_tolerance * ref_deltas)
+            if common else np.nan),
+        'congruence_error': np.mean(conf_errors) if common else np.nan,
+        'beat_f_measure': evaluation.f_measure(ref_beats, beats,
+                                               beat_tolerance)
+    }
+
+
+def compare_with_sequential(tracker, onset_times, **kwargs):
+    '''
+    Tracks onset_times sequentially and by segments (see track_segmented for
+    kwargs), reporting the divergence between both and their duration in
+    seconds (sequential_time and segmented_time).
+    '''
+    start = time.perf_counter()
+    reference = tracker(onset_times)
+    sequential_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hts = track_segmented(tracker, onset_times, **kwargs)
+    segmented_time = time.perf_counter() - start
+
+    report = divergence(reference, hts, onset_times)
+    report['sequential_time'] = sequential_time
+    report['segmented_time'] = segmented_time
+    return report
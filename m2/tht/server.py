@@ -0,0 +1,240 @@
+'''Long-lived tracking service.
+
+A TrackingServer keeps a pool of worker processes with the tracker modules
+imported and the trackers built, so that requests only pay for the tracking
+itself. Requests are served over a Unix domain socket (serve_unix) or a pair
+of streams such as stdin/stdout (serve_stream) with a line-delimited JSON
+protocol: each line holds a request object and each response is written as a
+line as soon as its request finishes, so responses may come out of order.
+
+Request fields:
+    id: any JSON value, copied to the response
+    mode: 'beat' (default), 'congruence' or 'full'
+    in_file: input filename (see onsets.load_onsets), or
+    onsets: onset times [ms]
+    item: item id, when in_file is an onset corpus
+    config: tracker overrides (see sweep.tracker_config)
+    max_bpm, avoid_quickturns: beat mode options (see scripts/tht)
+    out_file: full mode output filename, a pickle of the trackers or, if it
+        ends in .csv, the tracking_dataframe
+
+Response fields:
+    id: request id
+    ok: whether the request succeeded. If not, error holds a message.
+    beats: [ms] in beat mode
+    congruence: [[ms, conf]] in congruence mode
+    out_file: written filename in full mode
+'''
+
+import json
+import multiprocessing
+import os
+import pickle
+import socket
+import socketserver
+import threading
+
+import numpy as np
+
+from m2.tht import sweep
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import tracker_analysis
+from m2.tht.onsets import load_onsets
+
+MODES = ['full', 'beat', 'congruence']
+
+_trackers = {}
+
+
+def _tracker(config):
+    'Tracker of a configuration, built once per process'
+    key = json.dumps(config, sort_keys=True)
+    if key not in _trackers:
+        _trackers[key] = tactus_hypothesis_tracker.default_tht(
+            **sweep.tracker_config(config))
+    return _trackers[key]
+
+
+def _init_worker():
+    _tracker({})
+
+
+def _process(request):
+    mode = request.get('mode', 'beat')
+    if mode not in MODES:
+        raise ValueError('Unknown mode: {}'.format(mode))
+    if mode == 'full' and not request.get('out_file'):
+        raise ValueError('Full mode requires an out_file')
+
+    if 'onsets' in request:
+        onsets = np.array(request['onsets'], dtype=float)
+    elif 'in_file' in request:
+        onsets = load_onsets(request['in_file'], item=request.get('item'))
+    else:
+        raise ValueError('Request has neither onsets nor in_file')
+
+    tht = _tracker(request.get('config', {}))
+    trackers = tht(onsets)
+
+    if mode == 'full':
+        out_file = request['out_file']
+        if out_file.endswith('.csv'):
+            tracker_analysis.tracking_dataframe(trackers).to_csv(
+                out_file, index=False, float_format='%.6f')
+        else:
+            with open(out_file, 'wb') as f:
+                pickle.dump(trackers, f)
+        return {'out_file': out_file}
+    elif mode == 'beat':
+        max_bpm = request.get('max_bpm')
+        top_hts = tracker_analysis.top_hypothesis(trackers, len(onsets))
+        beats = tracker_analysis.produce_beats_information(
+            onsets, top_hts, adapt_period=max_bpm is not None,
+            adapt_phase=tht.eval_f, max_delta_bpm=max_bpm,
+            avoid_quickturns=request.get('avoid_quickturns'))
+        return {'beats': [float(b) for b in beats]}
+    else:
+        conf_values = tracker_analysis.tht_tracking_confs(trackers,
+                                                          len(onsets))
+        return {'congruence': [[float(t), float(c)]
+                               for t, c in conf_values]}
+
+
+def handle(request):
+    'Processes a request, returning its response. Errors are reported.'
+    response = {'id': request.get('id')}
+    try:
+        response.update(_process(request))
+        response['ok'] = True
+    except Exception as e:
+        response['ok'] = False
+        response['error'] = '{}: {}'.format(type(e).__name__, e)
+    return response
+
+
+class TrackingServer():
+    '''
+    Processes requests concurrently over a pool of worker processes.
+
+    Args:
+        processes: size of the worker pool. None uses a process per cpu and
+            1 processes requests in the calling thread. Requests processed
+            in-process are serialized, as the cached trackers (and their
+            seeders, memoization and per-run state) are not thread safe.
+        config: tracker overrides used by requests without config
+    '''
+
+    def __init__(self, processes=None, config=None):
+        self.config = config or {}
+        self.pool = None
+        self.unix_server = None
+        self._lock = threading.Lock()
+        if processes == 1:
+            _init_worker()
+        else:
+            self.pool = multiprocessing.Pool(processes,
+                                             initializer=_init_worker)
+
+    def submit(self, request, callback):
+        'Processes request, calling callback with its response'
+        if 'config' not in request and self.config:
+            request = dict(request, config=self.config)
+        if self.pool is None:
+            with self._lock:
+                response = handle(request)
+            callback(response)
+        else:
+            def failed(e):
+                callback({'id': request.get('id'), 'ok': False,
+                          'error': '{}: {}'.format(type(e).__name__, e)})
+            self.pool.apply_async(handle, (request,), callback=callback,
+                                  error_callback=failed)
+
+    def serve_stream(self, in_stream, out_stream):
+        '''
+        Serves the requests read from in_stream (binary, a request per line)
+        until it ends, writing responses to out_stream (binary). Returns
+        once all responses are written.
+        '''
+        done = threading.Condition()
+        pending = [0]
+
+        def respond(response):
+            with done:
+                out_stream.write(json.dumps(response).encode() + b'\n')
+                out_stream.flush()
+                pending[0] -= 1
+                done.notify_all()
+
+        for line in in_stream:
+            if not line.strip():
+                continue
+            with done:
+                pending[0] += 1
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('Request is not an object')
+            except ValueError as e:
+                respond({'id': None, 'ok': False,
+                         'error': 'Invalid request: {}'.format(e)})
+                continue
+            self.submit(request, respond)
+
+        with done:
+            done.wait_for(lambda: pending[0] == 0)
+
+    def serve_unix(self, path):
+        '''
+        Serves connections on a Unix domain socket at path until
+        interrupted. Each connection is served as in serve_stream.
+        '''
+        if os.path.exists(path):
+            os.unlink(path)
+        tracking_server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                tracking_server.serve_stream(self.rfile, self.wfile)
+
+        with socketserver.ThreadingUnixStreamServer(path, Handler) as srv:
+            self.unix_server = srv
+            try:
+                srv.serve_forever()
+            finally:
+                self.unix_server = None
+                os.unlink(path)
+
+    def shutdown(self):
+        'Stops serve_unix, if it is serving'
+        if self.unix_server is not None:
+            self.unix_server.shutdown()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+
+def request(path, requests):
+    '''
+    Sends requests to the server listening at path.
+
+    Args:
+        path: Unix domain socket filename
+        requests: [dict]. Requests without id are given their position.
+
+    Returns:
+        [dict] responses, in the order of requests
+    '''
+    requests = [dict(r, id=r.get('id', i)) for i, r in enumerate(requests)]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall(b''.join(json.dumps(r).encode() + b'\n' for r in requests))
+        s.shutdown(socket.SHUT_WR)
+        with s.makefile('rb') as f:
+            responses = {}
+            for line in f:
+                response = json.loads(line)
+                responses[json.dumps(response['id'])] = response
+    return [responses[json.dumps(r['id'])] for r in requests]
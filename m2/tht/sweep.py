@@ -0,0 +1,227 @@
+'''Parameter sweeps of the Tactus Hypothesis Tracker over a corpus.
+
+A sweep runs the tracker with many configurations (overrides of
+defaults.config) over many onset sequences. Onsets are loaded once and each
+sequence gets a single playback.OnsetIndex with the lookups of all the
+configurations precomputed (candidate onset pairs, window starts). The
+(configuration, sequence) jobs are run over a process pool that shares the
+indexes, and a summary row is produced per job as soon as it finishes.
+'''
+
+import itertools
+import multiprocessing
+import time
+
+import numpy as np
+import pandas as pd
+
+from m2.tht import confidence
+from m2.tht import correction
+from m2.tht import similarity
+from m2.tht import playback
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import tracker_analysis
+from m2.tht import corpus as onset_corpus
+
+FUNCTION_MODULES = {
+    'eval_f': confidence,
+    'corr_f': correction,
+    'sim_f': similarity
+}
+
+METRICS = ['onsets', 'runtime', 'hypotheses', 'tracking_conf']
+
+
+def expand_grid(grid):
+    '''
+    Cartesian product of a parameter grid.
+
+    Args:
+        grid: dict :: parameter -> [values]
+
+    Returns:
+        [dict :: parameter -> value]
+    '''
+    keys = list(grid)
+    return [dict(zip(keys, values))
+            for values in itertools.product(*[grid[k] for k in keys])]
+
+
+def grid_parameters(overrides):
+    'Parameter names of a list of overrides, in order of appearance'
+    params = []
+    for o in overrides:
+        params.extend(k for k in o if k not in params)
+    return params
+
+
+def tracker_config(overrides):
+    '''
+    Translates sweep overrides into default_tht keyword arguments.
+
+    Besides the keys of defaults.config, overrides may contain:
+        * eval_f, corr_f, sim_f as names of objects in the confidence,
+          correction and similarity modules respectively.
+        * eval_window: ms of window of a confidence.WindowedExpEval eval_f.
+        * corr_window: ms of window of a correction.WindowedCorrection corr_f
+          with the multiplier and decay of correction.windowed_corr.
+    '''
+    if 'eval_window' in overrides and 'eval_f' in overrides:
+        raise ValueError('eval_window and eval_f cannot be both overriden')
+    if 'corr_window' in overrides and 'corr_f' in overrides:
+        raise ValueError('corr_window and corr_f cannot be both overriden')
+
+    config = {}
+    for key, value in overrides.items():
+        if key == 'eval_window':
+            config['eval_f'] = confidence.WindowedExpEval(value)
+        elif key == 'corr_window':
+            config['corr_f'] = correction.WindowedCorrection(
+                correction.windowed_corr.mult,
+                correction.windowed_corr.decay,
+                value)
+        elif key in FUNCTION_MODULES and isinstance(value, str):
+            config[key] = getattr(FUNCTION_MODULES[key], value)
+        else:
+            config[key] = value
+    return config
+
+
+def prepare_index(onset_times, configs):
+    '''
+    Builds an OnsetIndex over onset_times with the lookups used by the
+    trackers of configs already computed.
+
+    Args:
+        onset_times: [ms]
+        configs: [dict] of default_tht keyword arguments
+    '''
+    index = playback.OnsetIndex(onset_times)
+    for config in configs:
+        tht = tactus_hypothesis_tracker.default_tht(**config)
+        index.pair_ranges(tht.min_delta, tht.max_delta)
+        for f in (tht.eval_f, tht.corr_f):
+            window = getattr(f, 'window', None)
+            if window is not None:
+                index.window_starts(window)
+    return index
+
+
+def track_summary(tracker, index):
+    '''
+    Runs tracker over the onsets of index and summarizes the tracking.
+
+    Returns:
+        dict with
+            onsets: number of onsets
+            runtime: seconds spent tracking
+            hypotheses: number of hypothesis trackers in the result
+            tracking_conf: mean top tracking confidence (nan if undefined)
+    '''
+    start = time.perf_counter()
+    hts = tracker(index.onset_times, index)
+    runtime = time.perf_counter() - start
+    confs = tracker_analysis.tht_tracking_confs(hts, len(index))
+    return {
+        'onsets': len(index),
+        'runtime': runtime,
+        'hypotheses': len(hts),
+        'tracking_conf': (np.mean([c for _, c in confs])
+                          if confs else np.nan)
+    }
+
+
+def _describe(overrides):
+    return dict((k, v if isinstance(v, (int, float, str)) else repr(v))
+                for k, v in overrides.items())
+
+
+_corpus = {}
+
+
+def _init_worker(corpus):
+    global _corpus
+    _corpus = corpus
+
+
+def _run_job(job):
+    config_id, overrides, name = job
+    tracker = tactus_hypothesis_tracker.default_tht(
+        **tracker_config(overrides))
+    row = {'config': config_id, 'file': name}
+    row.update(_describe(overrides))
+    row.update(track_summary(tracker, _corpus[name]))
+    return row
+
+
+def sweep(grid, corpus, processes=None, on_result=None):
+    '''
+    Runs the tracker with each configuration of a grid over a corpus.
+
+    Args:
+        grid: either a dict :: parameter -> [values] (see expand_grid) or a
+            list of overrides dicts. See tracker_config for valid overrides.
+        corpus: either a dict :: name -> onset_times or a list of filenames
+            (see onset_corpus.load_inputs)
+        processes: size of the process pool. None uses a process per cpu and
+            1 runs all jobs in the current process.
+        on_result: callable called with each result row as soon as the job
+            finishes.
+
+    Returns:
+        DataFrame with one row per (configuration, onset sequence) with
+        columns config, file, one per parameter and METRICS.
+    '''
+    overrides = expand_grid(grid) if isinstance(grid, dict) else list(grid)
+    if not isinstance(corpus, dict):
+        corpus = dict(onset_corpus.load_inputs(corpus))
+
+    configs = [tracker_config(o) for o in overrides]
+    indexes = dict((name, prepare_index(onset_times, configs))
+                   for name, onset_times in corpus.items())
+    jobs = [(config_id, o, name)
+            for config_id, o in enumerate(overrides)
+            for name in indexes]
+
+    rows = []
+
+    def collect(results):
+        for row in results:
+            if on_result is not None:
+                on_result(row)
+            rows.append(row)
+
+    if processes == 1:
+        _init_worker(indexes)
+        try:
+            collect(map(_run_job, jobs))
+        finally:
+            _init_worker({})
+    else:
+        with multiprocessing.Pool(processes, _init_worker,
+                                  (indexes,)) as pool:
+            collect(pool.imap_unordered(_run_job, jobs))
+
+    columns = ['config', 'file'] + grid_parameters(overrides) + METRICS
+    results = pd.DataFrame(rows, columns=columns)
+    return results.sort_values(['config', 'file']).reset_index(drop=True)
+
+
+def summarize(results):
+    '''
+    Summarizes sweep results per configuration.
+
+    Returns:
+        DataFrame with one row per configuration with its parameters, the
+        number of files, the mean tracking_conf and hypotheses and the total
+        runtime.
+    '''
+    groups = results.groupby('config')
+    params = [c for c in results.columns
+              if c not in ['config', 'file'] + METRICS]
+    summary = groups[params].first()
+    summary['files'] = groups['file'].count()
+    summary['tracking_conf'] = groups['tracking_conf'].mean()
+    summary['hypotheses'] = groups['hypotheses'].mean()
+    summary['runtime'] = groups['runtime'].sum()
+    return summary.reset_index()
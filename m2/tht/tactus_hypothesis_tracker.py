@@ -6,8 +6,18 @@ from m2.tht import defaults
 from m2.tht import hypothesis
 from m2.tht.correction import HypothesisCorrection, windowed_corr
 from m2.tht import confidence
+from m2.tht import observers as tht_observers
 import collections
+import hashlib
+import heapq
+import json
 import logging
+import os
+import pickle
+import signal
+import threading
+import types
+import numpy as np
 from typing import *
 
 Rho = NewType('Rho', float)
@@ -36,6 +46,11 @@ class HypothesisTracker(hypothesis.HypothesisFromIndex):
     The 'update' method allows us to correct the current hypothesis with
     a correction function and to update the confence status with a
     confidence function.
+
+    'states' holds the per tracker state of stateful evaluation and
+    correction functions (e.g. utils.ProjectionHistory), keyed by function,
+    so that it is pickled with the tracker: in checkpoints and when updated
+    by parallel workers.
     """
     beta: Tuple[Rho, Delta]
     oonset_times: List[float]
@@ -48,12 +63,21 @@ class HypothesisTracker(hypothesis.HypothesisFromIndex):
         self.onset_times = onset_times
         self.corr = []  # [(onset_idx, hypothesis_correction)]
         self.confs = []  # [(onset_idx, conf_value)]
+        self.states = {}
 
     def update(self, ongoing_play, eval_f, corr_f):
         "Updates a hypothesis with new conf and applying corrections."
+        self.correct(ongoing_play, corr_f)
+        self.evaluate(ongoing_play, eval_f)
+
+    def correct(self, ongoing_play, corr_f):
+        "Applies the correction of corr_f for the last discovered onset."
         correction = corr_f(self, ongoing_play)
         self.corr.append((ongoing_play.discovered_index, correction))
         self.htuple = correction.new_hypothesis()
+
+    def evaluate(self, ongoing_play, eval_f):
+        "Adds the conf of eval_f for the last discovered onset."
         n_conf = eval_f(self, ongoing_play)
         self.confs.append((ongoing_play.discovered_index, n_conf))
 
@@ -81,6 +105,34 @@ class TactusHypothesisTracker():
         * a similarity_epsilon that defines the threshold for trimming
         * a maximun amount of hypothesis trackers to be kept. Only hypotheses
         best confidence are kept.
+        * whether hypothesis trackers dropped by score are kept in the result
+        (archive_hypotheses) and, if so, whether those trimmed by similarity
+        are also kept (archive_trimmed).
+        * optionally, a realtime.DeadlineController that adapts the amount
+        of hypothesis trackers to a per onset deadline.
+        * optionally, a seeder (e.g. seeding.IOIHistogramSeeder) that
+        restricts the hypotheses created at each step.
+        * optionally, a trace.StepTrace that records the trackers created,
+        trimmed and dropped at each step.
+        * optionally, a trimming.IncrementalTrimmer that trims similar
+        hypotheses comparing only the pairs that may have become similar.
+        * whether to update hypotheses in two phases (two_phase_update): all
+        hypotheses are corrected and trimmed first, and then evaluated in
+        decreasing order of an upper bound of their confidence (the bound
+        method of eval_f), skipping those whose bound is below the k-th best
+        confidence, as they would be dropped by score anyway. The result is
+        the same. verify_two_phase evaluates the skipped ones too and raises
+        RuntimeError if any would have been kept. Two phase updates are not
+        used if eval_f has no bound or hypotheses are archived (archived
+        hypotheses need their confidence).
+        * optionally, a parallel.HypothesisPool that updates the hypotheses
+        of each step over worker processes, with the same result.
+        * eval functions with a prepare method (e.g.
+        confidence.FamilyWindowedExpEval) are given the hypotheses of each
+        step, once corrected, before any is evaluated (not when updated by
+        an update_pool).
+        * optionally, observers: callables called at the end of each step
+        with an observers.StepSnapshot (e.g. observers.TopHypothesis).
 
     When called on a set of onset_times it will return the hypothesis trackers
     generated by the model.
@@ -90,7 +142,10 @@ class TactusHypothesisTracker():
 
     def __init__(self, eval_f, corr_f, sim_f, similarity_epsilon,
                  min_delta, max_delta, max_hypotheses, 
-                 archive_hypotheses=False):
+                 archive_hypotheses=False, controller=None, trace=None,
+                 seeder=None, archive_trimmed=False, trimmer=None,
+                 two_phase_update=False, verify_two_phase=False,
+                 update_pool=None, observers=None):
         self.eval_f = eval_f
         self.corr_f = corr_f
         self.sim_f = sim_f
@@ -99,60 +154,226 @@ class TactusHypothesisTracker():
         self.max_delta = max_delta
         self.max_hypotheses = max_hypotheses
         self.archive_hypotheses = archive_hypotheses
-
-    def __call__(self, onset_times):
+        self.archive_trimmed = archive_trimmed
+        self.trimmer = trimmer
+        self.two_phase_update = two_phase_update
+        self.verify_two_phase = verify_two_phase
+        self.update_pool = update_pool
+        self.observers = observers
+        self.controller = controller
+        self.trace = trace
+        self.seeder = seeder
+
+    def __call__(self, onset_times, onset_index=None, onset_weights=None):
         """
         Performs the tracking of tactus hypothesis as defined by the model from
         the song represented by the received onset_times.
 
         Args:
             onset_times: a sorted list of ms where the musical events occur.
+            onset_index: optional playback.OnsetIndex built over onset_times.
+                An index may be shared among trackers run over the same
+                onsets to reuse its precomputed lookups.
+            onset_weights: optional weight of each onset (e.g. the amount of
+                onsets merged by a clustering.OnsetClusterer), used by the
+                functions that support them.
 
         Returns:
             A dict :: hypothesis_name -> HypothesisTracker
         """
+        state = self.start(onset_times, onset_index, onset_weights)
+        self.run(state)
+        return state.result()
+
+    def fingerprint(self):
+        """
+        Stable digest of the configuration that determines the tracking
+        result: the classes and public parameters of eval_f, corr_f, sim_f
+        and seeder, the similarity_epsilon, min_delta, max_delta,
+        max_hypotheses, archive_hypotheses and archive_trimmed.
+
+        Returns:
+            hex str
+        """
+        config = {k: describe_config(getattr(self, k))
+                  for k in FINGERPRINT_FIELDS}
+        return hashlib.sha256(
+            json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+    def start(self, onset_times, onset_index=None, onset_weights=None):
+        "Returns the TrackingState previous to tracking onset_times."
         self.logger.debug('Started tracking for onsets (%d) : %s',
                           len(onset_times), onset_times)
-        ongoing_play = playback.OngoingPlayback(onset_times)
-        hypothesis_trackers = []
-        archived_hypotheses = []
+        state = TrackingState(onset_times, onset_index, onset_weights)
+        if self.seeder is not None:
+            state.seeding = self.seeder.start(self.min_delta, self.max_delta)
+        if self.trimmer is not None:
+            state.trimming = self.trimmer.start(self.sim_f,
+                                                self.similarity_epsilon)
+        return state
+
+    def run(self, state, checkpointer=None):
+        """
+        Advances the tracking in state until all its onsets are discovered.
+
+        Args:
+            state: TrackingState, updated in place
+            checkpointer: optional Checkpointer notified after each step
+        """
+        for _ in self.steps(state):
+            if checkpointer is not None:
+                checkpointer.step_done(state)
+
+    def steps(self, state):
+        """
+        Advances the tracking in state one onset at a time, yielding the
+        index of each discovered onset once its step is performed.
+        """
+        ongoing_play = state.ongoing_play
         while ongoing_play.advance():
-            n_hts = list(self._generate_new_hypothesis(ongoing_play))
-            self.logger.debug('New step. %d hypothesis created', len(n_hts))
+            self._step(state)
+            yield ongoing_play.discovered_index
 
-            hypothesis_trackers.extend(n_hts)
+    def track(self, onset_times, checkpoint=None, checkpoint_every=None,
+              onset_weights=None):
+        """
+        Performs the tracking of onset_times saving the tracking state to
+        the checkpoint file every checkpoint_every onsets and when signaled
+        (see Checkpointer).
 
+        If the checkpoint file exists, the tracking is resumed from it. The
+        checkpointed onsets (and weights) must be a prefix of onset_times
+        (and onset_weights) and the tracker must have the same configuration
+        (fingerprint) as the one that saved it. The result is identical to an
+        uninterrupted tracking.
+
+        Returns:
+            A dict :: hypothesis_name -> HypothesisTracker
+
+        Raises:
+            ValueError if the checkpoint was saved by a tracker with another
+            fingerprint, or its onsets are not a prefix of onset_times (see
+            TrackingState.resume).
+        """
+        if checkpoint is None:
+            return self(onset_times, onset_weights=onset_weights)
+
+        fingerprint = self.fingerprint()
+        if os.path.exists(checkpoint):
+            state = TrackingState.load(checkpoint)
+            if state.fingerprint != fingerprint:
+                raise ValueError('Checkpoint {} was saved by a tracker with '
+                                 'another configuration'.format(checkpoint))
+            state.resume(onset_times, onset_weights)
+            self.logger.debug('Resumed tracking at onset %d',
+                              state.ongoing_play.discovered_index)
+        else:
+            state = self.start(onset_times, onset_weights=onset_weights)
+            state.fingerprint = fingerprint
+
+        with Checkpointer(checkpoint, checkpoint_every) as checkpointer:
+            self.run(state, checkpointer)
+            checkpointer.save(state)
+        return state.result()
+
+    def _step(self, state):
+        "Performs the tracking step for the last discovered onset in state."
+        ongoing_play = state.ongoing_play
+        step = ongoing_play.discovered_index
+        hypothesis_trackers = state.hypothesis_trackers
+        max_hypotheses = self.max_hypotheses
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        controller_hs = []
+        if self.controller is not None:
+            self.controller.step_started()
+
+        n_hts = list(self._generate_new_hypothesis(ongoing_play))
+        self.logger.debug('New step. %d hypothesis created', len(n_hts))
+
+        if state.seeding is not None:
+            state.seeding.update(ongoing_play)
+            n_hts = state.seeding.select(n_hts)
+
+        if self.controller is not None:
+            max_hypotheses, n_live, n_new = self.controller.plan(
+                max_hypotheses, len(hypothesis_trackers), len(n_hts))
+            if n_live < len(hypothesis_trackers):
+                hypothesis_trackers, controller_hs = (
+                    self._split_k_best_hypotheses(hypothesis_trackers,
+                                                  n_live))
+                if (self.archive_hypotheses):
+                    state.archived_hypotheses.extend(controller_hs)
+                if self.trace is not None:
+                    self.trace.dropped(step, controller_hs)
+            n_hts = self.controller.admit(n_hts, n_new)
+
+        if self.trace is not None:
+            self.trace.created(step, n_hts)
+        hypothesis_trackers.extend(n_hts)
+
+        two_phase = (self.two_phase_update and not self.archive_hypotheses and
+                     hasattr(self.eval_f, 'bound'))
+        if self.update_pool is not None:
+            self.update_pool.update(hypothesis_trackers, ongoing_play,
+                                    self.corr_f,
+                                    None if two_phase else self.eval_f)
+        elif two_phase or hasattr(self.eval_f, 'prepare'):
+            for h in hypothesis_trackers:
+                h.correct(ongoing_play, self.corr_f)
+            if not two_phase:
+                self.eval_f.prepare(hypothesis_trackers, ongoing_play)
+                for h in hypothesis_trackers:
+                    h.evaluate(ongoing_play, self.eval_f)
+        else:
             for h in hypothesis_trackers:
                 h.update(ongoing_play, self.eval_f, self.corr_f)
 
+        if state.trimming is not None:
+            kept_hs, trimmed_hs = state.trimming.trim(
+                hypothesis_trackers, ongoing_play,
+                self._trim_similar_hypotheses)
+        else:
             kept_hs, trimmed_hs = self._trim_similar_hypotheses(
                 hypothesis_trackers, ongoing_play)
-            self.logger.debug('Trimmed by similarity (%d): %s',
-                              ongoing_play.discovered_index,
+        if debug:
+            self.logger.debug('Trimmed by similarity (%d): %s', step,
                               str([str(h) for h in trimmed_hs]))
 
-            k_best_hs, other_hs = self._split_k_best_hypotheses(kept_hs)
-            self.logger.debug('Trimmed by score (%d): %s',
-                              ongoing_play.discovered_index,
+        if two_phase:
+            k_best_hs, other_hs = self._evaluate_k_best_hypotheses(
+                kept_hs, ongoing_play, max_hypotheses)
+        else:
+            k_best_hs, other_hs = self._split_k_best_hypotheses(
+                kept_hs, max_hypotheses)
+        if debug:
+            self.logger.debug('Trimmed by score (%d): %s', step,
                               str([str(h) for h in other_hs]))
-            hypothesis_trackers = k_best_hs
-            if (self.archive_hypotheses):
-                archived_hypotheses.extend(other_hs)
-            self.logger.debug('End of step. %d trackers remaining',
-                              len(hypothesis_trackers))
-
-        return dict([(ht.name, ht) 
-                     for ht in archived_hypotheses + hypothesis_trackers])
+        state.hypothesis_trackers = k_best_hs
+        if (self.archive_hypotheses):
+            if self.archive_trimmed:
+                state.archived_hypotheses.extend(h for h, _ in trimmed_hs)
+            state.archived_hypotheses.extend(other_hs)
+        self.logger.debug('End of step. %d trackers remaining',
+                          len(k_best_hs))
+        if self.trace is not None:
+            self.trace.trimmed(step, trimmed_hs)
+            self.trace.dropped(step, other_hs)
+            self.trace.step_end(step, len(k_best_hs))
+        if self.controller is not None:
+            self.controller.step_done(len(hypothesis_trackers))
+        if self.observers:
+            snapshot = tht_observers.step_snapshot(
+                ongoing_play, k_best_hs, n_hts, trimmed_hs,
+                controller_hs + other_hs)
+            for observer in self.observers:
+                observer(snapshot)
 
     def _generate_new_hypothesis(self, ongoing_play):
         "Generates new hypothesis trackers given discovered onset in playback."
         end_index = ongoing_play.discovered_index
-        for k in range(end_index):
-            delta = (ongoing_play.onset_times[end_index] -
-                     ongoing_play.onset_times[k])
-            if self.min_delta <= delta and delta <= self.max_delta:
-                yield HypothesisTracker(k, end_index,
-                                        ongoing_play.onset_times)
+        lo, hi = ongoing_play.index.pair_ranges(self.min_delta, self.max_delta)
+        for k in range(lo[end_index], hi[end_index]):
+            yield HypothesisTracker(k, end_index, ongoing_play.onset_times)
 
     def _trim_similar_hypotheses(self, hts, ongoing_play):
         """Partitions new hypothesis into those that should be trimmed given
@@ -180,21 +401,249 @@ class TactusHypothesisTracker():
 
         return (kept_hs, trimmed_hs_data)
 
-    def _split_k_best_hypotheses(self, hts):
-        """Splits hypotheses into the self.max_hypotheses best
-        (according to confidence) and the rest.
+    def _split_k_best_hypotheses(self, hts, k=None):
+        """Splits hypotheses into the k best (according to confidence) and
+        the rest. k defaults to self.max_hypotheses.
 
         Both result list will be sorted in order of generation."""
+        if k is None:
+            k = self.max_hypotheses
         hts_info = [(-1 * ht.conf, idx) for idx, ht in enumerate(hts)]
         sorted_hts_info = sorted(hts_info)
         best_hts_idx = set([
-            i for _, i in sorted_hts_info[:self.max_hypotheses]])
+            i for _, i in sorted_hts_info[:k]])
         best_k_hts = [ht for idx, ht in enumerate(hts)
                       if idx in best_hts_idx]
         other_hts = [ht for idx, ht in enumerate(hts)
                      if idx not in best_hts_idx]
         return best_k_hts, other_hts
 
+    def _evaluate_k_best_hypotheses(self, hts, ongoing_play, k):
+        """Evaluates corrected hypotheses by decreasing confidence bound
+        until the bound falls below the k-th best confidence. Returns the
+        split of _split_k_best_hypotheses, where only hypotheses in the k
+        best are guaranteed to be evaluated."""
+        if hasattr(self.eval_f, 'prepare'):
+            self.eval_f.prepare(hts, ongoing_play)
+        bounds = [self.eval_f.bound(ht, ongoing_play) for ht in hts]
+        order = sorted(range(len(hts)), key=lambda i: -bounds[i])
+        best_confs = []  # min heap of the k best confs
+        prune = True
+        evaluated = []
+        for i in order:
+            if (prune and len(best_confs) >= k and
+                    bounds[i] < best_confs[0]):
+                break
+            hts[i].evaluate(ongoing_play, self.eval_f)
+            evaluated.append(i)
+            conf = hts[i].conf
+            if conf != conf:
+                prune = False  # NaN confs do not order
+            elif len(best_confs) < k:
+                heapq.heappush(best_confs, conf)
+            else:
+                heapq.heappushpop(best_confs, conf)
+
+        k_best_hs, _ = self._split_k_best_hypotheses(
+            [hts[i] for i in sorted(evaluated)], k)
+        best = set(id(ht) for ht in k_best_hs)
+        other_hs = [ht for ht in hts if id(ht) not in best]
+        self.logger.debug('Skipped evaluations (%d): %d',
+                          ongoing_play.discovered_index,
+                          len(hts) - len(evaluated))
+
+        if self.verify_two_phase:
+            skipped = set(range(len(hts))) - set(evaluated)
+            for i in skipped:
+                hts[i].evaluate(ongoing_play, self.eval_f)
+            expected, _ = self._split_k_best_hypotheses(hts, k)
+            if [ht.name for ht in expected] != [ht.name for ht in k_best_hs]:
+                raise RuntimeError(
+                    'Two phase update differs from the full update at onset '
+                    '{}'.format(ongoing_play.discovered_index))
+        return k_best_hs, other_hs
+
+
+class TrackingState():
+    """State of a TactusHypothesisTracker run.
+
+    Holds the ongoing playback, the live hypothesis trackers, the archived
+    ones and the state of the seeding and trimming stages, if any. A state
+    can be pickled at any step boundary (see save and load) and the tracking
+    resumed with TactusHypothesisTracker.run, also after more onsets are
+    appended to it with extend.
+
+    The fingerprint of the tracker is kept by TactusHypothesisTracker.track,
+    to check the checkpoints it resumes.
+    """
+
+    # Missing in states pickled before fingerprints were kept
+    fingerprint = None
+
+    def __init__(self, onset_times, onset_index=None, onset_weights=None):
+        self.ongoing_play = playback.OngoingPlayback(onset_times, onset_index,
+                                                     onset_weights)
+        self.hypothesis_trackers = []
+        self.archived_hypotheses = []
+        self.seeding = None
+        self.trimming = None
+        self.fingerprint = None
+
+    @property
+    def onset_times(self):
+        return self.ongoing_play.onset_times
+
+    @property
+    def finished(self):
+        "Whether all onsets of the playback were discovered."
+        return (self.ongoing_play.up_to_discovered_index >=
+                len(self.onset_times))
+
+    def extend(self, onset_times, onset_weights=None):
+        """
+        Appends onsets (after the current last onset) to the playback, with
+        their weights if the playback is weighted.
+        """
+        self.ongoing_play.extend(onset_times, onset_weights)
+        for ht in self.archived_hypotheses + self.hypothesis_trackers:
+            ht.onset_times = self.onset_times
+
+    def resume(self, onset_times, onset_weights=None):
+        """
+        Prepares the state to continue tracking onset_times (weighted by
+        onset_weights), appending those after the onsets in the state.
+
+        Raises:
+            ValueError if the onsets (or weights) in the state are not a
+            prefix of onset_times (or onset_weights).
+        """
+        known = len(self.onset_times)
+        weights = self.ongoing_play.weights
+        if (len(onset_times) < known or
+                not np.array_equal(self.onset_times, onset_times[:known])):
+            raise ValueError('Tracking state onsets are not a prefix of the '
+                             'onsets to track')
+        if (weights is None) != (onset_weights is None) or (
+                weights is not None and
+                not np.array_equal(weights, onset_weights[:known])):
+            raise ValueError('Tracking state weights are not a prefix of the '
+                             'weights of the onsets to track')
+        if len(onset_times) > known:
+            self.extend(onset_times[known:],
+                        None if onset_weights is None
+                        else onset_weights[known:])
+
+    def result(self):
+        "A dict :: hypothesis_name -> HypothesisTracker"
+        return dict([(ht.name, ht)
+                     for ht in self.archived_hypotheses +
+                     self.hypothesis_trackers])
+
+    def save(self, filename):
+        "Pickles the state into filename, replacing it atomically."
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump(self, f)
+        os.replace(tmp_filename, filename)
+
+    @staticmethod
+    def load(filename):
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+
+class TrackingInterrupted(Exception):
+    "Raised when a checkpointed tracking is stopped by a signal."
+
+
+class Checkpointer():
+    """Saves a TrackingState to a file during a tracking run.
+
+    The state is saved every `every` discovered onsets (if not None) and
+    after the step in course when one of `save_signals` is received. When one
+    of `stop_signals` is received, the state is saved and
+    TrackingInterrupted is raised.
+
+    Signal handlers are installed while used as a context manager from the
+    main thread.
+    """
+
+    def __init__(self, filename, every=None,
+                 save_signals=(signal.SIGUSR1,),
+                 stop_signals=(signal.SIGTERM,)):
+        self.filename = filename
+        self.every = every
+        self.save_signals = save_signals
+        self.stop_signals = stop_signals
+        self.steps = 0
+        self._save_requested = False
+        self._stop_requested = False
+        self._previous_handlers = {}
+
+    def _handle(self, signum, frame):
+        self._save_requested = True
+        if signum in self.stop_signals:
+            self._stop_requested = True
+
+    def __enter__(self):
+        if threading.current_thread() is threading.main_thread():
+            for signum in self.save_signals + self.stop_signals:
+                self._previous_handlers[signum] = signal.signal(signum,
+                                                                self._handle)
+        return self
+
+    def __exit__(self, *exc_info):
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler)
+        self._previous_handlers = {}
+
+    def save(self, state):
+        state.save(self.filename)
+        self._save_requested = False
+
+    def step_done(self, state):
+        self.steps += 1
+        if self._save_requested or (self.every is not None and
+                                    self.steps % self.every == 0):
+            self.save(state)
+        if self._stop_requested:
+            raise TrackingInterrupted(
+                'Tracking stopped at onset {}, state saved to {}'.format(
+                    state.ongoing_play.discovered_index, self.filename))
+
+
+FINGERPRINT_FIELDS = ['eval_f', 'corr_f', 'sim_f', 'seeder',
+                      'similarity_epsilon', 'min_delta', 'max_delta',
+                      'max_hypotheses', 'archive_hypotheses',
+                      'archive_trimmed']
+
+
+def describe_config(value):
+    """
+    JSON serializable description of a configuration value. Objects are
+    described by their class and their public attributes, functions by
+    their name.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [describe_config(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): describe_config(v) for k, v in value.items()}
+    if isinstance(value, (types.FunctionType, types.BuiltinFunctionType)):
+        return '{}.{}'.format(value.__module__, value.__qualname__)
+    return {
+        'class': '{}.{}'.format(type(value).__module__,
+                                type(value).__qualname__),
+        'params': {k: describe_config(v)
+                   for k, v in getattr(value, '__dict__', {}).items()
+                   if not k.startswith('_')}
+    }
+
 
 def default_tht(**kwargs):
     '''Returns a TactusHypothesisTracker with the default configuration.
@@ -0,0 +1,66 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from m2.tht import aggregation
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import tracker_analysis
+
+
+@pytest.fixture
+def results():
+    rng = np.random.RandomState(0)
+    tracker = tactus_hypothesis_tracker.default_tht(max_hypotheses=10)
+    return [tracker(np.cumsum(rng.normal(600, 10, 25))),
+            tracker(np.cumsum(rng.normal(350, 10, 30)))]
+
+
+def test_single_result_matches_tht_grid(results):
+    accumulator = aggregation.DensityAccumulator().add(results[0])
+    np.testing.assert_allclose(accumulator.grid(),
+                               tracker_analysis.tht_grid(results[0]),
+                               atol=1e-15)
+    assert accumulator.tracking_conf() == pytest.approx(
+        tracker_analysis.tht_tracking_conf(results[0]))
+
+
+def test_merge_matches_all_points(results):
+    first = aggregation.DensityAccumulator().add(results[0])
+    second = aggregation.DensityAccumulator().add(results[1])
+    merged = aggregation.DensityAccumulator().merge(first).merge(second)
+
+    all_hts = dict(('{}-{}'.format(i, name), ht)
+                   for i, hts in enumerate(results)
+                   for name, ht in hts.items())
+    np.testing.assert_allclose(merged.grid(),
+                               tracker_analysis.tht_grid(all_hts),
+                               atol=1e-15)
+    assert merged.results == 2
+    assert merged.tracking_conf() == pytest.approx(np.mean(
+        [tracker_analysis.tht_tracking_conf(hts) for hts in results]))
+
+    with pytest.raises(ValueError):
+        merged.merge(aggregation.DensityAccumulator(rho_sigma=0.2))
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_aggregate_files(tmpdir, results, processes):
+    filenames = []
+    for i, hts in enumerate(results):
+        filename = str(tmpdir.join('{}.pkl'.format(i)))
+        with open(filename, 'wb') as f:
+            pickle.dump(hts, f)
+        filenames.append(filename)
+
+    seen = []
+    total = aggregation.aggregate(
+        filenames, processes=processes,
+        on_result=lambda filename, acc: seen.append(filename))
+
+    expected = aggregation.DensityAccumulator()
+    for hts in results:
+        expected.add(hts)
+    assert sorted(seen) == filenames
+    np.testing.assert_allclose(total.grid(), expected.grid(), atol=1e-15)
+    assert total.tracking_conf() == pytest.approx(expected.tracking_conf())
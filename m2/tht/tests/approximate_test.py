@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from m2.tht import approximate
+from m2.tht import correction
+from m2.tht import tactus_hypothesis_tracker
+
+
+@pytest.fixture
+def onsets():
+    beats = np.arange(0, 12000, 500.)
+    return np.sort(np.concatenate([beats, beats[::2] + 250, beats + 3]))
+
+
+def test_quantize_onsets_merges_close_onsets():
+    q = approximate.quantize_onsets([0, 3, 498, 502, 1001], 10)
+    assert list(q) == [0, 500, 1000]
+
+
+def test_sparse_correction_every_onset_is_exact(onsets):
+    exact = tactus_hypothesis_tracker.default_tht()
+    sparse = tactus_hypothesis_tracker.default_tht(
+        corr_f=approximate.SparseCorrection(correction.windowed_corr, 1))
+    exact_hts = exact(onsets)
+    sparse_hts = sparse(onsets)
+    assert sorted(exact_hts) == sorted(sparse_hts)
+    assert all(exact_hts[k].confs == sparse_hts[k].confs for k in exact_hts)
+
+
+def test_sparse_correction_keeps_hypothesis_between_corrections(onsets):
+    tracker = tactus_hypothesis_tracker.default_tht(
+        corr_f=approximate.SparseCorrection(correction.windowed_corr, 4))
+    for ht in tracker(onsets).values():
+        for (idx, corr), (_, prev) in zip(ht.corr[1:], ht.corr):
+            if idx % 4:
+                assert (corr.n_rho, corr.n_delta) == (prev.n_rho,
+                                                      prev.n_delta)
+
+
+class CountingCorrection():
+    'Correction function counting its calls'
+
+    def __init__(self, corr_f):
+        self.corr_f = corr_f
+        self.window = corr_f.window
+        self.calls = 0
+
+    def __call__(self, ht, ongoing_play):
+        self.calls += 1
+        return self.corr_f(ht, ongoing_play)
+
+
+def test_accuracy_report(onsets):
+    exact_corr = CountingCorrection(correction.windowed_corr)
+    approx_corr = CountingCorrection(correction.windowed_corr)
+    report = approximate.accuracy_report(
+        onsets, exact=tactus_hypothesis_tracker.default_tht(corr_f=exact_corr),
+        approximate=approximate.approximate_tht(
+            corr_f=approximate.SparseCorrection(approx_corr, 4)))
+    assert report['onsets'] == len(onsets)
+    assert report['approximate_onsets'] == len(
+        approximate.quantize_onsets(onsets, 10))
+    assert report['approximate_onsets'] < len(onsets)
+    # Timing is left to the report, the work saved is deterministic
+    assert approx_corr.calls < exact_corr.calls / 2
+    assert report['speedup'] > 0
+    assert report['beat_f_measure'] > 0.8
+    assert report['top_agreement'] > 0.8
+    assert 0 < len(report['top_agreement_curve']) <= len(onsets) - 3
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from m2.tht import benchmark
+from m2.tht import evaluation
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import tracker_analysis
+
+
+@pytest.fixture
+def manifest(tmpdir):
+    rng = np.random.RandomState(0)
+    slow = np.cumsum(rng.normal(600, 10, 25))
+    fast = np.cumsum(rng.normal(350, 10, 30))
+    reference = tmpdir.join('fast.txt')
+    np.savetxt(str(reference), fast)
+    return [{'name': 'slow', 'onsets': list(slow), 'reference': list(slow)},
+            {'name': 'fast', 'onsets': list(fast),
+             'reference': str(reference)}]
+
+
+def test_continuity_metrical_levels():
+    reference = np.arange(0, 10000, 500.)
+    assert evaluation.continuity(reference, reference) == {
+        'cmlc': 1.0, 'cmlt': 1.0, 'amlc': 1.0, 'amlt': 1.0}
+    for estimated in [reference + 250, np.arange(0, 10000, 250.),
+                      reference[::2]]:
+        scores = evaluation.continuity(reference, estimated)
+        assert scores['cmlt'] == 0.0
+        assert scores['amlc'] == scores['amlt'] == 1.0
+
+
+def test_continuity_breaks_on_errors():
+    reference = np.arange(0, 10000, 500.)
+    estimated = reference.copy()
+    estimated[10] += 200
+    scores = evaluation.continuity(reference, estimated)
+    # Beat 10 fails the phase condition and beat 11 the period condition
+    assert scores['cmlt'] == pytest.approx(0.9)
+    assert scores['cmlc'] == pytest.approx(0.5)
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_evaluate_matches_independent_runs(manifest, processes):
+    rows = []
+    configs = [{}, {'max_hypotheses': 5}]
+    results = benchmark.evaluate(manifest, configs, processes=processes,
+                                 on_result=rows.append)
+    assert len(rows) == len(results) == 4
+
+    for _, row in results.iterrows():
+        item, = [i for i in manifest if i['name'] == row.file]
+        onsets = np.array(item['onsets'])
+        tht = tactus_hypothesis_tracker.default_tht(
+            **configs[row.config])
+        hts = tht(onsets)
+        beats = tracker_analysis.produce_beats_information(
+            onsets, tracker_analysis.top_hypothesis(hts, len(onsets)),
+            adapt_phase=tht.eval_f)
+        assert row.hypotheses == len(hts)
+        assert row.beats == len(beats)
+        assert row.f_measure == pytest.approx(
+            evaluation.f_measure(onsets, beats))
+        assert np.isnan(row.peak_memory)
+
+    comparison = benchmark.compare(results)
+    assert list(comparison.files) == [2, 2]
+    assert list(comparison.speedup)[0] == 1.0
+    assert list(comparison.f_measure_delta)[0] == 0.0
+
+
+@pytest.mark.parametrize('item,error', [
+    ({'item': 'a', 'reference': [0]}, 'an item but no in_file'),
+    ({'reference': [0]}, 'neither onsets nor in_file'),
+    ({'onsets': [0]}, 'no reference')])
+def test_malformed_manifest_items(manifest, item, error):
+    with pytest.raises(ValueError, match="item 2 has " + error):
+        benchmark.evaluate(manifest + [item], processes=1)
+    item = dict(item, name='bad')
+    with pytest.raises(ValueError, match="item 'bad' has " + error):
+        benchmark.evaluate(manifest + [item], processes=1)
+
+
+def test_track_and_score_measures_memory():
+    onsets = np.cumsum(np.full(20, 500.))
+    row = benchmark.track_and_score(tactus_hypothesis_tracker.default_tht(),
+                                    onsets, onsets, memory=True)
+    assert row['peak_memory'] > 0
@@ -0,0 +1,97 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from m2.tht import cache
+from m2.tht import confidence
+from m2.tht import observers
+from m2.tht import realtime
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import trace
+from m2.tht import tracker_analysis
+
+
+@pytest.fixture
+def onsets():
+    return np.arange(0, 6000, 500.)
+
+
+def test_fingerprint_is_stable_and_covers_config():
+    fingerprint = tactus_hypothesis_tracker.default_tht().fingerprint()
+    assert fingerprint == tactus_hypothesis_tracker.default_tht().fingerprint()
+
+    changed = [
+        {'max_hypotheses': 31},
+        {'similarity_epsilon': 0.01},
+        {'archive_hypotheses': True},
+        {'eval_f': confidence.WindowedExpEval(5000)},
+        {'eval_f': confidence.all_history_eval},
+    ]
+    fingerprints = {tactus_hypothesis_tracker.default_tht(**c).fingerprint()
+                    for c in changed}
+    assert fingerprint not in fingerprints
+    assert len(fingerprints) == len(changed)
+
+
+def test_cache_hits_and_misses(tmp_path, onsets):
+    tracker = tactus_hypothesis_tracker.default_tht()
+    result_cache = cache.ResultCache(str(tmp_path))
+    calls = []
+
+    def track(o):
+        calls.append(o)
+        return tracker(o)
+
+    first = result_cache.track(tracker, onsets, track)
+    second = result_cache.track(tracker, onsets, track)
+    result_cache.track(tracker, onsets[:-1], track)
+    assert len(calls) == 2
+    assert (result_cache.hits, result_cache.misses) == (1, 2)
+    assert sorted(first) == sorted(second)
+    assert all(first[k].confs == second[k].confs for k in first)
+
+
+@pytest.mark.parametrize('config', [
+    {'controller': realtime.DeadlineController(100)},
+    {'observers': [observers.TopHypothesis()]},
+    {'trace': trace.StepTrace()}])
+def test_uncacheable_trackers_are_tracked(tmp_path, onsets, config):
+    tracker = tactus_hypothesis_tracker.default_tht(**config)
+    result_cache = cache.ResultCache(str(tmp_path))
+    result_cache.track(tracker, onsets)
+    result_cache.track(tracker, onsets)
+    assert result_cache.entries() == []
+
+
+def test_key_covers_version(tmp_path, onsets, monkeypatch):
+    tracker = tactus_hypothesis_tracker.default_tht()
+    result_cache = cache.ResultCache(str(tmp_path))
+    key = result_cache.key(tracker, onsets)
+    monkeypatch.setattr(cache, 'CACHE_VERSION', cache.CACHE_VERSION + 1)
+    assert result_cache.key(tracker, onsets) != key
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path), max_entries=2)
+    for key in ['a', 'b']:
+        result_cache.put(key, key)
+        time.sleep(0.01)
+    assert result_cache.get('a') == 'a'
+    time.sleep(0.01)
+    result_cache.put('c', 'c')
+    assert result_cache.get('b') is None
+    assert result_cache.get('a') == 'a' and result_cache.get('c') == 'c'
+
+    result_cache.max_bytes = 0
+    result_cache.evict()
+    assert result_cache.entries() == []
+
+
+def test_track_beats_uses_default_cache(tmp_path, onsets, monkeypatch):
+    monkeypatch.setenv(cache.CACHE_DIR_ENV, str(tmp_path))
+    beats = tracker_analysis.track_beats(onsets)
+    assert len(cache.ResultCache(str(tmp_path)).entries()) == 1
+    assert tracker_analysis.track_beats(onsets) == beats
+    assert tracker_analysis.track_beats(onsets, cache=False) == beats
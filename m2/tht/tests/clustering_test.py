@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from m2.tht import clustering
+from m2.tht import confidence
+from m2.tht import correction
+from m2.tht import onset_detection
+from m2.tht import parallel
+from m2.tht import playback
+from m2.tht import tactus_hypothesis_tracker
+
+
+@pytest.fixture
+def chords():
+    'Onsets of chords of 1 to 4 notes played within 20 ms'
+    rng = np.random.RandomState(1)
+    beats = np.cumsum(rng.normal(520, 8, 40))
+    return np.concatenate([
+        b + np.sort(rng.uniform(0, 20, rng.randint(1, 5))) for b in beats])
+
+
+def test_cluster_merges_chords():
+    onsets = [0, 5, 12, 500, 1000, 1010, 1020, 1030, 1040]
+    clusterer = clustering.OnsetClusterer(25)
+    times, weights = clusterer.cluster(onsets)
+    # Clusters are anchored to their first onset, runs do not chain
+    assert times.tolist() == pytest.approx([17 / 3., 500, 1010, 1035])
+    assert weights.tolist() == [3, 1, 3, 2]
+    assert clusterer.report() == {'onsets': 9, 'clusters': 4,
+                                  'reduction': pytest.approx(5 / 9.)}
+
+    times, _ = clustering.OnsetClusterer(25, 'first').cluster(onsets)
+    assert times.tolist() == [0, 500, 1000, 1030]
+    with pytest.raises(ValueError):
+        clustering.OnsetClusterer(25, 'last')
+
+
+def test_streaming_clusters_match(chords):
+    expected = clustering.OnsetClusterer(30).cluster(chords)
+    clustering_state = clustering.OnsetClusterer(30).start()
+    closed = [clustering_state.push(chords[i:i + 7])
+              for i in range(0, len(chords), 7)]
+    closed.append(clustering_state.flush())
+    for values, expected_values in zip(zip(*closed), expected):
+        assert np.concatenate(values).tolist() == expected_values.tolist()
+
+    times, weights = expected
+    result = onset_detection.track_onsets(
+        tactus_hypothesis_tracker.default_tht(), iter(chords), batch_size=5,
+        clusterer=clustering.OnsetClusterer(30))
+    tracked = tactus_hypothesis_tracker.default_tht()(times,
+                                                     onset_weights=weights)
+    assert sorted(result) == sorted(tracked)
+    for name, ht in tracked.items():
+        assert result[name].confs == ht.confs
+
+
+@pytest.mark.parametrize('corr_f', [correction.windowed_corr,
+                                    correction.RecursiveLeastSquaresCorrection()])
+def test_unit_weights_match_unweighted(chords, corr_f):
+    times, _ = clustering.OnsetClusterer(30).cluster(chords)
+    tht = tactus_hypothesis_tracker.default_tht(corr_f=corr_f)
+    expected = tht(times)
+    result = tht(times, onset_weights=np.ones(len(times)))
+    assert sorted(result) == sorted(expected)
+    for name, ht in expected.items():
+        assert [c for _, c in result[name].confs] == pytest.approx(
+            [c for _, c in ht.confs])
+
+
+def test_weights_change_evaluation(chords):
+    times, weights = clustering.OnsetClusterer(30).cluster(chords)
+    ht = tactus_hypothesis_tracker.HypothesisTracker(0, 2, times)
+    ongoing_play = playback.OngoingPlayback(times, weights=weights)
+    unweighted = playback.OngoingPlayback(times)
+    for _ in range(len(times) - 1):
+        ongoing_play.advance()
+        unweighted.advance()
+    eval_f = confidence.windowed_conf
+    conf = eval_f(ht, ongoing_play)
+    assert conf != eval_f(ht, unweighted)
+    assert eval_f.bound(ht, ongoing_play) >= conf
+    assert (correction.windowed_corr(ht, ongoing_play).n_delta !=
+            correction.windowed_corr(ht, unweighted).n_delta)
+
+
+def test_weighted_pool_matches_serial(chords):
+    times, weights = clustering.OnsetClusterer(30).cluster(chords)
+    expected = tactus_hypothesis_tracker.default_tht()(
+        times, onset_weights=weights)
+    with parallel.HypothesisPool(2, min_hypotheses=4) as pool:
+        result = tactus_hypothesis_tracker.default_tht(update_pool=pool)(
+            times, onset_weights=weights)
+    assert sorted(result) == sorted(expected)
+    for name, ht in expected.items():
+        assert result[name].confs == ht.confs
+        assert (result[name].r, result[name].d) == (ht.r, ht.d)
+
+
+def test_weighted_state_resumes(chords):
+    times, weights = clustering.OnsetClusterer(30).cluster(chords)
+    tht = tactus_hypothesis_tracker.default_tht()
+    expected = tht(times, onset_weights=weights)
+
+    state = tht.start(times[:20], onset_weights=weights[:20])
+    tht.run(state)
+    with pytest.raises(ValueError):
+        state.resume(times)
+    state.resume(times, weights)
+    tht.run(state)
+    result = state.result()
+    assert sorted(result) == sorted(expected)
+    for name, ht in expected.items():
+        assert result[name].confs == ht.confs
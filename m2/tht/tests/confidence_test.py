@@ -0,0 +1,191 @@
+import importlib.util
+import pickle
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import m2
+from m2.tht import confidence
+from m2.tht import playback
+from m2.tht import tactus_hypothesis_tracker
+
+
+@pytest.fixture
+def onsets():
+    return np.arange(40) * 500.
+
+
+def discovered(onsets, count):
+    ongoing_play = playback.OngoingPlayback(onsets)
+    for _ in range(count - 1):
+        ongoing_play.advance()
+    return ongoing_play
+
+
+def test_memoized_eval_shares_phase_equivalent_hypotheses(onsets):
+    eval_f = confidence.MemoizedEval(confidence.windowed_conf)
+    ongoing_play = discovered(onsets, 20)
+    first = tactus_hypothesis_tracker.HypothesisTracker(0, 2, onsets)
+    # One period later, same delta and phase
+    second = tactus_hypothesis_tracker.HypothesisTracker(2, 4, onsets)
+    other = tactus_hypothesis_tracker.HypothesisTracker(0, 1, onsets)
+
+    conf = eval_f(first, ongoing_play)
+    assert eval_f(second, ongoing_play) == conf
+    assert eval_f(other, ongoing_play) == confidence.windowed_conf(
+        other, ongoing_play)
+    assert eval_f.report() == {'hits': 1, 'misses': 2}
+
+    ongoing_play.advance()
+    eval_f(second, ongoing_play)
+    assert eval_f.report() == {'hits': 1, 'misses': 3}
+
+
+def test_memoized_eval_tracking_matches(onsets):
+    eval_f = confidence.MemoizedEval(confidence.windowed_conf, 0)
+    expected = tactus_hypothesis_tracker.default_tht()(onsets)
+    result = tactus_hypothesis_tracker.default_tht(eval_f=eval_f)(onsets)
+
+    assert eval_f.report()['hits'] > 0
+    assert sorted(result) == sorted(expected)
+    for name, ht in expected.items():
+        assert [c for _, c in result[name].confs] == pytest.approx(
+            [c for _, c in ht.confs])
+
+
+def test_memoized_eval_delegates_and_pickles(onsets):
+    eval_f = confidence.MemoizedEval(confidence.windowed_conf)
+    assert eval_f.window == confidence.windowed_conf.window
+    # Bounds do not hold for confidences shared within a tolerance
+    assert not hasattr(eval_f, 'bound')
+    assert hasattr(confidence.MemoizedEval(confidence.windowed_conf, 0),
+                   'bound')
+    assert not hasattr(confidence.MemoizedEval(confidence.conf_all),
+                       'bound')
+
+    eval_f(tactus_hypothesis_tracker.HypothesisTracker(0, 2, onsets),
+           discovered(onsets, 5))
+    copy = pickle.loads(pickle.dumps(eval_f))
+    assert copy.tolerance == eval_f.tolerance
+    assert copy.report() == {'hits': 0, 'misses': 0}
+
+
+@pytest.fixture
+def metrical_onsets():
+    rng = np.random.RandomState(1)
+    beats = np.arange(0, 15000, 500.)
+    return np.sort(np.concatenate([
+        beats + rng.normal(0, 8, len(beats)),
+        beats[::2] + 250 + rng.normal(0, 8, len(beats[::2]))]))
+
+
+def jittered_metrical_onsets(seed):
+    'Onsets of beats and off beats with tempo and timing jitter'
+    rng = np.random.RandomState(seed)
+    beats = np.cumsum(rng.normal(500, 20, 40))
+    return np.sort(np.concatenate([
+        beats + rng.normal(0, 15, len(beats)),
+        beats[::2] + 250 + rng.normal(0, 25, 20),
+        rng.uniform(0, beats[-1], 5)]))
+
+
+@pytest.mark.parametrize('tolerance', [0.01, 5])
+def test_memoized_eval_two_phase_update(tolerance):
+    onsets = jittered_metrical_onsets(3)
+    expected = tactus_hypothesis_tracker.default_tht(
+        eval_f=confidence.MemoizedEval(confidence.windowed_conf,
+                                       tolerance))(onsets)
+    result = tactus_hypothesis_tracker.default_tht(
+        eval_f=confidence.MemoizedEval(confidence.windowed_conf, tolerance),
+        two_phase_update=True, verify_two_phase=True)(onsets)
+    assert sorted(result) == sorted(expected)
+    for name, ht in expected.items():
+        assert result[name].confs == ht.confs
+
+
+@pytest.mark.parametrize('config', [{}, {'two_phase_update': True}])
+def test_family_eval_tracking_matches(metrical_onsets, config):
+    eval_f = confidence.FamilyWindowedExpEval(6000, verify=True)
+    expected = tactus_hypothesis_tracker.default_tht(**config)(
+        metrical_onsets)
+    result = tactus_hypothesis_tracker.default_tht(eval_f=eval_f, **config)(
+        metrical_onsets)
+
+    assert eval_f.report()['shared'] > 0
+    assert sorted(result) == sorted(expected)
+    for name, ht in expected.items():
+        assert result[name].confs == ht.confs
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_family_eval_jittered_tracking_matches(seed):
+    onsets = jittered_metrical_onsets(seed)
+    eval_f = confidence.FamilyWindowedExpEval(6000, tolerance=50,
+                                              verify=True)
+    expected = tactus_hypothesis_tracker.default_tht()(onsets)
+    result = tactus_hypothesis_tracker.default_tht(eval_f=eval_f)(onsets)
+
+    assert eval_f.report()['shared'] > 0
+    assert sorted(result) == sorted(expected)
+    for name, ht in expected.items():
+        assert result[name].confs == ht.confs
+
+
+def test_family_eval_verifies_shared_matches(onsets):
+    eval_f = confidence.FamilyWindowedExpEval(6000, verify=True)
+    ongoing_play = discovered(onsets, 20)
+    ht = tactus_hypothesis_tracker.HypothesisTracker(0, 2, onsets)
+    eval_f.prepare([ht], ongoing_play)
+    eval_f(ht, ongoing_play)
+    # A wrong shared match
+    cur, idx = eval_f._families.matches[id(ht)]
+    eval_f._families.matches[id(ht)] = (cur, idx + 1)
+    with pytest.raises(RuntimeError):
+        eval_f(ht, ongoing_play)
+
+
+def test_family_eval_pickles(onsets):
+    eval_f = confidence.FamilyWindowedExpEval(6000, tolerance=1)
+    ongoing_play = discovered(onsets, 20)
+    hts = [tactus_hypothesis_tracker.HypothesisTracker(0, i, onsets)
+           for i in (1, 2)]
+    eval_f.prepare(hts, ongoing_play)
+    assert [eval_f(ht, ongoing_play) for ht in hts] == [
+        confidence.windowed_conf(ht, ongoing_play) for ht in hts]
+    assert eval_f.report() == {'roots': 1, 'shared': 1, 'rematched': 0}
+
+    copy = pickle.loads(pickle.dumps(eval_f))
+    assert (copy.window, copy.tolerance) == (6000, 1)
+    assert copy.report() == {'roots': 0, 'shared': 0, 'rematched': 0}
+
+
+def test_povel_accents_of_shifted_windows(monkeypatch):
+    povel = types.ModuleType('m2.povel1985')
+    povel.calls = 0
+
+    def accented_onsets(onsets):
+        povel.calls += 1
+        return [o for o in onsets if o % 1000 == 0]
+
+    povel.accented_onsets = accented_onsets
+    monkeypatch.setitem(sys.modules, 'm2.povel1985', povel)
+    monkeypatch.setattr(m2, 'povel1985', povel, raising=False)
+    # A copy of the module defines the accent modifiers with the stub
+    spec = importlib.util.spec_from_file_location('povel_confidence',
+                                                  confidence.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    mod = module.PovelAccentConfMod(4)
+    onsets = np.arange(20) * 250.
+    assert mod.accent_mask(onsets[0:6]).tolist() == [
+        True, False, False, False, True, False]
+    assert mod.accent_mask(onsets[0:6]).tolist() == [
+        True, False, False, False, True, False]
+    assert povel.calls == 1
+    # Same length and base array, shifted
+    assert mod.accent_mask(onsets[1:7]).tolist() == [
+        False, False, False, True, False, False]
+    assert povel.calls == 2
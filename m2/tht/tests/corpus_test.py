@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+from m2.tht import corpus
+from m2.tht import onset_detection
+from m2.tht import sweep
+from m2.tht.onsets import load_onsets
+
+SAMPLE_RATE = 22050
+
+
+@pytest.fixture
+def inputs(tmpdir):
+    'Directory with WAV files of noise bursts and a file that is not audio'
+    rng = np.random.RandomState(0)
+    directory = tmpdir.mkdir('inputs')
+    for name, ioi in [('slow.wav', 600.), ('sub/fast.wav', 350.)]:
+        samples = rng.normal(0, 0.001, SAMPLE_RATE * 4)
+        burst = np.arange(1000)
+        for t in np.arange(250, 3800, ioi):
+            i = int(t * SAMPLE_RATE / 1000)
+            samples[i:i + len(burst)] += (rng.normal(0, 0.3, len(burst)) *
+                                          np.exp(-burst / 200.))
+        filename = directory.join(name)
+        filename.dirpath().ensure(dir=True)
+        wavfile.write(str(filename), SAMPLE_RATE,
+                      (samples * 32767).astype(np.int16))
+    directory.join('notes.txt').write('not audio')
+    return str(directory)
+
+
+@pytest.fixture
+def corpus_file(tmpdir, inputs):
+    filename = str(tmpdir.join('corpus.thtc'))
+    with pytest.warns(UserWarning):
+        skipped = corpus.build_corpus(filename, [inputs],
+                                      detector='spectral_flux', processes=1)
+    assert [fn.endswith('notes.txt') for fn, _ in skipped] == [True]
+    return filename
+
+
+def test_corpus_items_match_inputs(inputs, corpus_file):
+    onset_corpus = corpus.OnsetCorpus(corpus_file)
+    assert onset_corpus.ids() == ['slow.wav', 'sub/fast.wav']
+    assert corpus.is_corpus(corpus_file)
+    assert not corpus.is_corpus(inputs + '/slow.wav')
+
+    for item, onsets in onset_corpus:
+        expected = list(onset_detection.wav_onsets(item['source']))
+        assert list(onsets) == expected
+        assert item['duration'] == expected[-1]
+        assert isinstance(onsets, np.memmap)
+        assert not onsets.flags.writeable
+    assert list(onset_corpus[1]) == list(onset_corpus['sub/fast.wav'])
+    with pytest.raises(KeyError):
+        onset_corpus['missing.wav']
+
+
+def test_parallel_build_matches(tmpdir, inputs, corpus_file):
+    filename = str(tmpdir.join('parallel.thtc'))
+    with pytest.warns(UserWarning):
+        corpus.build_corpus(filename, [inputs], detector='spectral_flux',
+                            processes=2)
+    with open(filename, 'rb') as f, open(corpus_file, 'rb') as g:
+        assert f.read() == g.read()
+
+
+def test_corpus_as_input(corpus_file):
+    onset_corpus = corpus.OnsetCorpus(corpus_file)
+    assert list(load_onsets(corpus_file, item='slow.wav')) == \
+        list(onset_corpus['slow.wav'])
+    with pytest.raises(ValueError):
+        load_onsets(corpus_file)
+
+    results = sweep.sweep({'max_hypotheses': [5]}, [corpus_file],
+                          processes=1)
+    assert list(results.file) == sorted(
+        '{}:{}'.format(corpus_file, i) for i in onset_corpus.ids())
+    assert list(results.onsets) == [len(onset_corpus['slow.wav']),
+                                    len(onset_corpus['sub/fast.wav'])]
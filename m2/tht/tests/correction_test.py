@@ -0,0 +1,94 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from m2.tht import benchmark
+from m2.tht import correction
+from m2.tht import playback
+from m2.tht import tactus_hypothesis_tracker
+
+
+@pytest.fixture
+def manifest():
+    rng = np.random.RandomState(0)
+    items = []
+    for name, ioi in [('accel', np.linspace(600, 420, 60)),
+                      ('rubato', 500 + 60 * np.sin(np.arange(60) / 8.))]:
+        beats = np.cumsum(ioi)
+        onsets = np.sort(np.concatenate([
+            beats + rng.normal(0, 8, len(beats)),
+            beats[:-1] + np.diff(beats) / 2]))
+        items.append({'name': name, 'onsets': list(onsets),
+                      'reference': list(beats)})
+    return items
+
+
+def test_rls_follows_tempo_change():
+    onsets = np.cumsum(np.concatenate([np.full(10, 500.),
+                                       np.linspace(500, 450, 30),
+                                       np.full(10, 450.)]))
+    corr_f = correction.RecursiveLeastSquaresCorrection()
+    ongoing_play = playback.OngoingPlayback(onsets)
+    ongoing_play.advance()
+    ht = tactus_hypothesis_tracker.HypothesisTracker(0, 1, onsets)
+    for _ in range(len(onsets) - 2):
+        ongoing_play.advance()
+        ht.correct(ongoing_play, corr_f)
+    assert ht.d == pytest.approx(450, abs=5)
+    assert abs(ht.r + ht.d * round((onsets[-1] - ht.r) / ht.d) -
+               onsets[-1]) < 10
+
+
+def test_rls_updates_with_new_onsets_only():
+    onsets = np.arange(10) * 500.
+    corr_f = correction.RecursiveLeastSquaresCorrection()
+    ongoing_play = playback.OngoingPlayback(onsets)
+    for _ in range(5):
+        ongoing_play.advance()
+    ht = tactus_hypothesis_tracker.HypothesisTracker(0, 1, onsets)
+    ht.htuple = (ht.r + 20, ht.d)
+    first = corr_f(ht, ongoing_play)
+    # Nothing new to update with
+    second = corr_f(ht, ongoing_play)
+    assert (second.n_rho, second.n_delta) == (ht.r, ht.d)
+    assert first.n_rho != ht.r
+
+    # The state is pickled with the hypothesis tracker
+    copy = pickle.loads(pickle.dumps(corr_f))
+    assert copy.forgetting == corr_f.forgetting
+    ht_copy = pickle.loads(pickle.dumps(ht))
+    unchanged = copy(ht_copy, ongoing_play)
+    assert (unchanged.n_rho, unchanged.n_delta) == (ht.r, ht.d)
+    ongoing_play.advance()
+    assert copy(ht_copy, ongoing_play).n_rho == corr_f(ht, ongoing_play).n_rho
+
+
+def test_rls_pickled_state_resumes():
+    rng = np.random.RandomState(0)
+    onsets = np.cumsum(rng.normal(500, 15, 40))
+    tht = tactus_hypothesis_tracker.default_tht(
+        corr_f=correction.RecursiveLeastSquaresCorrection())
+    expected = tht(onsets)
+
+    state = tht.start(onsets)
+    for idx in tht.steps(state):
+        if idx == len(onsets) // 2:
+            break
+    state = pickle.loads(pickle.dumps(state))
+    tht.run(state)
+    result = state.result()
+
+    assert sorted(result) == sorted(expected)
+    for name, ht in expected.items():
+        assert result[name].confs == ht.confs
+        assert (result[name].r, result[name].d) == (ht.r, ht.d)
+
+
+def test_rls_compared_to_windowed_corr(manifest):
+    results = benchmark.evaluate(
+        manifest, [{'corr_f': 'windowed_corr'}, {'corr_f': 'rls_corr'}],
+        processes=1)
+    comparison = benchmark.compare(results).set_index('config')
+    assert comparison.loc[1, 'f_measure_delta'] > -0.1
+    assert comparison.loc[1, 'amlt_delta'] > -0.1
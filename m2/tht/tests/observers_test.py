@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from m2.tht import observers
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import tracker_analysis
+
+
+@pytest.fixture(params=['random', 'metronome'])
+def onsets(request):
+    if request.param == 'metronome':
+        # Many hypotheses tie on confidence
+        return np.arange(0, 20000, 500.)
+    rng = np.random.RandomState(2)
+    return np.cumsum(rng.choice([250, 500, 750], 60) +
+                     rng.normal(0, 10, 60))
+
+
+@pytest.mark.parametrize('max_hypotheses', [5, 30])
+def test_observers_match_archived_result(onsets, max_hypotheses):
+    top, confs = observers.TopHypothesis(), observers.TrackingConfs()
+    tactus_hypothesis_tracker.default_tht(
+        max_hypotheses=max_hypotheses, observers=[top, confs])(onsets)
+
+    hts = tactus_hypothesis_tracker.default_tht(
+        max_hypotheses=max_hypotheses, archive_hypotheses=True,
+        archive_trimmed=True)(onsets)
+    expected = tracker_analysis.top_hypothesis(hts, len(onsets))
+
+    timeline = top.timeline()
+    assert ([(idx, ht.onset_indexes, dict(ht.confs)[idx])
+             for idx, ht in expected] ==
+            [(r['onset_idx'], (r['a'], r['b']), r['conf'])
+             for r in timeline])
+    for r, (idx, ht) in zip(timeline, expected):
+        assert (r['rho'], r['delta']) == tuple(
+            dict(ht.corr)[idx].new_hypothesis().htuple)
+    assert confs.confs == tracker_analysis.tht_tracking_confs(hts,
+                                                              len(onsets))
+
+
+def test_snapshots_are_read_only(onsets):
+    snapshots = []
+    hts = tactus_hypothesis_tracker.default_tht(
+        max_hypotheses=5, observers=[snapshots.append])(onsets)
+
+    assert [s.onset_idx for s in snapshots] == list(range(1, len(onsets)))
+    last = snapshots[-1]
+    assert (sorted('%d-%d' % tuple(o) for o in last.live.origins) ==
+            sorted(hts))
+    assert list(last.live.conf) == sorted(last.live.conf, reverse=True)
+    assert len(last.trimmed.origins) == len(last.trimmed_by)
+    with pytest.raises(ValueError):
+        last.live.conf[0] = 0
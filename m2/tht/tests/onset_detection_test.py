@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+from m2.tht import evaluation
+from m2.tht import onset_detection
+from m2.tht import tactus_hypothesis_tracker
+
+SAMPLE_RATE = 22050
+
+
+@pytest.fixture
+def clicks(tmpdir):
+    'WAV file of noise bursts over a noise floor, with their onsets [ms]'
+    rng = np.random.RandomState(0)
+    samples = rng.normal(0, 0.001, SAMPLE_RATE * 8)
+    onsets = np.arange(250, 7800, 450.) + rng.normal(0, 20, 17)
+    burst = np.arange(1000)
+    for t in onsets:
+        i = int(t * SAMPLE_RATE / 1000)
+        samples[i:i + len(burst)] += (rng.normal(0, 0.3, len(burst)) *
+                                      np.exp(-burst / 200.))
+    filename = str(tmpdir.join('clicks.wav'))
+    wavfile.write(filename, SAMPLE_RATE, (samples * 32767).astype(np.int16))
+    return filename, onsets
+
+
+def test_detects_bursts(clicks):
+    filename, expected = clicks
+    onsets = list(onset_detection.wav_onsets(filename, frame_size=1024))
+    assert evaluation.f_measure(expected, onsets, 50) == 1.0
+
+
+def test_chunking_does_not_change_onsets(clicks):
+    filename, _ = clicks
+    expected = list(onset_detection.wav_onsets(filename, chunk_size=2 ** 16))
+    assert list(onset_detection.wav_onsets(filename,
+                                           chunk_size=999)) == expected
+
+
+def test_track_onsets_matches_tracking(clicks):
+    filename, _ = clicks
+    onsets = np.array(list(onset_detection.wav_onsets(filename)))
+    expected = tactus_hypothesis_tracker.default_tht()(onsets)
+    result = onset_detection.track_onsets(
+        tactus_hypothesis_tracker.default_tht(),
+        onset_detection.wav_onsets(filename), batch_size=3)
+    assert sorted(result) == sorted(expected)
+    for name, ht in expected.items():
+        assert result[name].confs == ht.confs
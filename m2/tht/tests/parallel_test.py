@@ -0,0 +1,104 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from m2.tht import confidence
+from m2.tht import correction
+from m2.tht import parallel
+from m2.tht import tactus_hypothesis_tracker
+
+
+@pytest.fixture
+def onsets():
+    rng = np.random.RandomState(1)
+    iois = rng.choice([250, 500, 750], 60) + rng.normal(0, 10, 60)
+    return np.cumsum(iois)
+
+
+class MomentumCorrection():
+    'Adds half the last delta correction to the corrections of corr_f'
+
+    def __init__(self, corr_f):
+        self.corr_f = corr_f
+
+    def __call__(self, ht, ongoing_play):
+        c = self.corr_f(ht, ongoing_play)
+        if not ht.corr:
+            return c
+        _, last = ht.corr[-1]
+        return correction.HypothesisCorrection(
+            c.o_rho, c.o_delta, c.n_rho, c.n_delta + last.d_delta / 2)
+
+
+def tracking_values(hts):
+    'Values of each tracker, with corrections as float arrays'
+    return {name: (np.array([[idx] + [np.nan if v is None else v
+                                      for v in vars(c).values()]
+                             for idx, c in ht.corr], dtype=float),
+                   np.array(ht.confs, dtype=float), (ht.r, ht.d))
+            for name, ht in hts.items()}
+
+
+@pytest.mark.parametrize('config', [
+    {'max_hypotheses': 20},
+    {'max_hypotheses': 20, 'two_phase_update': True},
+    {'max_hypotheses': 10, 'archive_hypotheses': True},
+    {'max_hypotheses': 20,
+     'corr_f': MomentumCorrection(correction.windowed_corr)}])
+def test_pool_matches_serial_tracking(onsets, config):
+    expected = tracking_values(
+        tactus_hypothesis_tracker.default_tht(**config)(onsets))
+    with parallel.HypothesisPool(2, min_hypotheses=4) as pool:
+        tht = tactus_hypothesis_tracker.default_tht(update_pool=pool,
+                                                    **config)
+        result = tracking_values(tht(onsets))
+
+    assert result.keys() == expected.keys()
+    for name, (corr, confs, cur) in expected.items():
+        r_corr, r_confs, r_cur = result[name]
+        assert np.array_equal(r_corr, corr, equal_nan=True)
+        assert np.array_equal(r_confs, confs)
+        assert r_cur == cur
+
+
+@pytest.mark.parametrize('config', [
+    {'corr_f': correction.RecursiveLeastSquaresCorrection()},
+    {'eval_f': confidence.IncrementalAllHistoryEval('gauss', 1, 5),
+     'corr_f': correction.IncrementalLinearRegressCorrection(),
+     'max_hypotheses': 10}])
+def test_pool_keeps_function_states(onsets, config):
+    expected = tracking_values(
+        tactus_hypothesis_tracker.default_tht(**config)(onsets))
+    with parallel.HypothesisPool(2, min_hypotheses=4) as pool:
+        tht = tactus_hypothesis_tracker.default_tht(update_pool=pool,
+                                                    **config)
+        result = tracking_values(tht(onsets))
+
+    assert result.keys() == expected.keys()
+    for name, (corr, confs, cur) in expected.items():
+        r_corr, r_confs, r_cur = result[name]
+        assert np.array_equal(r_corr, corr, equal_nan=True)
+        assert np.array_equal(r_confs, confs)
+        assert r_cur == cur
+
+
+def test_pool_refuses_unsafe_functions(onsets):
+    eval_f = confidence.MemoizedEval(confidence.windowed_conf, 0.01)
+    assert not parallel.is_parallel_safe(eval_f)
+    assert parallel.is_parallel_safe(
+        confidence.MemoizedEval(confidence.windowed_conf, 0))
+    with parallel.HypothesisPool(2, min_hypotheses=4) as pool:
+        tht = tactus_hypothesis_tracker.default_tht(update_pool=pool,
+                                                    eval_f=eval_f)
+        with pytest.raises(ValueError):
+            tht(onsets)
+
+
+def test_pool_is_not_pickled(onsets):
+    with parallel.HypothesisPool(2, min_hypotheses=4) as pool:
+        tht = tactus_hypothesis_tracker.default_tht(update_pool=pool)
+        tht(onsets)
+        copy = pickle.loads(pickle.dumps(tht)).update_pool
+    assert (copy.processes, copy.min_hypotheses) == (2, 4)
+    assert copy._pool is None
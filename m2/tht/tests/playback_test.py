@@ -0,0 +1,37 @@
+import numpy as np
+
+from m2.tht import playback
+
+
+def brute_pair_ranges(onset_times, min_delta, max_delta):
+    return [[k for k in range(i)
+             if min_delta <= onset_times[i] - onset_times[k] <= max_delta]
+            for i in range(len(onset_times))]
+
+
+def test_pair_ranges_match_delta_restrictions():
+    onset_times = np.cumsum(np.random.RandomState(1).uniform(0.1, 300, 200))
+    index = playback.OnsetIndex(onset_times)
+    for min_delta, max_delta in [(187.5, 1500), (0.1, 10000), (500, 500)]:
+        lo, hi = index.pair_ranges(min_delta, max_delta)
+        expected = brute_pair_ranges(onset_times, min_delta, max_delta)
+        assert [list(range(l, h)) for l, h in zip(lo, hi)] == expected
+
+
+def test_pair_ranges_on_exact_deltas():
+    onset_times = list(range(10))
+    index = playback.OnsetIndex(onset_times)
+    lo, hi = index.pair_ranges(1, 2)
+    assert ([list(range(l, h)) for l, h in zip(lo, hi)] ==
+            brute_pair_ranges(onset_times, 1, 2))
+
+
+def test_discovered_window_matches_filter():
+    onset_times = np.cumsum(np.random.RandomState(2).uniform(1, 900, 50))
+    ongoing_play = playback.OngoingPlayback(onset_times)
+    while ongoing_play.advance():
+        discovered = ongoing_play.discovered_play()
+        expected = [o for o in discovered if o > discovered[-1] - 6000]
+        assert list(ongoing_play.discovered_window(6000)) == expected
+        assert (list(playback.Playback(discovered).discovered_window(6000))
+                == expected)
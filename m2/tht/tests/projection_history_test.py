@@ -0,0 +1,154 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from m2.tht import clustering
+from m2.tht import confidence
+from m2.tht import correction
+from m2.tht import playback
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import utils
+
+
+@pytest.fixture
+def onsets():
+    rng = np.random.RandomState(0)
+    beats = np.arange(0, 12000, 450.)
+    return np.sort(np.concatenate([
+        beats + rng.normal(0, 10, len(beats)),
+        beats[::2] + 225,
+        rng.uniform(0, 12000, 8)]))
+
+
+def test_project_indexes_match_project():
+    rng = np.random.RandomState(1)
+    for _ in range(2000):
+        # Rounded values produce repeated and equally near values
+        reference = np.sort(np.round(rng.uniform(0, 100,
+                                                 rng.randint(1, 12))))
+        base = np.sort(np.round(rng.uniform(-10, 110, rng.randint(1, 10)),
+                                rng.randint(0, 2)))
+        expected = [r for _, _, r in utils.project(range(len(base)), base,
+                                                    reference)]
+        assert list(reference[utils.project_indexes(base, reference)]) == \
+            expected
+
+
+@pytest.mark.parametrize('eval_f,expected_f', [
+    (confidence.IncrementalAllHistoryEval('exp', tolerance=0),
+     confidence.all_history_eval_exp),
+    (confidence.IncrementalAllHistoryEval('gauss', 1, 5, tolerance=0),
+     confidence.conf_all),
+    (confidence.IncrementalAllHistoryEval('abs', tolerance=0),
+     confidence.all_history_eval),
+])
+def test_incremental_eval_matches_all_history(onsets, eval_f, expected_f):
+    ongoing_play = playback.OngoingPlayback(onsets)
+    ongoing_play.advance()
+    ht = tactus_hypothesis_tracker.HypothesisTracker(0, 2, onsets)
+    for idx in range(3, len(onsets)):
+        ongoing_play.advance()
+        # Hypotheses move on each step
+        ht.htuple = (ht.r + 0.5, ht.d)
+        assert (eval_f(ht, ongoing_play) ==
+                pytest.approx(expected_f(ht, ongoing_play), rel=1e-9))
+
+
+def test_exact_tracking_matches_all_history(onsets):
+    config = {'max_hypotheses': 10}
+    expected = tactus_hypothesis_tracker.default_tht(
+        eval_f=confidence.conf_all, corr_f=correction.lin_r_corr,
+        **config)(onsets)
+    result = tactus_hypothesis_tracker.default_tht(
+        eval_f=confidence.IncrementalAllHistoryEval('gauss', 1, 5,
+                                                    tolerance=0),
+        corr_f=correction.IncrementalLinearRegressCorrection(tolerance=0),
+        **config)(onsets)
+
+    assert sorted(result) == sorted(expected)
+    for name, ht in expected.items():
+        np.testing.assert_allclose([c for _, c in result[name].confs],
+                                   [c for _, c in ht.confs], rtol=1e-9)
+        for (_, c), (_, e) in zip(result[name].corr, ht.corr):
+            assert (c.n_rho, c.n_delta, c.r_value, c.p_value, c.stderr) == \
+                pytest.approx((e.n_rho, e.n_delta, e.r_value, e.p_value,
+                               e.stderr), rel=1e-6, abs=1e-9, nan_ok=True)
+
+
+def test_tolerance_reuses_sums(onsets):
+    eval_f = confidence.IncrementalAllHistoryEval('gauss', 1, 5,
+                                                  tolerance=5)
+    corr_f = correction.IncrementalLinearRegressCorrection(tolerance=5)
+    result = tactus_hypothesis_tracker.default_tht(
+        eval_f=eval_f, corr_f=corr_f, max_hypotheses=10)(onsets)
+    expected = tactus_hypothesis_tracker.default_tht(
+        eval_f=confidence.conf_all, corr_f=correction.lin_r_corr,
+        max_hypotheses=10)(onsets)
+
+    assert eval_f.report()['incremental'] > 0
+    assert corr_f.report()['incremental'] > 0
+    best = max(expected.values(), key=lambda ht: ht.conf)
+    assert best.name in result
+    assert result[best.name].d == pytest.approx(best.d, rel=1e-2)
+
+
+def test_pickled_eval_keeps_tracker_sums(onsets):
+    eval_f = confidence.IncrementalAllHistoryEval()
+    ongoing_play = playback.OngoingPlayback(onsets)
+    for _ in range(10):
+        ongoing_play.advance()
+    ht = tactus_hypothesis_tracker.HypothesisTracker(0, 2, onsets)
+    conf = eval_f(ht, ongoing_play)
+
+    copy = pickle.loads(pickle.dumps(eval_f))
+    assert copy.tolerance == eval_f.tolerance
+    assert copy.report() == {'full': 0, 'incremental': 0}
+    ht_copy = pickle.loads(pickle.dumps(ht))
+    assert copy(ht_copy, ongoing_play) == conf
+    # Sums are kept by the hypothesis tracker, not the function
+    assert copy.report() == {'full': 0, 'incremental': 1}
+
+
+def test_pickled_state_resumes(onsets):
+    tht = tactus_hypothesis_tracker.default_tht(
+        eval_f=confidence.IncrementalAllHistoryEval('gauss', 1, 5,
+                                                    tolerance=5),
+        corr_f=correction.IncrementalLinearRegressCorrection(tolerance=5),
+        max_hypotheses=10)
+    expected = tht(onsets)
+
+    state = tht.start(onsets)
+    for idx in tht.steps(state):
+        if idx == len(onsets) // 2:
+            break
+    state = pickle.loads(pickle.dumps(state))
+    tht.run(state)
+    result = state.result()
+
+    assert sorted(result) == sorted(expected)
+    for name, ht in expected.items():
+        assert result[name].confs == ht.confs
+        assert [(c.n_rho, c.n_delta) for _, c in result[name].corr] == \
+            [(c.n_rho, c.n_delta) for _, c in ht.corr]
+
+
+def test_weighted_incremental_eval_matches_all_history():
+    rng = np.random.RandomState(1)
+    beats = np.cumsum(rng.normal(520, 8, 40))
+    chords = np.concatenate([
+        b + np.sort(rng.uniform(0, 20, rng.randint(1, 5))) for b in beats])
+    times, weights = clustering.OnsetClusterer(30).cluster(chords)
+    eval_f = confidence.IncrementalAllHistoryEval('exp', tolerance=0)
+    ongoing_play = playback.OngoingPlayback(times, weights=weights)
+    ongoing_play.advance()
+    ht = tactus_hypothesis_tracker.HypothesisTracker(0, 2, times)
+    for idx in range(3, len(times)):
+        ongoing_play.advance()
+        # Kept sums are reused on the steps the hypothesis does not move
+        if idx % 2:
+            ht.htuple = (ht.r + 0.5, ht.d)
+        assert (eval_f(ht, ongoing_play) ==
+                pytest.approx(confidence.all_history_eval_exp(
+                    ht, ongoing_play), rel=1e-9))
+    assert eval_f.report()['incremental'] > 0
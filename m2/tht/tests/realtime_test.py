@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from m2.tht import realtime
+from m2.tht import tactus_hypothesis_tracker
+
+
+@pytest.fixture
+def onsets():
+    return np.cumsum(np.random.RandomState(4).normal(300, 10, 40))
+
+
+class UpdateClock():
+    'Fake clock advanced manually, in ms'
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now / 1000.
+
+
+def summary(hts):
+    return sorted((name, ht.confs) for name, ht in hts.items())
+
+
+def test_large_deadline_does_not_change_tracking(onsets):
+    expected = tactus_hypothesis_tracker.default_tht()(onsets)
+    controller = realtime.DeadlineController(deadline=1e9)
+    hts = tactus_hypothesis_tracker.default_tht(controller=controller)(onsets)
+    assert summary(hts) == summary(expected)
+    assert controller.report()['degraded_steps'] == 0
+
+
+def test_short_deadline_reduces_budget(onsets):
+    clock = UpdateClock()
+    controller = realtime.DeadlineController(deadline=10, headroom=1,
+                                             clock=clock)
+    updated = []
+
+    def eval_f(ht, ongoing_play):
+        clock.now += 1  # each update costs 1 ms
+        updated.append(ongoing_play.discovered_index)
+        return tactus_hypothesis_tracker.defaults.eval_f(ht, ongoing_play)
+
+    tht = tactus_hypothesis_tracker.default_tht(eval_f=eval_f,
+                                                controller=controller)
+    hts = tht(onsets)
+    report = controller.report()
+    assert report['degraded_steps'] > 0
+    assert report['dropped_candidates'] > 0
+    steps = np.bincount(updated)
+    # After the first measured step, no step exceeds the budget
+    first = np.nonzero(steps)[0][0]
+    assert all(steps[first + 1:] <= 10)
+    assert len(hts) <= tht.max_hypotheses
+
+
+def test_admit_subsamples_evenly():
+    controller = realtime.DeadlineController(deadline=1)
+    assert controller.admit(list(range(10)), 3) == [0, 4, 9]
+    assert controller.admit(list(range(10)), 1) == [5]
+    assert controller.admit(list(range(3)), 5) == [0, 1, 2]
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from m2.tht import playback
+from m2.tht import seeding
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import tracker_analysis
+
+
+@pytest.fixture
+def dense_onsets():
+    rng = np.random.RandomState(7)
+    beats = np.arange(0, 30000, 500.)
+    notes = [beats, beats[::2] + 250, beats[1::4] + 125]
+    return np.sort(np.concatenate(notes) + rng.normal(0, 3, sum(
+        len(n) for n in notes)))
+
+
+def test_histogram_is_updated_incrementally(dense_onsets):
+    seeder = seeding.IOIHistogramSeeder(window=3000)
+    state = seeder.start(100, 1000)
+    ongoing_play = playback.OngoingPlayback(dense_onsets)
+    while ongoing_play.advance():
+        state.update(ongoing_play)
+        window = ongoing_play.discovered_window(3000)
+        iois = (window[None, :] - window[:, None]).ravel()
+        state_copy = seeding.IOISeeding(seeder, state.min_ioi, state.max_ioi)
+        state_copy._account(iois[iois > 0], 1)
+        assert np.array_equal(state.histogram, state_copy.histogram)
+
+
+def test_seeding_reduces_candidates(dense_onsets):
+    seeder = seeding.IOIHistogramSeeder()
+    tht = tactus_hypothesis_tracker.default_tht(seeder=seeder)
+    hts = tht(dense_onsets)
+    report = seeder.report()
+    assert report['considered'] > report['admitted'] > 0
+    assert report['reduction'] > 0.3
+
+    top = tracker_analysis.top_hypothesis(hts, len(dense_onsets))
+    idx, ht = top[-1]
+    delta = dict(ht.corr)[idx].n_delta
+    assert min(abs(delta - p) for p in (250, 500, 1000)) < 25
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from m2.tht import confidence
+from m2.tht import correction
+from m2.tht import segmented
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import tracker_analysis
+
+
+@pytest.fixture
+def onsets():
+    return np.cumsum(np.random.RandomState(5).normal(500, 10, 150))
+
+
+def test_segment_bounds_cover_onsets(onsets):
+    bounds = segmented.segment_bounds(onsets, 20000, 8000)
+    firsts = [f for _, f, _ in bounds]
+    lasts = [l for _, _, l in bounds]
+    assert firsts[0] == 0 and lasts[-1] == len(onsets) - 1
+    assert firsts[1:] == [l + 1 for l in lasts[:-1]]
+    for start, first, _ in bounds:
+        assert onsets[first] - onsets[start] <= 8000
+        assert start == 0 or onsets[first] - onsets[start - 1] > 8000
+
+
+def test_overlap_must_cover_window(onsets):
+    tht = tactus_hypothesis_tracker.default_tht()
+    with pytest.raises(ValueError):
+        segmented.track_segmented(tht, onsets, overlap=1000)
+
+
+def test_windowless_tracker_needs_overlap(onsets):
+    tht = tactus_hypothesis_tracker.default_tht(eval_f=confidence.conf_all,
+                                                corr_f=correction.lin_r_corr)
+    with pytest.raises(ValueError):
+        segmented.track_segmented(tht, onsets[:60], segment_length=10000,
+                                  processes=1)
+    hts = segmented.track_segmented(tht, onsets[:60], segment_length=10000,
+                                    overlap=8000, processes=1)
+    top = tracker_analysis.top_hypothesis(hts, 60)
+    assert [idx for idx, _ in top] == list(range(3, 60))
+
+
+def test_segmented_tracking_is_continuous(onsets):
+    tht = tactus_hypothesis_tracker.default_tht()
+    hts = segmented.track_segmented(tht, onsets, segment_length=20000,
+                                    processes=2)
+    top = tracker_analysis.top_hypothesis(hts, len(onsets))
+    assert [idx for idx, _ in top] == list(range(3, len(onsets)))
+
+    report = segmented.divergence(tht(onsets), hts, onsets)
+    assert report['compared_onsets'] == len(onsets) - 3
+    assert report['period_agreement'] > 0.9
+    assert report['top_agreement'] > 0.9
+    assert report['beat_f_measure'] > 0.9
+
+
+def test_stitch_continues_hypotheses_originated_in_overlap():
+    onsets = np.arange(10) * 500.0
+
+    def result(a, b, idxs, rho, delta):
+        corr = [(i, correction.HypothesisCorrection(rho, delta, rho, delta))
+                for i in idxs]
+        return (a, b, corr, [(i, 1.0) for i in idxs])
+
+    first = [result(0, 1, [2, 3, 4], 0, 500),
+             result(0, 2, [3, 4], 0, 1000)]
+    # 3-4 originated in the overlap and is 5 ms away from 0-1
+    second = [result(3, 4, [5, 6], 1505, 500),
+              result(4, 5, [6], 2000, 700)]
+    hts = segmented.stitch(onsets, [first, second])
+    assert sorted(hts) == ['0-1', '0-2', '4-5']
+    assert [idx for idx, _ in hts['0-1'].confs] == [2, 3, 4, 5, 6]
+    assert hts['0-1'].cur.htuple == (1505, 500)
+    assert [idx for idx, _ in hts['0-2'].confs] == [3, 4]
+
+    hts = segmented.stitch(onsets, [first, second], tolerance=1)
+    assert sorted(hts) == ['0-1', '0-2', '3-4', '4-5']
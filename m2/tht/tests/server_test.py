@@ -0,0 +1,104 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from m2.tht import server
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import tracker_analysis
+
+
+@pytest.fixture
+def onsets():
+    return list(np.arange(0, 8000, 500.)) + [8250., 8500.]
+
+
+@pytest.fixture
+def tracking_server():
+    s = server.TrackingServer(processes=1)
+    yield s
+    s.close()
+
+
+def test_beat_request_matches_tracking(onsets):
+    response = server.handle({'id': 3, 'mode': 'beat', 'onsets': onsets})
+    assert response['ok'] and response['id'] == 3
+
+    tht = tactus_hypothesis_tracker.default_tht()
+    expected = tracker_analysis.track_beats(onsets, tht)
+    assert np.allclose(response['beats'], expected)
+
+
+def test_full_request_writes_out_file(onsets, tmp_path):
+    out_file = str(tmp_path / 'full.csv')
+    response = server.handle({'mode': 'full', 'onsets': onsets,
+                              'out_file': out_file})
+    assert response['ok'] and response['out_file'] == out_file
+    assert os.path.exists(out_file)
+
+
+def test_errors_are_reported(tracking_server):
+    out = io.BytesIO()
+    requests = [b'{"id": 1, "mode": "tempo", "onsets": [0, 500]}',
+                b'not json',
+                b'{"id": 2}']
+    tracking_server.serve_stream(io.BytesIO(b'\n'.join(requests)), out)
+    responses = [json.loads(l) for l in out.getvalue().splitlines()]
+    assert [r['ok'] for r in responses] == [False] * 3
+    assert [r['id'] for r in responses] == [1, None, 2]
+
+
+def test_unix_socket_round_trip(tracking_server, onsets):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'tht.sock')
+    thread = threading.Thread(target=tracking_server.serve_unix,
+                              args=(path,))
+    thread.start()
+    try:
+        while tracking_server.unix_server is None:
+            time.sleep(0.01)
+        beat, congruence = server.request(path, [
+            {'mode': 'beat', 'onsets': onsets},
+            {'mode': 'congruence', 'onsets': onsets}])
+        assert beat['ok'] and congruence['ok']
+        assert len(beat['beats']) > 0
+        assert len(congruence['congruence']) == len(onsets) - 3
+    finally:
+        tracking_server.shutdown()
+        thread.join()
+        shutil.rmtree(directory)
+    assert tracking_server.unix_server is None
+
+
+def test_shutdown_without_serving(tracking_server):
+    tracking_server.shutdown()
+
+
+def test_in_process_requests_are_serialized(tracking_server, monkeypatch):
+    active = []
+    overlapped = []
+
+    def handle(request):
+        active.append(request['id'])
+        overlapped.append(len(active) > 1)
+        time.sleep(0.01)
+        active.remove(request['id'])
+        return {'id': request['id'], 'ok': True}
+
+    monkeypatch.setattr(server, 'handle', handle)
+    responses = []
+    threads = [threading.Thread(target=tracking_server.submit,
+                                args=({'id': i}, responses.append))
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(r['id'] for r in responses) == list(range(8))
+    assert not any(overlapped)
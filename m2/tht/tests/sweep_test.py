@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from m2.tht import confidence
+from m2.tht import sweep
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import tracker_analysis
+
+
+@pytest.fixture
+def corpus():
+    rng = np.random.RandomState(0)
+    return {
+        'slow': np.cumsum(rng.normal(600, 10, 25)),
+        'fast': np.cumsum(rng.normal(350, 10, 30))
+    }
+
+
+grid = {'max_hypotheses': [5, 10], 'eval_window': [3000, 6000]}
+
+
+def test_expand_grid():
+    assert sweep.expand_grid(grid) == [
+        {'max_hypotheses': 5, 'eval_window': 3000},
+        {'max_hypotheses': 5, 'eval_window': 6000},
+        {'max_hypotheses': 10, 'eval_window': 3000},
+        {'max_hypotheses': 10, 'eval_window': 6000}]
+
+
+def test_tracker_config_resolves_names():
+    config = sweep.tracker_config({'eval_f': 'conf_all', 'corr_window': 100})
+    assert config['eval_f'] is confidence.conf_all
+    assert config['corr_f'].window == 100
+    with pytest.raises(ValueError):
+        sweep.tracker_config({'eval_f': 'conf_all', 'eval_window': 100})
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_sweep_matches_independent_runs(corpus, processes):
+    rows = []
+    results = sweep.sweep(grid, corpus, processes=processes,
+                          on_result=rows.append)
+    assert len(rows) == len(results) == 8
+
+    for _, row in results.iterrows():
+        tht = tactus_hypothesis_tracker.default_tht(
+            max_hypotheses=row.max_hypotheses,
+            eval_f=confidence.WindowedExpEval(row.eval_window))
+        onsets = corpus[row.file]
+        hts = tht(onsets)
+        assert row.hypotheses == len(hts)
+        assert row.tracking_conf == pytest.approx(
+            tracker_analysis.tht_tracking_conf(hts, len(onsets)))
+
+    summary = sweep.summarize(results)
+    assert list(summary.config) == [0, 1, 2, 3]
+    assert list(summary.files) == [2] * 4
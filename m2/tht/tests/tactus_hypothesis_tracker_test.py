@@ -1,7 +1,11 @@
+import os
+import signal
 import unittest
 import pytest
 import collections
 
+import numpy as np
+
 from m2.tht import tactus_hypothesis_tracker
 from m2.tht import correction
 
@@ -153,3 +157,137 @@ class TestGeneralTrackingResults:
     def test_conf_onsets_are_complete_and_greater_than_beta_2(self, hts):
         assert all([proj_1(ht.confs) == list(range(ht.onset_indexes[1], 10))
             for ht in hts.values()])
+
+
+def tracking_values(hts):
+    return sorted((name, [(i, c.n_rho, c.n_delta) for i, c in ht.corr],
+                   ht.confs)
+                  for name, ht in hts.items())
+
+
+@pytest.fixture
+def jittered_onsets():
+    return list(np.cumsum(np.random.RandomState(3).normal(450, 15, 40)))
+
+
+class TestCheckpointing:
+
+    def test_resume_from_saved_state(self, jittered_onsets, tmpdir):
+        tht = tactus_hypothesis_tracker.default_tht(archive_hypotheses=True)
+        expected = tracking_values(tht(jittered_onsets))
+
+        state = tht.start(jittered_onsets)
+        for _ in range(15):
+            state.ongoing_play.advance()
+            tht._step(state)
+        filename = str(tmpdir.join('state.pkl'))
+        state.save(filename)
+
+        resumed = tactus_hypothesis_tracker.TrackingState.load(filename)
+        tht.run(resumed)
+        assert tracking_values(resumed.result()) == expected
+
+    def test_extend_finished_tracking(self, jittered_onsets):
+        tht = tactus_hypothesis_tracker.default_tht()
+        expected = tracking_values(tht(jittered_onsets))
+
+        state = tht.start(jittered_onsets[:25])
+        tht.run(state)
+        assert state.finished
+        state.resume(jittered_onsets)
+        assert not state.finished
+        tht.run(state)
+        assert tracking_values(state.result()) == expected
+        assert all(ht.onset_times is state.onset_times
+                   for ht in state.result().values())
+
+    def test_resume_requires_prefix(self, jittered_onsets):
+        state = tactus_hypothesis_tracker.TrackingState(jittered_onsets)
+        with pytest.raises(ValueError):
+            state.resume(jittered_onsets[1:])
+
+    def test_track_stopped_by_signal(self, jittered_onsets, tmpdir):
+        filename = str(tmpdir.join('state.pkl'))
+        tht = tactus_hypothesis_tracker.default_tht()
+        expected = tracking_values(tht(jittered_onsets))
+
+        def stop(snapshot):
+            if snapshot.onset_idx == 20:
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        # Observers are not part of the configuration
+        interrupted = tactus_hypothesis_tracker.default_tht(observers=[stop])
+        with pytest.raises(tactus_hypothesis_tracker.TrackingInterrupted):
+            interrupted.track(jittered_onsets, filename, checkpoint_every=7)
+        state = tactus_hypothesis_tracker.TrackingState.load(filename)
+        assert state.ongoing_play.discovered_index == 20
+
+        hts = tht.track(jittered_onsets, filename, checkpoint_every=7)
+        assert tracking_values(hts) == expected
+
+    def test_track_requires_same_configuration(self, jittered_onsets,
+                                               tmpdir):
+        filename = str(tmpdir.join('state.pkl'))
+        tht = tactus_hypothesis_tracker.default_tht()
+        tht.track(jittered_onsets[:20], filename)
+        assert (tactus_hypothesis_tracker.TrackingState.load(filename)
+                .fingerprint == tht.fingerprint())
+
+        other = tactus_hypothesis_tracker.default_tht(max_hypotheses=5)
+        with pytest.raises(ValueError):
+            other.track(jittered_onsets, filename)
+        hts = tht.track(jittered_onsets, filename)
+        assert tracking_values(hts) == tracking_values(tht(jittered_onsets))
+
+
+@pytest.fixture
+def dense_onsets():
+    rng = np.random.RandomState(1)
+    beats = np.arange(0, 12000, 430.)
+    return np.sort(np.concatenate([beats + rng.normal(0, 10, len(beats)),
+                                   beats[::2] + 215,
+                                   rng.uniform(0, 12000, 8)]))
+
+
+class TestTwoPhaseUpdate:
+
+    @pytest.mark.parametrize('max_hypotheses', [5, 30])
+    def test_same_result_as_full_update(self, dense_onsets, max_hypotheses):
+        expected = tactus_hypothesis_tracker.default_tht(
+            max_hypotheses=max_hypotheses)(dense_onsets)
+        tht = tactus_hypothesis_tracker.default_tht(
+            max_hypotheses=max_hypotheses, two_phase_update=True,
+            verify_two_phase=True)
+        assert tracking_values(tht(dense_onsets)) == tracking_values(expected)
+
+    def test_skips_evaluations(self, dense_onsets):
+        evaluations = collections.Counter()
+        eval_f = tactus_hypothesis_tracker.defaults.eval_f
+
+        class CountingEval():
+            bound = staticmethod(eval_f.bound)
+
+            def __call__(self, ht, ongoing_play):
+                evaluations[ht.name] += 1
+                return eval_f(ht, ongoing_play)
+
+        tactus_hypothesis_tracker.default_tht(
+            eval_f=CountingEval(), max_hypotheses=5)(dense_onsets)
+        full = sum(evaluations.values())
+        evaluations.clear()
+        tactus_hypothesis_tracker.default_tht(
+            eval_f=CountingEval(), max_hypotheses=5,
+            two_phase_update=True)(dense_onsets)
+        assert sum(evaluations.values()) < full
+
+    def test_bound_is_optimistic(self, dense_onsets):
+        eval_f = tactus_hypothesis_tracker.defaults.eval_f
+        ongoing_play = tactus_hypothesis_tracker.playback.OngoingPlayback(
+            dense_onsets)
+        for _ in range(20):
+            ongoing_play.advance()
+        rng = np.random.RandomState(0)
+        for _ in range(200):
+            ht = tactus_hypothesis_tracker.hypothesis.Hypothesis(
+                rng.uniform(0, 5000), rng.uniform(187.5, 1500))
+            assert eval_f(ht, ongoing_play) <= eval_f.bound(ht, ongoing_play)
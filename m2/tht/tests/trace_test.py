@@ -0,0 +1,40 @@
+import logging
+
+import numpy as np
+import pytest
+
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import trace
+
+
+@pytest.fixture
+def onsets():
+    return np.cumsum(np.random.RandomState(6).normal(400, 10, 20))
+
+
+def test_trace_rebuilds_debug_log(onsets, caplog):
+    tht = tactus_hypothesis_tracker.default_tht(max_hypotheses=5)
+    with caplog.at_level(logging.DEBUG, logger='TactusHypothesisTracker'):
+        tht(onsets)
+    expected = [r.getMessage() for r in caplog.records[1:]]
+
+    step_trace = trace.StepTrace()
+    tht = tactus_hypothesis_tracker.default_tht(max_hypotheses=5,
+                                                trace=step_trace)
+    hts = tht(onsets)
+    records = step_trace.records()
+    assert list(trace.format_trace(records)) == expected
+
+    created = records[records['event'] == trace.CREATED]
+    names = set('%d-%d' % (r['a'], r['b']) for r in created)
+    assert set(hts) <= names
+
+
+def test_trace_file_matches_memory(onsets, tmpdir):
+    filename = str(tmpdir.join('trace.bin'))
+    memory_trace = trace.StepTrace()
+    tactus_hypothesis_tracker.default_tht(trace=memory_trace)(onsets)
+    with trace.StepTrace(filename) as file_trace:
+        tactus_hypothesis_tracker.default_tht(trace=file_trace)(onsets)
+    assert (trace.read_trace(filename).tobytes() ==
+            memory_trace.records().tobytes())
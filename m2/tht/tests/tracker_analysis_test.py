@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import tracker_analysis
+
+
+@pytest.fixture
+def onsets():
+    rng = np.random.RandomState(0)
+    beats = np.arange(0, 15000, 450.)
+    return np.sort(np.concatenate([
+        beats + rng.normal(0, 10, len(beats)),
+        beats[::2] + 225 + rng.normal(0, 10, len(beats[::2])),
+        rng.uniform(0, 15000, 10)]))
+
+
+@pytest.fixture
+def tracker():
+    return tactus_hypothesis_tracker.default_tht(archive_hypotheses=True,
+                                                 archive_trimmed=True)
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'adapt_period': True, 'max_delta_bpm': 100},
+    {'avoid_quickturns': 1000},
+])
+def test_iter_beats_matches_batch_beats(onsets, tracker, options):
+    hts = tracker(onsets)
+    top_hts = tracker_analysis.top_hypothesis(hts, len(onsets))
+    batch = tracker_analysis.produce_beats_information(onsets, top_hts,
+                                                       **options)
+    incremental = list(tracker_analysis.iter_beats(onsets, tracker,
+                                                   **options))
+    assert np.array_equal(batch, incremental)
+
+
+def test_iter_beats_emits_while_tracking(onsets, tracker):
+    steps = []
+    step = tracker._step
+
+    def counting_step(state):
+        steps.append(state.ongoing_play.discovered_index)
+        step(state)
+
+    tracker._step = counting_step
+    beats = tracker_analysis.iter_beats(onsets, tracker)
+    next(beats)
+    assert len(steps) < len(onsets) // 2
+
+
+def test_iter_beats_requires_archived_hypotheses(onsets):
+    with pytest.raises(ValueError):
+        next(tracker_analysis.iter_beats(
+            onsets, tactus_hypothesis_tracker.default_tht()))
@@ -83,3 +83,34 @@ def test_conf_sorted_hats(basic_hts_mock):
     equalsToMatchers(hts_at_sorted_time[2][1],
                      [matchesHypothesisAtTime(hts=b.h1, onset_idx=3, conf=4),
                       matchesHypothesisAtTime(hts=b.h2, onset_idx=3, conf=3)])
+
+
+def hat_values(hats):
+    return [(hat.hts, hat.onset_idx, hat.corr, hat.conf) for hat in hats]
+
+
+def test_indexed_tracking_matches_overtime_tracking(basic_hts_mock):
+    b = basic_hts_mock
+    tracking = tracking_overtime.OvertimeTracking(b.hts)
+    indexed = tracking_overtime.IndexedOvertimeTracking(b.hts)
+    for (t, hats), (i_t, i_hats) in zip(tracking.hypothesis_by_time(),
+                                        indexed.hypothesis_by_time()):
+        assert t == i_t
+        assert hat_values(hats) == hat_values(i_hats)
+    for (t, hats), (i_t, i_hats) in zip(tracking.hypothesis_sorted_by_conf(),
+                                        indexed.hypothesis_sorted_by_conf()):
+        assert t == i_t
+        assert hat_values(hats) == hat_values(i_hats)
+
+
+def test_indexed_tracking_lookup_by_time(basic_hts_mock):
+    b = basic_hts_mock
+    indexed = tracking_overtime.IndexedOvertimeTracking(b.hts)
+    assert indexed.index_at(-1) == -1
+    assert indexed.index_at(250) == 2
+    assert indexed.at_time(-1) == []
+    assert hat_values(indexed.at_time(250)) == hat_values(
+        indexed.sorted_by_conf_at(2))
+    assert list(indexed.confs_at(2)) == [2, 1]
+    assert indexed.top_at(3).hts is b.h1
+    assert indexed.top_at(0) is None
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from m2.tht import similarity
+from m2.tht import tactus_hypothesis_tracker
+from m2.tht import trimming
+
+
+@pytest.fixture
+def onsets():
+    rng = np.random.RandomState(0)
+    beats = np.arange(0, 15000, 450.)
+    return np.sort(np.concatenate([
+        beats + rng.normal(0, 10, len(beats)),
+        beats[::2] + 225,
+        rng.uniform(0, 15000, 10)]))
+
+
+@pytest.mark.parametrize('config', [
+    {},
+    {'max_hypotheses': 80},
+    {'similarity_epsilon': 0.05},
+    {'sim_f': similarity.id_sim},
+])
+def test_incremental_trimming_matches_full_pass(onsets, config):
+    expected = tactus_hypothesis_tracker.default_tht(**config)(onsets)
+
+    tracker = tactus_hypothesis_tracker.default_tht(
+        trimmer=trimming.IncrementalTrimmer(verify=True), **config)
+    result = tracker(onsets)
+
+    assert sorted(result) == sorted(expected)
+    for name, ht in expected.items():
+        assert result[name].confs == ht.confs
+
+
+def test_incremental_trimming_compares_few_pairs(onsets):
+    tracker = tactus_hypothesis_tracker.default_tht(
+        trimmer=trimming.IncrementalTrimmer(), max_hypotheses=80)
+    state = tracker.start(onsets)
+    tracker.run(state)
+    # The full pass compares at least all pairs of the kept hypotheses
+    assert state.trimming.comparisons < len(onsets) * 80 ** 2 / 20
+
+
+def test_unbounded_similarity_uses_full_pass(onsets):
+    tracker = tactus_hypothesis_tracker.default_tht(
+        sim_f=similarity.proj_conf_sim,
+        trimmer=trimming.IncrementalTrimmer())
+    with pytest.warns(UserWarning):
+        state = tracker.start(onsets)
+    assert state.trimming is None
@@ -1,6 +1,9 @@
 import unittest
 import mock
 
+import numpy as np
+
+from m2.tht import hypothesis
 from m2.tht import utils
 
 class RealProjTest(unittest.TestCase):
@@ -16,3 +19,81 @@ class RealProjTest(unittest.TestCase):
         expected = [1, 2, 2, 2, 4, 4, 5]
         _, _, result = zip(*utils.real_proj(xs, to_match, matched))
         self.assertEqual(list(result), expected)
+
+
+class ProjectArraysTest(unittest.TestCase):
+
+    def test_project_arrays(self):
+        reference = [1, 2, 3, 4, 5]
+        to_match = [-2, 2.2, 2.3, 2.5, 4, 4.5, 6, 7]
+        xs = range(len(to_match))
+        expected = utils.project(xs, to_match, reference)
+        result = utils.project_arrays(xs, to_match, reference)
+        self.assertEqual(list(zip(*result)), expected)
+
+    def test_project_arrays_empty(self):
+        xs, base, matched = utils.project_arrays([], [], [1, 2])
+        self.assertEqual((len(xs), len(base), len(matched)), (0, 0, 0))
+
+
+class ProjectionFamiliesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.onsets = np.array([0, 240, 510, 760, 1000, 1270, 1500, 1740,
+                                2010, 2250, 2500])
+
+    def test_relatives_share_the_finest_lattice(self):
+        fine = hypothesis.Hypothesis(0, 250)
+        double = hypothesis.Hypothesis(500, 500)
+        triple = hypothesis.Hypothesis(250, 750)
+        other = hypothesis.Hypothesis(100, 330)
+        families = utils.ProjectionFamilies(tolerance=0)
+        families.group([triple, other, double, fine], self.onsets)
+
+        self.assertEqual(families.report(), {'roots': 2, 'shared': 2,
+                                               'rematched': 0})
+        for ht in [fine, double, triple, other]:
+            _, proj = ht.proj_arrays_in_range(self.onsets[0],
+                                              self.onsets[-1])
+            self.assertEqual(
+                families.indexes(ht, self.onsets).tolist(),
+                utils.project_indexes(proj, self.onsets).tolist())
+
+    def test_tolerance_groups_near_relatives(self):
+        fine = hypothesis.Hypothesis(0, 250)
+        near = hypothesis.Hypothesis(0.5, 500.1)
+        families = utils.ProjectionFamilies(tolerance=0)
+        families.group([fine, near], self.onsets)
+        self.assertEqual(families.report()['roots'], 2)
+
+        families = utils.ProjectionFamilies(tolerance=1)
+        families.group([fine, near], self.onsets)
+        self.assertEqual(families.report()['shared'], 1)
+        _, proj = near.proj_arrays_in_range(self.onsets[0], self.onsets[-1])
+        self.assertEqual(families.indexes(near, self.onsets).tolist(),
+                         utils.project_indexes(proj, self.onsets).tolist())
+
+    def test_projections_near_midpoints_are_matched_on_their_own(self):
+        # 375 is the midpoint of the onsets 240 and 510, the lattice point
+        # of the double hypothesis is 370 and its projection 376
+        onsets = np.array([0, 240, 510, 1000, 1500, 2000])
+        fine = hypothesis.Hypothesis(-130, 250)
+        double = hypothesis.Hypothesis(-124, 500)
+        families = utils.ProjectionFamilies(tolerance=10)
+        families.group([fine, double], onsets)
+
+        self.assertEqual(families.report(), {'roots': 1, 'shared': 1,
+                                             'rematched': 1})
+        _, proj = double.proj_arrays_in_range(onsets[0], onsets[-1])
+        self.assertEqual(families.indexes(double, onsets).tolist(),
+                         utils.project_indexes(proj, onsets).tolist())
+
+    def test_indexes_of_other_hypotheses_or_onsets(self):
+        ht = hypothesis.Hypothesis(0, 250)
+        families = utils.ProjectionFamilies()
+        families.group([ht], self.onsets)
+        self.assertIsNone(families.indexes(ht, self.onsets[1:]))
+        self.assertIsNone(families.indexes(hypothesis.Hypothesis(0, 250),
+                                           self.onsets))
+        ht.htuple = (10, 250)
+        self.assertIsNone(families.indexes(ht, self.onsets))
@@ -0,0 +1,141 @@
+'''Structured trace of the steps of a TactusHypothesisTracker run.
+
+A trace records, for each tracking step, the hypothesis trackers created,
+those trimmed by similarity (with the tracker that kept them out) and those
+dropped by score, as fixed size numeric records. Hypothesis trackers are
+identified by the onset indexes that originated them.
+
+Records are appended to an in-memory buffer or to a binary file and can be
+read back with read_trace and turned into a human readable log with
+format_trace.
+'''
+
+import struct
+from itertools import groupby
+
+import numpy as np
+
+CREATED = 1
+TRIMMED = 2
+DROPPED = 3
+STEP_END = 4
+
+MAGIC = b'THTTRACE1\n'
+
+# event, step, hypothesis onset indexes (a, b), other hypothesis onset
+# indexes (c, d) and a value
+RECORD = struct.Struct('<BIiiiid')
+RECORD_DTYPE = np.dtype([
+    ('event', '<u1'), ('step', '<u4'),
+    ('a', '<i4'), ('b', '<i4'), ('c', '<i4'), ('d', '<i4'),
+    ('value', '<f8')
+])
+
+
+class StepTrace():
+    '''
+    Collects trace records of a tracking run.
+
+    Args:
+        filename: binary file where records are written. If None, records
+            are kept in memory (see records).
+    '''
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._buffer = bytearray()
+        self._file = None
+        if filename is not None:
+            self._file = open(filename, 'wb')
+            self._file.write(MAGIC)
+
+    def _write(self, *record):
+        data = RECORD.pack(*record)
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._buffer += data
+
+    def created(self, step, hts):
+        for ht in hts:
+            a, b = ht.onset_indexes
+            self._write(CREATED, step, a, b, -1, -1, np.nan)
+
+    def trimmed(self, step, trimmed_hts):
+        'trimmed_hts :: [(trimmed_ht, kept_ht)]'
+        for ht, kept_ht in trimmed_hts:
+            a, b = ht.onset_indexes
+            c, d = kept_ht.onset_indexes
+            self._write(TRIMMED, step, a, b, c, d, np.nan)
+
+    def dropped(self, step, hts):
+        'Records dropped hts with their last confidence (NaN if none)'
+        for ht in hts:
+            a, b = ht.onset_indexes
+            self._write(DROPPED, step, a, b, -1, -1,
+                        ht.conf if ht.confs else np.nan)
+
+    def step_end(self, step, remaining):
+        self._write(STEP_END, step, remaining, -1, -1, -1, np.nan)
+
+    def records(self):
+        'Records of an in-memory trace as a RECORD_DTYPE array'
+        if self._file is not None:
+            self._file.flush()
+            return read_trace(self.filename)
+        return np.frombuffer(bytes(self._buffer), dtype=RECORD_DTYPE)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_trace(filename):
+    'Reads the records of a trace file as a RECORD_DTYPE array'
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a tht trace file'.format(filename))
+        return np.frombuffer(f.read(), dtype=RECORD_DTYPE)
+
+
+def _name(a, b):
+    return 'Hi:%d-%d' % (a, b)
+
+
+def format_trace(records, verbose=False):
+    '''
+    Rebuilds the debug log lines of a tracking run from trace records.
+
+    Args:
+        records: RECORD_DTYPE array (see StepTrace.records and read_trace)
+        verbose: whether to include the created hypotheses
+
+    Returns:
+        iterator of str
+    '''
+    for step, step_records in groupby(records, key=lambda r: r['step']):
+        step_records = list(step_records)
+
+        def of(event):
+            return [r for r in step_records if r['event'] == event]
+
+        created = of(CREATED)
+        yield 'New step. %d hypothesis created' % len(created)
+        if verbose and created:
+            yield 'Created (%d): %s' % (
+                step, [_name(r['a'], r['b']) for r in created])
+        yield 'Trimmed by similarity (%d): %s' % (
+            step, str(['(%s, %s)' % (_name(r['a'], r['b']),
+                                     _name(r['c'], r['d']))
+                       for r in of(TRIMMED)]))
+        yield 'Trimmed by score (%d): %s' % (
+            step, str([_name(r['a'], r['b']) for r in of(DROPPED)]))
+        for r in of(STEP_END):
+            yield 'End of step. %d trackers remaining' % r['a']
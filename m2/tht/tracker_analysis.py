@@ -6,10 +6,12 @@ from . import tactus_hypothesis_tracker
 import numpy as np
 from m2.tht.tactus_hypothesis_tracker import HypothesisTracker
 from m2.tht import hypothesis, playback
+from m2.tht import cache as tht_cache
 import m2.tht.defaults as tht_defaults
 from scipy.stats import spearmanr, pearsonr, norm
 import pandas as pd
 import pickle
+import collections
 
 Delta = float
 Rho = float
@@ -102,6 +104,27 @@ def tracker_dump(tracker, stream):
         print('ht conf %d %f' % (n, conf), file=stream)
 
 
+def tracking_dataframe(hts):
+    '''
+    Full evolution of the hypothesis trackers as a table with a row per
+    tracker and onset (columns a, b, onset_index, onset_time, score, phase
+    and period).
+    '''
+    return pd.DataFrame([
+        {
+            'a': tracker.onset_indexes[0],
+            'b': tracker.onset_indexes[1],
+            'onset_index': corr[0],
+            'onset_time': tracker.onset_times[corr[0]],
+            'score': conf[1],
+            'phase': corr[1].n_rho,
+            'period': corr[1].n_delta
+        }
+        for name, tracker in hts.items()
+        for corr, conf in zip(tracker.corr, tracker.confs)
+    ])
+
+
 def top_hypothesis(hts, onset_times_count):
     '''
     Given a case, returns a list of top tactus hypothesis
@@ -150,67 +173,239 @@ def produce_beats_information(onset_times, top_hts, adapt_period=False,
     Returns:
         :: [ms]
     '''
-    top_onset_idxs = [onset_idx for onset_idx, _ in top_hts]
-    onset_idxs = [0] + top_onset_idxs[1:] + [top_onset_idxs[-1]]
-    onset_limits_idx = [(onset_idxs[i], onset_idxs[i+1])
-                        for i in range(0, len(onset_idxs) - 1)]
-    onset_limits = [(onset_times[l], onset_times[r])
-                    for l, r in onset_limits_idx]
-    assert len(onset_limits) == len(top_hts)
-
+    producer = BeatProducer(onset_times, adapt_period, max_delta_bpm,
+                            adapt_phase, avoid_quickturns)
     ret = []
-    last_ht = None
-    suggested_change_ht = None
-    suggested_change_time = None
-    phase_corr = 0
-    for idx in range(len(onset_limits)):
-        onset_idx, top_ht = top_hts[idx]
-        left_limit, right_limit = onset_limits[idx]
-        iht = dict(top_ht.corr)[onset_idx].new_hypothesis()
-        if avoid_quickturns != None:
-            if last_ht == None:
-                last_ht = top_ht
-            elif (top_ht.origin_onsets() != last_ht.origin_onsets()):
+    for onset_idx, top_ht in top_hts:
+        ret.extend(producer.add(onset_idx, top_ht))
+    ret.extend(producer.finish())
+    return ret
+
+
+def _corr_at(ht, onset_idx):
+    'Correction of ht at onset_idx, None if ht was not tracked then'
+    for idx, corr in reversed(ht.corr):
+        if idx == onset_idx:
+            return corr
+        if idx < onset_idx:
+            break
+    return None
+
+
+class BeatProducer():
+    '''
+    Incremental version of produce_beats_information (see it for the
+    arguments). Top hypotheses are added in order as they are known and the
+    beats of the interval of each one are returned as soon as the next one
+    is added, which sets the end of the interval.
+    '''
+
+    def __init__(self, onset_times, adapt_period=False, max_delta_bpm=160,
+                 adapt_phase=None, avoid_quickturns=None):
+        self.onset_times = onset_times
+        self.adapt_period = adapt_period
+        self.max_delta_bpm = max_delta_bpm
+        self.adapt_phase = adapt_phase
+        self.avoid_quickturns = avoid_quickturns
+        self.last_ht = None
+        self.suggested_change_ht = None
+        self.suggested_change_time = None
+        self.phase_corr = 0
+        self._pending = None  # (left_idx, onset_idx, top_ht)
+
+    def add(self, onset_idx, top_ht):
+        '''
+        Adds the top hypothesis at onset_idx.
+
+        Returns:
+            :: [ms] beats of the interval of the previous top hypothesis
+        '''
+        ret = []
+        if self._pending is not None:
+            ret = self._beats(*self._pending, right_idx=onset_idx)
+            self._pending = (onset_idx, onset_idx, top_ht)
+        else:
+            self._pending = (0, onset_idx, top_ht)
+        return ret
+
+    def finish(self):
+        '''
+        Returns:
+            :: [ms] beats of the interval of the last top hypothesis
+        '''
+        if self._pending is None:
+            return []
+        left_idx, onset_idx, top_ht = self._pending
+        self._pending = None
+        return self._beats(left_idx, onset_idx, top_ht, right_idx=onset_idx)
+
+    def _beats(self, left_idx, onset_idx, top_ht, right_idx):
+        onset_times = self.onset_times
+        left_limit = onset_times[left_idx]
+        right_limit = onset_times[right_idx]
+        iht = _corr_at(top_ht, onset_idx).new_hypothesis()
+        if self.avoid_quickturns != None:
+            if self.last_ht == None:
+                self.last_ht = top_ht
+            elif _corr_at(self.last_ht, onset_idx) is None:
+                # The hypothesis was trimmed (only possible on results with
+                # archived hypotheses), so the top one is taken.
+                self.last_ht = top_ht
+                self.suggested_change_ht = None
+            elif (top_ht.origin_onsets() != self.last_ht.origin_onsets()):
                 current_time = onset_times[onset_idx]
-                if (suggested_change_ht == None or top_ht.origin_onsets() != suggested_change_ht.origin_onsets()):
-                    suggested_change_ht = top_ht
-                    suggested_change_time = current_time
-                    iht = dict(last_ht.corr)[onset_idx].new_hypothesis()
-                elif (suggested_change_ht.origin_onsets() == top_ht.origin_onsets() and 
-                      current_time - suggested_change_time < avoid_quickturns):
-                    iht = dict(last_ht.corr)[onset_idx].new_hypothesis()
+                if (self.suggested_change_ht == None or
+                        top_ht.origin_onsets() !=
+                        self.suggested_change_ht.origin_onsets()):
+                    self.suggested_change_ht = top_ht
+                    self.suggested_change_time = current_time
+                    iht = _corr_at(self.last_ht, onset_idx).new_hypothesis()
+                elif (self.suggested_change_ht.origin_onsets() ==
+                      top_ht.origin_onsets() and
+                      current_time - self.suggested_change_time <
+                      self.avoid_quickturns):
+                    iht = _corr_at(self.last_ht, onset_idx).new_hypothesis()
                 else:
-                    last_ht = top_ht
+                    self.last_ht = top_ht
 
-        if adapt_period:
+        if self.adapt_period:
             d = iht.d
             divisions = 0
-            while (60000 / d) > max_delta_bpm:
+            while (60000 / d) > self.max_delta_bpm:
                 divisions += 1
                 d = d * 2
-            if (adapt_phase is not None and 
-                (last_ht is None or 
-                 last_ht.origin_onsets() != top_ht.origin_onsets())):
+            if (self.adapt_phase is not None and
+                (self.last_ht is None or
+                 self.last_ht.origin_onsets() != top_ht.origin_onsets())):
                 possible_k = list(range(2 ** divisions))
-                phase_corr = max(
-                    possible_k, 
-                    key=lambda k: adapt_phase(
+                self.phase_corr = max(
+                    possible_k,
+                    key=lambda k: self.adapt_phase(
                         hypothesis.Hypothesis(iht.r + iht.d * k , d),
                         playback.Playback(onset_times[:onset_idx]))
                 )
 
-            r = iht.r + iht.d * phase_corr
+            r = iht.r + iht.d * self.phase_corr
             iht = hypothesis.Hypothesis(r, d)
         beats = np.array(iht.proj_in_range(left_limit, right_limit))
-        for beat in beats[1:]:
-            ret.append(beat)
-    return ret
+        return list(beats[1:])
+
+
+class IncrementalTopHypothesis():
+    '''
+    Determines, along a tracking with archive_hypotheses and
+    archive_trimmed, the top hypothesis that top_hypothesis gives at each
+    onset on the tracking result.
 
+    The top hypothesis at an onset is the one with the best confidence among
+    those updated on its step. Ties are broken as in top_hypothesis, by the
+    order of the trackers in the result (archived ones first, in order of
+    archiving), so a tied onset is only resolved once one of the tied
+    trackers is archived or the tracking finishes. Onsets are resolved in
+    order.
+
+    Args:
+        state: TrackingState of the tracking, before its steps
+    '''
 
-def track_beats(onset_times, tracker=tactus_hypothesis_tracker.default_tht()):
+    def __init__(self, state):
+        self.state = state
+        self._archived = 0
+        self._archive_pos = {}
+        self._pending = collections.deque()  # (onset_idx, [tied hts])
+
+    def step(self, onset_idx):
+        '''
+        Registers the step of onset_idx.
+
+        Returns:
+            :: [(onset_idx, HypothesisTracker)] newly resolved onsets
+        '''
+        archived = self.state.archived_hypotheses
+        new_archived = archived[self._archived:]
+        for pos in range(self._archived, len(archived)):
+            self._archive_pos[id(archived[pos])] = pos
+        self._archived = len(archived)
+
+        if onset_idx >= 3:
+            updated = ([ht for ht in new_archived
+                        if ht.confs and ht.confs[-1][0] == onset_idx] +
+                       self.state.hypothesis_trackers)
+            if updated:
+                best = max(ht.conf for ht in updated)
+                self._pending.append(
+                    (onset_idx, [ht for ht in updated if ht.conf == best]))
+        return self._resolve()
+
+    def finish(self):
+        '''
+        Returns:
+            :: [(onset_idx, HypothesisTracker)] remaining onsets
+        '''
+        live_pos = {id(ht): len(self._archive_pos) + pos
+                    for pos, ht in enumerate(self.state.hypothesis_trackers)}
+        return self._resolve(live_pos)
+
+    def _resolve(self, live_pos=None):
+        ret = []
+        while self._pending:
+            onset_idx, tied = self._pending[0]
+            if len(tied) > 1:
+                positions = dict(self._archive_pos, **(live_pos or {}))
+                known = [ht for ht in tied if id(ht) in positions]
+                if not known:
+                    break
+                tied = [min(known, key=lambda ht: positions[id(ht)])]
+            self._pending.popleft()
+            ret.append((onset_idx, tied[0]))
+        return ret
+
+
+def iter_beats(onset_times, tracker, adapt_period=False, max_delta_bpm=160,
+               adapt_phase=None, avoid_quickturns=None, onset_weights=None):
+    '''
+    Tracks onset_times (weighted by onset_weights, if given) yielding the
+    beats as soon as they are determined, usually one onset after the onset
+    that determines them.
+
+    The beats are the same as produce_beats_information on the top
+    hypotheses of the tracking result (see it for the arguments). The
+    tracker must archive all hypotheses (archive_hypotheses and
+    archive_trimmed): otherwise the top hypothesis at an onset depends on
+    whether the trackers are trimmed later on.
+
+    Returns:
+        iterator of ms
+    '''
+    if not (tracker.archive_hypotheses and tracker.archive_trimmed):
+        raise ValueError('Incremental beats require a tracker with '
+                         'archive_hypotheses and archive_trimmed')
+    state = tracker.start(onset_times, onset_weights=onset_weights)
+    top = IncrementalTopHypothesis(state)
+    producer = BeatProducer(state.onset_times, adapt_period, max_delta_bpm,
+                            adapt_phase, avoid_quickturns)
+    for onset_idx in tracker.steps(state):
+        for idx, top_ht in top.step(onset_idx):
+            yield from producer.add(idx, top_ht)
+    for idx, top_ht in top.finish():
+        yield from producer.add(idx, top_ht)
+    yield from producer.finish()
+
+
+def track_beats(onset_times, tracker=tactus_hypothesis_tracker.default_tht(),
+                cache=None):
     '''Generates tracked beats from onset_times by projecting to hypothesis
-    during tracking.'''
-    hts = tracker(onset_times)
+    during tracking.
+
+    The tracking result is taken from cache (a cache.ResultCache), if given,
+    or from the default cache (see cache.default_cache). Pass cache=False
+    to always track.'''
+    if cache is None:
+        cache = tht_cache.default_cache()
+    if cache:
+        hts = cache.track(tracker, onset_times)
+    else:
+        hts = tracker(onset_times)
 
     top_hts = top_hypothesis(hts, len(onset_times))
 
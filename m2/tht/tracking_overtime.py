@@ -48,16 +48,126 @@ class OvertimeTracking:
             yield (time, sorted(hats, key=lambda hat: hat.conf, reverse=True))
 
 
+class IndexedOvertimeTracking:
+    '''
+    Array backed version of OvertimeTracking indexed by onset index.
+
+    Only arrays with the (tracker, onset index, confidence) of each tracking
+    step are built on initialization. The confidence ordering at every onset
+    is computed once with a single sort and HypothesisAtTime instances are
+    created on access.
+
+    self.hts: tracking result
+    self.trackers: [HypothesisTracker], positions are used as tracker ids
+    self.onset_times: array of ms
+    self.tracker_ids, self.steps, self.onset_idxs, self.confs: arrays with an
+        entry per tracking step of each tracker; steps is the position of the
+        entry in the tracker corr and confs lists.
+    '''
+
+    def __init__(self, hts):
+        '''
+        Args:
+            hts: string -> HypothesisTracker result of a
+            TactusHypothesisTracker
+        '''
+        self.hts = hts
+        self.trackers = list(hts.values())
+        self.onset_times = np.array(sorted(self.trackers[0].onset_times))
+
+        counts = [len(ht.confs) for ht in self.trackers]
+        total = sum(counts)
+        self.tracker_ids = np.repeat(np.arange(len(self.trackers)), counts)
+        self.steps = np.concatenate(
+            [np.arange(c) for c in counts] + [np.zeros(0, dtype=int)])
+        self.onset_idxs = np.fromiter(
+            (idx for ht in self.trackers for idx, _ in ht.confs),
+            dtype=int, count=total)
+        self.confs = np.fromiter(
+            (conf for ht in self.trackers for _, conf in ht.confs),
+            dtype=float, count=total)
+
+        # Entries sorted by onset index and then by decreasing confidence.
+        # Sorts are stable, so ties keep the order of self.trackers.
+        self._by_conf = np.lexsort((-self.confs, self.onset_idxs))
+        self._by_time = np.argsort(self.onset_idxs, kind='stable')
+        self._offsets = np.searchsorted(self.onset_idxs[self._by_time],
+                                        np.arange(len(self.onset_times) + 1))
+
+    def __len__(self):
+        return len(self.onset_times)
+
+    def _hat(self, entry):
+        ht = self.trackers[self.tracker_ids[entry]]
+        onset_idx, corr = ht.corr[self.steps[entry]]
+        return HypothesisAtTime(ht, onset_idx, corr, self.confs[entry])
+
+    def _entries(self, onset_idx, order):
+        return order[self._offsets[onset_idx]:self._offsets[onset_idx + 1]]
+
+    def index_at(self, time):
+        '''
+        Index of the last onset at or before time (ms), -1 if time is
+        before the first onset. O(log n).
+        '''
+        return int(np.searchsorted(self.onset_times, time, side='right')) - 1
+
+    def confs_at(self, onset_idx):
+        'Confidences at onset_idx sorted decreasingly'
+        return self.confs[self._entries(onset_idx, self._by_conf)]
+
+    def sorted_by_conf_at(self, onset_idx):
+        'HypothesisAtTime list at onset_idx sorted by decreasing confidence'
+        return [self._hat(e) for e in self._entries(onset_idx, self._by_conf)]
+
+    def at_time(self, time):
+        '''
+        HypothesisAtTime list, sorted by decreasing confidence, at the last
+        onset at or before time (ms).
+        '''
+        onset_idx = self.index_at(time)
+        return self.sorted_by_conf_at(onset_idx) if onset_idx >= 0 else []
+
+    def top_at(self, onset_idx):
+        'HypothesisAtTime with the highest confidence at onset_idx or None'
+        entries = self._entries(onset_idx, self._by_conf)
+        return self._hat(entries[0]) if len(entries) else None
+
+    def hypothesis_by_time(self):
+        'Returns the list of HTS sorted by time'
+        for onset_idx in range(1, len(self.onset_times)):
+            entries = self._entries(onset_idx, self._by_time)
+            if len(entries):
+                yield (self.onset_times[onset_idx],
+                       [self._hat(e) for e in entries])
+
+    def hypothesis_sorted_by_conf(self):
+        'Returns the list of HTS sorted by time and then by confidence'
+        for onset_idx in range(1, len(self.onset_times)):
+            entries = self._entries(onset_idx, self._by_conf)
+            if len(entries):
+                yield (self.onset_times[onset_idx],
+                       [self._hat(e) for e in entries])
+
+
 class HypothesisAtTime:
     '''
     Class to represent a hypothesis at a given time.
+
+    The corrected hypothesis value (ht_value) is created on first access.
     '''
     def __init__(self, hts_ref, onset_idx, corr, conf):
         self.hts = hts_ref
         self.onset_idx = onset_idx
         self.corr = corr
-        self.ht_value = corr.new_hypothesis()
         self.conf = conf
+        self._ht_value = None
+
+    @property
+    def ht_value(self):
+        if self._ht_value is None:
+            self._ht_value = self.corr.new_hypothesis()
+        return self._ht_value
 
     def __repr__(self):
         return '%s (c:%.2f)' % (self.hts, self.conf)
@@ -0,0 +1,180 @@
+'''Incremental trimming of similar hypothesis trackers.
+
+The trimming of a TactusHypothesisTracker step compares every pair of
+hypotheses. With similarity functions for which two hypotheses can only be
+similar if their periods are close (relative period difference below the
+similarity epsilon, as with min_dist_sim), most pairs can be excluded by
+their periods alone, and periods change little from step to step.
+
+IncrementalTrimming keeps, for each hypothesis, a snapshot of its log period
+and the set of hypotheses whose snapshots lie within a reach of it (its
+neighbors). Only hypotheses that are new or whose period moved more than a
+tolerance from their snapshot are refreshed, and only neighbor pairs are
+compared with the similarity function. Since two hypotheses whose snapshots
+lie beyond the reach are still too far apart in period to be similar, the
+result is identical to the full pass.
+'''
+
+import math
+import warnings
+
+import numpy as np
+
+from m2.tht import similarity
+
+# Similarity functions for which similar hypotheses have a relative period
+# difference below the similarity epsilon
+PERIOD_BOUNDED = {similarity.min_dist_sim, similarity.id_sim}
+
+
+class IncrementalTrimmer():
+    '''
+    Configuration of the incremental trimming.
+
+    Args:
+        tolerance: change of log period after which a hypothesis is
+            refreshed. Defaults to half the log period band of the
+            similarity epsilon.
+        verify: whether to run the full pass on each step too, raising
+            RuntimeError if results differ
+    '''
+
+    def __init__(self, tolerance=None, verify=False):
+        self.tolerance = tolerance
+        self.verify = verify
+
+    def start(self, sim_f, similarity_epsilon):
+        '''
+        Returns the trimming state for a run, None if sim_f is not period
+        bounded (see PERIOD_BOUNDED) and the full pass must be used.
+        '''
+        if sim_f not in PERIOD_BOUNDED:
+            warnings.warn('Incremental trimming is not available for {}, '
+                          'using the full pass'.format(
+                              getattr(sim_f, '__name__', sim_f)))
+            return None
+        return IncrementalTrimming(sim_f, similarity_epsilon, self.tolerance,
+                                   self.verify)
+
+
+class IncrementalTrimming():
+    '''
+    Per run state of the incremental trimming.
+
+    Interal Variables
+        band: log period difference under which hypotheses may be similar
+        reach: log period difference between snapshots under which
+            hypotheses are neighbors
+        snapshots: hypothesis name -> log period when last refreshed
+        neighbors: hypothesis name -> set of neighbor names
+        comparisons: amount of similarity comparisons performed
+        refreshed: amount of hypothesis refreshes
+    '''
+
+    def __init__(self, sim_f, similarity_epsilon, tolerance=None,
+                 verify=False):
+        self.sim_f = sim_f
+        self.similarity_epsilon = similarity_epsilon
+        self.verify = verify
+        self.band = -math.log(1 - similarity_epsilon)
+        self.tolerance = tolerance if tolerance is not None else self.band / 2
+        # The relative margin covers rounding errors
+        self.reach = (self.band + 2 * self.tolerance) * (1 + 1e-6)
+        self.snapshots = {}
+        self.neighbors = {}
+        self.comparisons = 0
+        self.refreshed = 0
+
+    def reset(self):
+        self.snapshots = {}
+        self.neighbors = {}
+
+    def _forget(self, name):
+        del self.snapshots[name]
+        for other in self.neighbors.pop(name, ()):
+            if other in self.neighbors:
+                self.neighbors[other].discard(name)
+
+    def _refresh(self, hts, positions):
+        for name in [n for n in self.snapshots if n not in positions]:
+            self._forget(name)
+
+        log_d = np.log([ht.d for ht in hts])
+        dirty = []
+        for ht, ld in zip(hts, log_d):
+            snapshot = self.snapshots.get(ht.name)
+            if snapshot is None or abs(ld - snapshot) > self.tolerance:
+                if snapshot is not None:
+                    self._forget(ht.name)
+                self.snapshots[ht.name] = ld
+                self.neighbors[ht.name] = set()
+                dirty.append(ht.name)
+        if not dirty:
+            return
+
+        self.refreshed += len(dirty)
+        names = list(self.snapshots)
+        values = np.array([self.snapshots[n] for n in names])
+        order = np.argsort(values, kind='stable')
+        sorted_values = values[order]
+        for name in dirty:
+            value = self.snapshots[name]
+            lo = np.searchsorted(sorted_values, value - self.reach, 'left')
+            hi = np.searchsorted(sorted_values, value + self.reach, 'right')
+            for k in order[lo:hi]:
+                other = names[k]
+                if other != name:
+                    self.neighbors[name].add(other)
+                    self.neighbors[other].add(name)
+
+    def trim(self, hts, ongoing_play, full_pass):
+        '''
+        Partitions hypothesis trackers as full_pass does.
+
+        Args:
+            hts: hypothesis trackers sorted by generation
+            ongoing_play: OngoingPlayback
+            full_pass: function (hts, ongoing_play) -> (kept, trimmed), used
+                when periods are not positive and for verification
+
+        Returns:
+            (kept_hts, [(trimmed_ht, kept_ht)])
+        '''
+        if any(not ht.d > 0 for ht in hts):
+            self.reset()
+            return full_pass(hts, ongoing_play)
+
+        positions = {ht.name: idx for idx, ht in enumerate(hts)}
+        self._refresh(hts, positions)
+
+        threshold = 1 - self.similarity_epsilon
+        removed = set()
+        kept_hs = []
+        trimmed_hs_data = []
+        for idx, ht in enumerate(hts):
+            if ht.name in removed:
+                continue
+            kept_hs.append(ht)
+            later = sorted(positions[n] for n in self.neighbors[ht.name]
+                           if positions.get(n, -1) > idx and n not in removed)
+            for j in later:
+                n_ht = hts[j]
+                self.comparisons += 1
+                if self.sim_f(ht, n_ht, ongoing_play) > threshold:
+                    trimmed_hs_data.append((n_ht, ht))
+                    removed.add(n_ht.name)
+
+        if self.verify:
+            expected = full_pass(hts, ongoing_play)
+            if (expected[0] != kept_hs or
+                    [(a.name, b.name) for a, b in expected[1]] !=
+                    [(a.name, b.name) for a, b in trimmed_hs_data]):
+                raise RuntimeError(
+                    'Incremental trimming differs from the full pass at '
+                    'onset {}'.format(ongoing_play.discovered_index))
+        return kept_hs, trimmed_hs_data
+
+    def report(self):
+        'dict with the comparisons and refreshes performed'
+        return {'comparisons': self.comparisons,
+                'refreshed': self.refreshed}
@@ -1,5 +1,7 @@
 """Utils for tactus processing."""
 
+import bisect
+
 import numpy as np
 import more_itertools as mit
 
@@ -66,3 +68,362 @@ def project(xs, base, reference):
         except StopIteration:
             more_proj = False
     return ret
+
+
+def project_indexes(base, reference):
+    '''
+    Indexes of the reference values matched to base values by project, as
+    an array.
+
+    project matches each base value to its nearest reference value (the
+    first one on ties), except that its search cannot move past a repeated
+    reference value, so base values after one are matched to its first
+    occurrence. Base values after the first one matched to the last
+    reference value are not matched.
+
+    Args:
+        base: sorted np.array
+        reference: sorted np.array, not empty
+
+    Returns:
+        np.array of int, the index of the reference value of each matched
+        base value, which are a prefix of base
+    '''
+    return matched_prefix(nearest_indexes(base, reference), len(reference))
+
+
+def nearest_indexes(base, reference):
+    '''
+    Index of the reference value project matches to each base value, were
+    the matching not stopped at the last reference value (see
+    project_indexes). The index of each base value only depends on that
+    value.
+
+    Args:
+        base: np.array
+        reference: sorted np.array, not empty
+
+    Returns:
+        np.array of int
+    '''
+    idx = np.searchsorted(reference, base, side='left')
+    left = np.clip(idx - 1, 0, None)
+    right = np.clip(idx, None, len(reference) - 1)
+    nearest = np.where(np.abs(base - reference[left]) <=
+                       np.abs(reference[right] - base), left, right)
+    repeated = np.flatnonzero(reference[1:] == reference[:-1])
+    if len(repeated):
+        nearest = np.minimum(nearest, repeated[0])
+    # The first of equally near values
+    return np.searchsorted(reference, reference[nearest], side='left')
+
+
+def matched_prefix(nearest, n_reference):
+    '''
+    Prefix of the nearest_indexes of sorted base values that project
+    matches: up to the first one matched to the last of n_reference values.
+    '''
+    last = np.flatnonzero(nearest == n_reference - 1)
+    return nearest[:last[0] + 1] if len(last) else nearest
+
+
+def project_arrays(xs, base, reference):
+    '''
+    project as arrays, computed without iterating over the values.
+
+    Args:
+        xs: index associated with base
+        base: sorted values
+        reference: sorted values
+
+    Returns:
+        (xs, base, reference values) arrays of the matched pairs, as the
+        columns of the result of project
+    '''
+    xs = np.asarray(xs)
+    base = np.asarray(base, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    if len(base) == 0:
+        return xs[:0], base, reference[:0]
+    idx = project_indexes(base, reference)
+    return xs[:len(idx)], base[:len(idx)], reference[idx]
+
+
+def _distance_to_nearest(values, points):
+    'Distance of each of values to its nearest of sorted points, inf if none'
+    if len(points) == 0:
+        return np.full(len(values), np.inf)
+    idx = np.searchsorted(points, values)
+    left = points[np.clip(idx - 1, 0, None)]
+    right = points[np.clip(idx, None, len(points) - 1)]
+    return np.minimum(np.abs(values - left), np.abs(right - values))
+
+
+class ProjectionFamilies():
+    '''
+    Matching of the projections of metrically related hypotheses over a set
+    of onsets, computed once per family on the lattice of its finest
+    hypothesis.
+
+    A hypothesis (rho, delta) is a relative of a finer root (rho_r, delta_r)
+    if, for a ratio m in ratios and an integer j, each of its projections
+    rho + delta * x over the onsets lies within tolerance ms of the lattice
+    point rho_r + delta_r * (j + m * x) of the root. The lattice points of
+    each root spanned by its family are matched to the onsets once
+    (nearest_indexes) and the matches of each relative are subsampled from
+    them.
+
+    A projection is matched to another onset than its lattice point only if
+    a midpoint between adjacent onsets lies between them, so within its
+    deviation from the lattice point. The distance of each lattice point to
+    its nearest midpoint is computed along with its match, and the
+    projections that deviate at least that much are matched on their own.
+    Matches are thus always those of project_indexes over the own
+    projections of each hypothesis; the tolerance only bounds how many
+    projections may need their own matching.
+
+    Args:
+        tolerance: ms
+        ratios: integer ratios of the delta of relatives to that of their
+            root
+
+    Interal Variables
+        bounds: (first onset, last onset, amount) of the grouped onsets
+        matches: id of hypothesis -> ((rho, delta), matched onset indexes)
+        roots: amount of lattices matched
+        shared: amount of hypotheses matched through the lattice of a root
+        rematched: amount of projections of those matched on their own
+    '''
+
+    def __init__(self, tolerance=20.0, ratios=(2, 3, 4)):
+        self.tolerance = tolerance
+        self.ratios = ratios
+        self.bounds = None
+        self.matches = {}
+        self.roots = 0
+        self.shared = 0
+        self.rematched = 0
+
+    def _relation(self, root, ht, m, min_x, max_x):
+        '''
+        j of ht as a relative of root with ratio m, None if it is not one.
+        Deviations from the lattice are linear in x, so they are checked on
+        the first and last projections only.
+        '''
+        j = int(round((ht.r + ht.d * min_x - root.r) / root.d)) - m * min_x
+        deviations = [(ht.r + ht.d * x) - (root.r + root.d * (j + m * x))
+                      for x in (min_x, max_x)]
+        if max(abs(dev) for dev in deviations) <= self.tolerance:
+            return j
+        return None
+
+    def group(self, hts, onsets):
+        '''
+        Groups the hypotheses hts (with positive delta) into families and
+        matches their projections over onsets, replacing previous groups.
+
+        Args:
+            hts: hypotheses
+            onsets: sorted np.array of ms, not empty
+        '''
+        self.bounds = (onsets[0], onsets[-1], len(onsets))
+        self.matches = {}
+        families = []  # [(root, [(ht, xs, j, m)])]
+        root_deltas = []
+        for ht in sorted((ht for ht in hts if ht.d > 0),
+                         key=lambda ht: ht.d):
+            min_x, max_x = ht.proj_x_range(onsets[0], onsets[-1])
+            xs = np.arange(min_x, max_x + 1)
+            related = False
+            for m in self.ratios:
+                lo = bisect.bisect_left(root_deltas,
+                                        (ht.d - 2 * self.tolerance) / m)
+                hi = bisect.bisect_right(root_deltas,
+                                         (ht.d + 2 * self.tolerance) / m)
+                for root, members in families[lo:hi]:
+                    j = self._relation(root, ht, m, min_x, max_x)
+                    if j is not None:
+                        members.append((ht, xs, j, m))
+                        related = True
+                        break
+                if related:
+                    break
+            if not related:
+                # Roots are sorted by delta as hts are
+                families.append((ht, [(ht, xs, 0, 1)]))
+                root_deltas.append(ht.d)
+
+        midpoints = (onsets[:-1] + onsets[1:]) / 2.0
+        # Covers the rounding of midpoints and of the matching comparisons
+        margin = 1e-9 * max(abs(onsets[0]), abs(onsets[-1]), 1.0)
+        for root, members in families:
+            min_k = min(j + m * xs[0] for _, xs, j, m in members)
+            max_k = max(j + m * xs[-1] for _, xs, j, m in members)
+            lattice = root.r + root.d * np.arange(min_k, max_k + 1)
+            nearest = nearest_indexes(lattice, onsets)
+            to_midpoint = _distance_to_nearest(lattice, midpoints)
+            for ht, xs, j, m in members:
+                k = j + m * xs - min_k
+                idx = nearest[k]
+                if ht is not root:
+                    proj = ht.r + ht.d * xs
+                    own = np.flatnonzero(to_midpoint[k] <=
+                                         np.abs(proj - lattice[k]) + margin)
+                    if len(own):
+                        idx = idx.copy()
+                        idx[own] = nearest_indexes(proj[own], onsets)
+                        self.rematched += len(own)
+                self.matches[id(ht)] = ((ht.r, ht.d),
+                                        matched_prefix(idx, len(onsets)))
+            self.roots += 1
+            self.shared += len(members) - 1
+
+    def indexes(self, ht, onsets):
+        '''
+        Indexes of the onsets matched to the projections of ht over onsets,
+        as project_indexes, None if ht was not grouped over those onsets or
+        moved since.
+        '''
+        if self.bounds != (onsets[0], onsets[-1], len(onsets)):
+            return None
+        cur, idx = self.matches.get(id(ht), (None, None))
+        if cur != (ht.r, ht.d):
+            return None
+        return idx
+
+    def report(self):
+        '''
+        dict with the amount of lattices, of hypotheses sharing one and of
+        their projections matched on their own
+        '''
+        return {'roots': self.roots, 'shared': self.shared,
+                'rematched': self.rematched}
+
+
+class ProjectionHistory():
+    '''
+    Sums of per projection terms of hypothesis trackers over the whole
+    discovered playback, maintained incrementally along a tracking.
+
+    The projections of a hypothesis are matched to the discovered onsets as
+    in project. A projection is settled once no later onset can be nearer to
+    it than its match. The terms of settled projections are summed once and
+    kept, and only the rest are computed on each call, with the current
+    hypothesis. Kept terms are reused while the hypothesis has not moved the
+    settled projections more than tolerance ms since the sums were started;
+    otherwise all terms are computed again.
+
+    The kept sums of a hypothesis tracker are stored in its states, under
+    key, so they are pickled with it. Hypotheses without states (e.g. plain
+    hypothesis.Hypothesis) are summed from scratch on each call.
+
+    Args:
+        terms: function (xs, proj, matched_onsets, delta) -> (n, width)
+            array of the terms of each projection. If weights are given to
+            sums, it is given the weights of the matched onsets too, as a
+            fifth argument.
+        width: amount of terms of each projection
+        tolerance: ms
+        key: key of the sums in the hypothesis tracker states, which must
+            identify terms. Defaults to the qualified name of terms.
+
+    Interal Variables
+        full: amount of sums computed from scratch
+        incremental: amount of sums computed from kept terms
+    '''
+
+    def __init__(self, terms, width, tolerance, key=None):
+        self.terms = terms
+        self.width = width
+        self.tolerance = tolerance
+        self.key = key or '{}.{}'.format(terms.__module__,
+                                         terms.__qualname__)
+        self.full = 0
+        self.incremental = 0
+
+    def __getstate__(self):
+        return {'terms': self.terms, 'width': self.width,
+                'tolerance': self.tolerance, 'key': self.key}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _reusable(self, state, r, d, n, onsets, min_x):
+        if (state is None or state.n > n or
+                onsets[state.n - 1] != state.last or
+                state.first_x != min_x):
+            return False
+        dr, dd = r - state.rho, d - state.delta
+        return (max(abs(dr + dd * state.first_x),
+                    abs(dr + dd * (state.settled_x - 1))) <=
+                self.tolerance)
+
+    def sums(self, ht, onsets, weights=None):
+        '''
+        Sums of the terms of ht over onsets, the discovered onsets, with
+        weights, their weights, if any.
+
+        Returns:
+            (np.array of the width sums, amount of projections)
+        '''
+        r, d = ht.r, ht.d
+        n = len(onsets)
+        last = onsets[-1]
+        min_x, max_x = ht.proj_x_range(onsets[0], last)
+
+        states = getattr(ht, 'states', None)
+        state = states.get(self.key) if states is not None else None
+        if self._reusable(state, r, d, n, onsets, min_x):
+            self.incremental += 1
+        else:
+            self.full += 1
+            state = _ProjectionSums(r, d, min_x)
+            if states is not None and d > 0:
+                states[self.key] = state
+
+        xs = np.arange(state.settled_x, max_x + 1)
+        if state.sums is None:
+            state.sums = np.zeros(self.width)
+        if len(xs) == 0 or (state.match == n - 1 and
+                            state.settled_x > state.first_x):
+            # No more projections, or project already matched the last onset
+            tail = state.sums
+        else:
+            proj = r + d * xs
+            idx = state.match + project_indexes(proj, onsets[state.match:])
+            xs, proj = xs[:len(idx)], proj[:len(idx)]
+            matched = onsets[idx]
+            if weights is None:
+                terms = np.asarray(self.terms(xs, proj, matched, d))
+            else:
+                terms = np.asarray(self.terms(xs, proj, matched, d,
+                                              weights[idx]))
+
+            settled = np.abs(matched - proj) <= last - proj
+            s = len(settled) if settled.all() else int(np.argmin(settled))
+            if s:
+                state.sums = state.sums + terms[:s].sum(axis=0)
+                state.settled_x += s
+                state.match = idx[s - 1]
+            tail = state.sums + terms[s:].sum(axis=0)
+        state.n = n
+        state.last = last
+        return tail, max_x - min_x + 1
+
+    def report(self):
+        'dict with the amount of full and incremental sums'
+        return {'full': self.full, 'incremental': self.incremental}
+
+
+class _ProjectionSums():
+    'Kept sums of the settled projections of a hypothesis tracker'
+
+    def __init__(self, rho, delta, first_x):
+        self.rho = rho
+        self.delta = delta
+        self.first_x = first_x
+        self.settled_x = first_x
+        self.match = 0
+        self.sums = None
+        self.n = 0
+        self.last = None